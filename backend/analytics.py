@@ -0,0 +1,183 @@
+"""
+Partner analytics queries.
+
+Everything is aggregated in SQL with GROUP BY; Python only reshapes the
+grouped rows. Bucket and calendar expressions are chosen per dialect.
+"""
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import Integer, func, case, cast, select
+from sqlalchemy.orm import Session
+from models import Order, OrderItem, OrderStatus, Product
+
+GRANULARITIES = ("hour", "day", "week", "month")
+DIMENSIONS = ("status", "product", "heatmap", "customers")
+
+_SQLITE_BUCKETS = {
+    "hour": "%Y-%m-%dT%H:00",
+    "day": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+def _is_sqlite(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+def bucket_expr(db: Session, column, granularity: str):
+    """SQL expression that labels a timestamp with the start of its bucket as text"""
+    if _is_sqlite(db):
+        if granularity == "week":
+            # Monday of the ISO week
+            return func.date(column, "weekday 0", "-6 days")
+        return func.strftime(_SQLITE_BUCKETS[granularity], column)
+    formats = {"hour": "YYYY-MM-DD\"T\"HH24:00", "day": "YYYY-MM-DD", "week": "YYYY-MM-DD", "month": "YYYY-MM"}
+    return func.to_char(func.date_trunc(granularity, column), formats[granularity])
+
+def _hour_expr(db: Session, column):
+    if _is_sqlite(db):
+        return cast(func.strftime("%H", column), Integer)
+    return cast(func.extract("hour", column), Integer)
+
+def _weekday_expr(db: Session, column):
+    """0 = Monday ... 6 = Sunday"""
+    if _is_sqlite(db):
+        return (cast(func.strftime("%w", column), Integer) + 6) % 7
+    return cast(func.extract("isodow", column), Integer) - 1
+
+def _order_filters(partner_id: int, date_from: datetime, date_to: datetime) -> list:
+    return [
+        Order.partner_id == partner_id,
+        Order.created_at >= date_from,
+        Order.created_at < date_to,
+    ]
+
+def timeseries(db: Session, partner_id: int, date_from: datetime, date_to: datetime, granularity: str) -> List[dict]:
+    bucket = bucket_expr(db, Order.created_at, granularity).label("bucket")
+    completed = Order.status == OrderStatus.COMPLETED
+    rows = db.execute(
+        select(
+            bucket,
+            func.count(Order.id),
+            func.sum(case((completed, 1), else_=0)),
+            func.sum(case((completed, Order.total_amount), else_=0.0)),
+            func.count(func.distinct(Order.customer_id))
+        ).where(*_order_filters(partner_id, date_from, date_to)).group_by(bucket).order_by(bucket)
+    ).all()
+    return [
+        {
+            "bucket": row[0],
+            "orders": row[1],
+            "completed_orders": row[2] or 0,
+            "revenue": float(row[3] or 0.0),
+            "customers": row[4]
+        }
+        for row in rows
+    ]
+
+def by_status(db: Session, partner_id: int, date_from: datetime, date_to: datetime) -> List[dict]:
+    rows = db.execute(
+        select(Order.status, func.count(Order.id), func.sum(Order.total_amount))
+        .where(*_order_filters(partner_id, date_from, date_to))
+        .group_by(Order.status)
+    ).all()
+    return [
+        {"status": status.value, "orders": count, "amount": float(amount or 0.0)}
+        for status, count, amount in rows
+    ]
+
+def by_product(db: Session, partner_id: int, date_from: datetime, date_to: datetime) -> List[dict]:
+    quantity = func.sum(OrderItem.quantity)
+    rows = db.execute(
+        select(
+            OrderItem.product_id,
+            Product.name,
+            quantity,
+            func.sum(OrderItem.price * OrderItem.quantity),
+            func.count(func.distinct(OrderItem.order_id))
+        )
+        .join(Order, OrderItem.order_id == Order.id)
+        .outerjoin(Product, OrderItem.product_id == Product.id)
+        .where(*_order_filters(partner_id, date_from, date_to), Order.status == OrderStatus.COMPLETED)
+        .group_by(OrderItem.product_id, Product.name)
+        .order_by(quantity.desc())
+    ).all()
+    return [
+        {
+            "product_id": product_id,
+            "product_name": name,
+            "quantity": int(qty or 0),
+            "revenue": float(revenue or 0.0),
+            "orders": orders
+        }
+        for product_id, name, qty, revenue, orders in rows
+    ]
+
+def heatmap(db: Session, partner_id: int, date_from: datetime, date_to: datetime) -> List[List[int]]:
+    """7 x 24 matrix of order counts, rows are weekdays starting on Monday"""
+    weekday = _weekday_expr(db, Order.created_at).label("weekday")
+    hour = _hour_expr(db, Order.created_at).label("hour")
+    matrix = [[0] * 24 for _ in range(7)]
+    rows = db.execute(
+        select(weekday, hour, func.count(Order.id))
+        .where(*_order_filters(partner_id, date_from, date_to))
+        .group_by(weekday, hour)
+    ).all()
+    for day, hour_of_day, count in rows:
+        matrix[day][hour_of_day] = count
+    return matrix
+
+def customers(
+    db: Session, partner_id: int, date_from: datetime, date_to: datetime, granularity: str
+) -> List[dict]:
+    """Distinct customers per bucket split into first-time and returning ones"""
+    first_orders = (
+        select(Order.customer_id, func.min(Order.created_at).label("first_order_at"))
+        .where(Order.partner_id == partner_id)
+        .group_by(Order.customer_id)
+        .subquery()
+    )
+    bucket = bucket_expr(db, Order.created_at, granularity).label("bucket")
+    first_bucket = bucket_expr(db, first_orders.c.first_order_at, granularity)
+    is_new = case((first_bucket == bucket_expr(db, Order.created_at, granularity), 1), else_=0)
+    per_customer = (
+        select(bucket, Order.customer_id, is_new.label("is_new"))
+        .join(first_orders, first_orders.c.customer_id == Order.customer_id)
+        .where(*_order_filters(partner_id, date_from, date_to))
+        .group_by(bucket, Order.customer_id, first_orders.c.first_order_at)
+        .subquery()
+    )
+    rows = db.execute(
+        select(
+            per_customer.c.bucket,
+            func.sum(per_customer.c.is_new),
+            func.count(per_customer.c.customer_id)
+        ).group_by(per_customer.c.bucket).order_by(per_customer.c.bucket)
+    ).all()
+    return [
+        {"bucket": bucket_label, "new_customers": int(new or 0), "returning_customers": total - int(new or 0)}
+        for bucket_label, new, total in rows
+    ]
+
+def build_report(
+    db: Session,
+    partner_id: int,
+    date_from: datetime,
+    date_to: datetime,
+    granularity: str,
+    dimensions: Optional[List[str]] = None
+) -> dict:
+    dimensions = dimensions or []
+    report = {
+        "date_from": date_from,
+        "date_to": date_to,
+        "granularity": granularity,
+        "timeseries": timeseries(db, partner_id, date_from, date_to, granularity),
+    }
+    if "status" in dimensions:
+        report["by_status"] = by_status(db, partner_id, date_from, date_to)
+    if "product" in dimensions:
+        report["by_product"] = by_product(db, partner_id, date_from, date_to)
+    if "heatmap" in dimensions:
+        report["heatmap"] = heatmap(db, partner_id, date_from, date_to)
+    if "customers" in dimensions:
+        report["customers"] = customers(db, partner_id, date_from, date_to, granularity)
+    return report
@@ -0,0 +1,358 @@
+"""
+In-process benchmark of the key API flows.
+
+Requests go straight to the ASGI app (no sockets, no server), so the numbers
+measure the application and the database. Run it against a database seeded
+with seed_data.py and keep the JSON output as a baseline:
+
+    DATABASE_URL=sqlite:///./bench.db python seed_data.py --scale 0.1
+    DATABASE_URL=sqlite:///./bench.db python benchmark.py --out baseline.json
+    DATABASE_URL=sqlite:///./bench.db python benchmark.py --out new.json --compare baseline.json
+
+Scenarios: login, partners_list (map), storefront (partner, products,
+promotions), create_order, partner_orders, statistics and ws_fanout (order
+status updates delivered to thousands of open WebSockets through the outbox).
+Each reports p50/p90/p99 latency in milliseconds, throughput and errors.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+import httpx
+from sqlalchemy import func
+from database import SessionLocal, DATABASE_URL
+from models import User, UserType, Partner, Product, Order, OrderStatus
+from auth import create_access_token
+from seed_data import BENCH_PASSWORD, BENCH_DOMAIN
+
+SCENARIOS = ["login", "partners_list", "storefront", "create_order", "partner_orders", "statistics", "ws_fanout"]
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))]
+
+def summarize(latencies: List[float], errors: int, duration: float, operations: Optional[int] = None) -> dict:
+    values = sorted(latencies)
+    operations = len(values) if operations is None else operations
+    return {
+        "requests": operations,
+        "errors": errors,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "throughput_rps": round(operations / duration, 2) if duration else 0.0,
+        "duration_s": round(duration, 3),
+    }
+
+async def run_load(step: Callable[[int], Awaitable[bool]], requests: int, concurrency: int) -> dict:
+    """Runs step(i) for i in range(requests) with `concurrency` workers"""
+    latencies: List[float] = []
+    errors = 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            started = time.perf_counter()
+            try:
+                ok = await step(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+class ASGIWebSocket:
+    """Minimal in-process WebSocket client speaking ASGI to the app"""
+
+    def __init__(self, app, path: str, query_string: str):
+        self.app = app
+        self.path = path
+        self.query_string = query_string
+        self.to_app: asyncio.Queue = asyncio.Queue()
+        self.from_app: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "root_path": "",
+            "query_string": self.query_string.encode(), "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 0), "server": ("bench", 80), "subprotocols": [],
+        }
+        self.to_app.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(self.app(scope, self.to_app.get, self.from_app.put))
+        message = await self.from_app.get()
+        return message["type"] == "websocket.accept"
+
+    async def receive_json(self, timeout: float) -> dict:
+        while True:
+            message = await asyncio.wait_for(self.from_app.get(), timeout)
+            if message["type"] == "websocket.send":
+                return json.loads(message.get("text") or message.get("bytes"))
+            if message["type"] == "websocket.close":
+                raise ConnectionError("WebSocket closed")
+
+    async def close(self):
+        self.to_app.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        if self.task:
+            try:
+                await asyncio.wait_for(self.task, 5)
+            except Exception:
+                self.task.cancel()
+
+class Benchmark:
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://bench",
+            headers={"accept-encoding": args.accept_encoding} if args.accept_encoding else {}
+        )
+
+    def load_fixtures(self):
+        """Sample seeded partners, customers and products; tokens are issued directly"""
+        db = SessionLocal()
+        try:
+            bench_users = User.email.like(f"%@{BENCH_DOMAIN}")
+            partners = db.query(Partner.id, Partner.user_id, User.email).join(User, Partner.user_id == User.id).filter(
+                bench_users
+            ).order_by(Partner.id).all()
+            customers = db.query(User.id, User.email).filter(
+                bench_users, User.user_type == UserType.CUSTOMER
+            ).order_by(User.id).limit(self.args.sample_size * 10).all()
+            if not partners or not customers:
+                raise SystemExit("No seeded users found, run seed_data.py first")
+            self.partners = self.rng.sample(partners, min(self.args.sample_size, len(partners)))
+            self.customers = self.rng.sample(customers, min(self.args.sample_size, len(customers)))
+            partner_ids = [p.id for p in self.partners]
+            self.products: Dict[int, List[tuple]] = {}
+            for product_id, partner_id, price in db.query(Product.id, Product.partner_id, Product.price).filter(
+                Product.partner_id.in_(partner_ids), Product.is_available == True
+            ):
+                self.products.setdefault(partner_id, []).append((product_id, price or 1.0))
+            self.partners = [p for p in self.partners if p.id in self.products]
+            self.dataset = {
+                "partners": db.query(func.count(Partner.id)).scalar(),
+                "products": db.query(func.count(Product.id)).scalar(),
+                "orders": db.query(func.count(Order.id)).scalar(),
+            }
+        finally:
+            db.close()
+        expires = timedelta(hours=2)
+        self.partner_tokens = {p.id: create_access_token({"sub": p.email}, expires) for p in self.partners}
+        self.customer_tokens = [create_access_token({"sub": c.email}, expires) for c in self.customers]
+
+    def _auth(self, token: str) -> dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    def _pick_partner(self, i: int):
+        return self.partners[i % len(self.partners)]
+
+    async def login(self, i: int) -> bool:
+        email = self.customers[i % len(self.customers)].email
+        response = await self.client.post("/api/auth/login", data={"username": email, "password": BENCH_PASSWORD})
+        return response.status_code == 200
+
+    async def partners_list(self, i: int) -> bool:
+        response = await self.client.get("/api/customer/partners")
+        return response.status_code == 200
+
+    async def storefront(self, i: int) -> bool:
+        partner_id = self._pick_partner(i).id
+        responses = await asyncio.gather(
+            self.client.get(f"/api/customer/partners/{partner_id}"),
+            self.client.get("/api/customer/products", params={"partner_id": partner_id}),
+            self.client.get("/api/customer/promotions", params={"partner_id": partner_id}),
+        )
+        return all(r.status_code == 200 for r in responses)
+
+    async def create_order(self, i: int) -> bool:
+        partner_id = self._pick_partner(i).id
+        products = self.rng.sample(self.products[partner_id], min(len(self.products[partner_id]), self.rng.randint(1, 3)))
+        response = await self.client.post("/api/customer/orders", headers=self._auth(self.customer_tokens[i % len(self.customer_tokens)]), json={
+            "partner_id": partner_id,
+            "items": [{"product_id": product_id, "quantity": 1, "price": price} for product_id, price in products],
+        })
+        return response.status_code == 200
+
+    async def partner_orders(self, i: int) -> bool:
+        response = await self.client.get("/api/partner/orders", headers=self._auth(self.partner_tokens[self._pick_partner(i).id]))
+        return response.status_code == 200
+
+    async def statistics(self, i: int) -> bool:
+        response = await self.client.get("/api/partner/statistics", headers=self._auth(self.partner_tokens[self._pick_partner(i).id]))
+        return response.status_code == 200
+
+    async def ws_fanout(self) -> dict:
+        """
+        Opens --ws-sockets sockets spread over --ws-users partner accounts, then
+        changes the status of one of the partner's orders per round and measures
+        the time until every socket of that partner received the update.
+        """
+        args = self.args
+        users = self.partners[:args.ws_users]
+        db = SessionLocal()
+        try:
+            orders = {}
+            for partner in users:
+                order = db.query(Order.id).filter(Order.partner_id == partner.id).order_by(Order.id.desc()).first()
+                if order:
+                    orders[partner.id] = order.id
+        finally:
+            db.close()
+        users = [p for p in users if p.id in orders]
+        if not users:
+            return {"error": "no orders for the sampled partners"}
+
+        sockets: Dict[int, List[ASGIWebSocket]] = {p.id: [] for p in users}
+        connected = 0
+        connect_started = time.perf_counter()
+        for index in range(args.ws_sockets):
+            partner = users[index % len(users)]
+            socket = ASGIWebSocket(self.app, f"/api/ws/orders/{partner.user_id}", f"token={self.partner_tokens[partner.id]}")
+            if await socket.connect():
+                sockets[partner.id].append(socket)
+                connected += 1
+        connect_duration = time.perf_counter() - connect_started
+
+        latencies: List[float] = []
+        errors = 0
+        statuses = [OrderStatus.IN_PROCESS.value, OrderStatus.READY.value]
+        started = time.perf_counter()
+        for round_index in range(args.ws_rounds):
+            partner = users[round_index % len(users)]
+            sent_at = time.perf_counter()
+            response = await self.client.put(
+                f"/api/partner/orders/{orders[partner.id]}",
+                headers=self._auth(self.partner_tokens[partner.id]),
+                json={"status": statuses[round_index % 2]},
+            )
+            if response.status_code != 200:
+                errors += len(sockets[partner.id])
+                continue
+
+            async def delivered(socket: ASGIWebSocket) -> Optional[float]:
+                try:
+                    while True:
+                        message = await socket.receive_json(args.ws_timeout)
+                        if message.get("type") == "order_update":
+                            return time.perf_counter() - sent_at
+                except Exception:
+                    return None
+
+            for latency in await asyncio.gather(*(delivered(s) for s in sockets[partner.id])):
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+        result = summarize(latencies, errors, time.perf_counter() - started, operations=len(latencies) + errors)
+        result["sockets"] = connected
+        result["connect_rate_per_s"] = round(connected / connect_duration, 2) if connect_duration else 0.0
+
+        await asyncio.gather(*(s.close() for group in sockets.values() for s in group))
+        return result
+
+    async def run(self) -> dict:
+        await self.app.router.startup()
+        try:
+            self.load_fixtures()
+            results = {}
+            for name in self.args.scenarios:
+                print(f"  {name}...", flush=True)
+                if name == "ws_fanout":
+                    results[name] = await self.ws_fanout()
+                    continue
+                step = getattr(self, name)
+                requests = self.args.requests if name != "login" else min(self.args.requests, self.args.login_requests)
+                await run_load(step, min(self.args.warmup, requests), self.args.concurrency)
+                results[name] = await run_load(step, requests, self.args.concurrency)
+            return results
+        finally:
+            await self.client.aclose()
+            await self.app.router.shutdown()
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def compare(current: dict, baseline: dict):
+    """Prints latency and throughput changes per scenario against a previous run"""
+    print(f"{'scenario':<16}{'p50 ms':>20}{'p99 ms':>20}{'rps':>20}")
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous or "p50_ms" not in result or "p50_ms" not in previous:
+            continue
+        cells = []
+        for key in ("p50_ms", "p99_ms", "throughput_rps"):
+            old, new = previous[key], result[key]
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            cells.append(f"{new:>10.2f} {change:>8}")
+        print(f"{name:<16}" + "".join(f"{cell:>20}" for cell in cells))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process and write a JSON report")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--login-requests", type=int, default=100, help="Password hashing is slow on purpose")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--sample-size", type=int, default=200, help="Partners and customers to draw requests from")
+    parser.add_argument("--accept-encoding", default="br, gzip", help="Sent with every request; empty to disable")
+    parser.add_argument("--ws-sockets", type=int, default=2000)
+    parser.add_argument("--ws-users", type=int, default=20, help="Partner accounts the sockets are spread over")
+    parser.add_argument("--ws-rounds", type=int, default=40)
+    parser.add_argument("--ws-timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Imported late so --help and argument errors do not load the whole application
+    from main import app
+    benchmark = Benchmark(app, args)
+    scenarios = asyncio.run(benchmark.run())
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_revision": _git_revision(),
+            "database": DATABASE_URL.split("://")[0],
+            "python": platform.python_version(),
+            "dataset": benchmark.dataset,
+            "args": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        },
+        "scenarios": scenarios,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
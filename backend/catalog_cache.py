@@ -0,0 +1,69 @@
+"""
+Cache of rendered customer catalog responses (partners, products, promotions).
+
+Bodies are stored precompressed, so repeated requests cost neither a query nor
+a compression pass. Partner writes call invalidate(); entries also expire after
+CATALOG_CACHE_TTL seconds, which bounds staleness across worker processes.
+At most CATALOG_CACHE_MAX_ENTRIES bodies are kept, least recently used go first.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+from compression import PrecompressedBody
+
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "5000"))
+
+# (kind, partner_id or None for all partners) -> (expires_at, body), least recently used first
+_cache: "OrderedDict[Tuple[str, Optional[int]], Tuple[float, PrecompressedBody]]" = OrderedDict()
+_lock = threading.Lock()
+
+def get(kind: str, partner_id: Optional[int] = None) -> Optional[PrecompressedBody]:
+    key = (kind, partner_id)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        expires_at, body = entry
+        if expires_at < time.monotonic():
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return body
+
+def put(kind: str, partner_id: Optional[int], body: bytes, ttl: Optional[float] = None) -> PrecompressedBody:
+    ttl = CATALOG_CACHE_TTL if ttl is None else min(ttl, CATALOG_CACHE_TTL)
+    entry = PrecompressedBody(body)
+    now = time.monotonic()
+    with _lock:
+        _cache[(kind, partner_id)] = (now + ttl, entry)
+        _cache.move_to_end((kind, partner_id))
+        # Expired entries at the cold end go first, then whatever exceeds the bound
+        while _cache:
+            oldest_key, (expires_at, _) = next(iter(_cache.items()))
+            if expires_at >= now and len(_cache) <= CATALOG_CACHE_MAX_ENTRIES:
+                break
+            del _cache[oldest_key]
+    return entry
+
+def get_or_render(kind: str, partner_id: Optional[int], render: Callable[[], Tuple[bytes, Optional[float]]]) -> PrecompressedBody:
+    """render() returns the body and an optional shorter TTL; a TTL of 0 means the body is not cached"""
+    body = get(kind, partner_id)
+    if body is None:
+        rendered, ttl = render()
+        if ttl is not None and ttl <= 0:
+            return PrecompressedBody(rendered)
+        body = put(kind, partner_id, rendered, ttl)
+    return body
+
+def invalidate(partner_id: int):
+    """Drop the partner's entries and the cross-partner lists that include it"""
+    with _lock:
+        for key in [key for key in _cache if key[1] in (partner_id, None)]:
+            del _cache[key]
+
+def clear():
+    with _lock:
+        _cache.clear()
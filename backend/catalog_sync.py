@@ -0,0 +1,85 @@
+"""
+Delta sync of the customer catalog (partners, products, promotions, partner images).
+
+A client calls /api/customer/catalog/changes without `since` once to get the
+whole catalog and a token, then passes the token back to receive only rows
+created or updated since (by updated_at) and the ids of rows deleted since
+(catalog_tombstones). Rows are returned as-is, including unavailable products
+and inactive or expired promotions, so the client can drop them from its copy.
+
+The token is a database clock reading minus CATALOG_SYNC_OVERLAP seconds: a
+write transaction that started before the reading but committed after it is
+still picked up by the next sync. Clients upsert by id, so the few repeated
+rows are harmless. Tokens older than the tombstone retention get a full reset.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from models import Partner, Product, Promotion, PartnerImage, CatalogTombstone
+from fast_json import partner_projection, product_projection, promotion_projection, partner_image_projection
+
+CATALOG_SYNC_OVERLAP = float(os.getenv("CATALOG_SYNC_OVERLAP_SECONDS", "10"))
+CATALOG_TOMBSTONE_RETENTION_DAYS = int(os.getenv("CATALOG_TOMBSTONE_RETENTION_DAYS", "30"))
+
+# Response key -> (model, projection, partner column)
+ENTITIES = {
+    "partners": (Partner, partner_projection, Partner.id),
+    "products": (Product, product_projection, Product.partner_id),
+    "promotions": (Promotion, promotion_projection, Promotion.partner_id),
+    "partner_images": (PartnerImage, partner_image_projection, PartnerImage.partner_id),
+}
+ENTITY_BY_MODEL = {model: name for name, (model, _, _) in ENTITIES.items()}
+
+EPOCH = datetime(1970, 1, 1)
+
+def naive_utc(moment: datetime) -> datetime:
+    """Timestamps are stored as naive UTC; convert a value with an offset to that"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def encode_token(moment: datetime) -> str:
+    return str((naive_utc(moment) - EPOCH) // timedelta(microseconds=1))
+
+def decode_token(token: str) -> datetime:
+    """Raises ValueError for a malformed token"""
+    micros = int(token)
+    if micros < 0:
+        raise ValueError("negative token")
+    return EPOCH + timedelta(microseconds=micros)
+
+def record_deleted(db: Session, row):
+    """Add a tombstone for a deleted catalog row; committed with the caller's transaction"""
+    partner_id = row.id if isinstance(row, Partner) else row.partner_id
+    db.add(CatalogTombstone(entity=ENTITY_BY_MODEL[type(row)], entity_id=row.id, partner_id=partner_id))
+    # Expired tombstones are pruned on write; the delete is served by the deleted_at index
+    cutoff = datetime.utcnow() - timedelta(days=CATALOG_TOMBSTONE_RETENTION_DAYS)
+    db.query(CatalogTombstone).filter(CatalogTombstone.deleted_at < cutoff).delete(synchronize_session=False)
+
+def changes(db: Session, since: Optional[datetime], partner_id: Optional[int] = None) -> dict:
+    """Catalog rows changed since `since` (everything when None), deletions and the next token"""
+    now = naive_utc(db.execute(select(func.now())).scalar())
+    retention_start = now - timedelta(days=CATALOG_TOMBSTONE_RETENTION_DAYS)
+    reset = since is None or since < retention_start
+
+    result = {"token": encode_token(now - timedelta(seconds=CATALOG_SYNC_OVERLAP)), "reset": reset}
+    for name, (model, projection, partner_column) in ENTITIES.items():
+        query = db.query(model)
+        if not reset:
+            query = query.filter(model.updated_at >= since)
+        if partner_id:
+            query = query.filter(partner_column == partner_id)
+        result[name] = projection.all(query.order_by(model.id))
+
+    deleted = {name: [] for name in ENTITIES}
+    if not reset:
+        query = db.query(CatalogTombstone.entity, CatalogTombstone.entity_id).filter(CatalogTombstone.deleted_at >= since)
+        if partner_id:
+            query = query.filter(CatalogTombstone.partner_id == partner_id)
+        for entity, entity_id in query.order_by(CatalogTombstone.id):
+            if entity in deleted:
+                deleted[entity].append(entity_id)
+    result["deleted"] = deleted
+    return result
@@ -0,0 +1,210 @@
+"""
+Response compression.
+
+CompressionMiddleware negotiates Brotli or gzip from Accept-Encoding and
+compresses compressible responses (JSON, text, CSV, NDJSON) above a minimum
+size, including streamed ones. Routes can opt out or use their own threshold
+via ROUTE_MIN_SIZES; WebSockets are never touched.
+
+Cacheable payloads are compressed once with PrecompressedBody and served by
+precompressed_response(); responses that already carry Content-Encoding are
+passed through by the middleware.
+"""
+import gzip
+import hashlib
+import os
+import zlib
+from typing import List, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))  # on the fly: speed over ratio
+PRECOMPRESS_BROTLI_QUALITY = int(os.getenv("PRECOMPRESS_BROTLI_QUALITY", "9"))
+
+# Path prefix -> minimum size in bytes, None disables compression for the route
+ROUTE_MIN_SIZES: List[Tuple[str, Optional[int]]] = [
+    ("/api/uploads/", None),  # images are already compressed
+    ("/api/ws/", None),
+]
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript", "application/xml",
+    "text/", "image/svg+xml",
+)
+
+def route_min_size(path: str) -> Optional[int]:
+    for prefix, min_size in ROUTE_MIN_SIZES:
+        if path.startswith(prefix):
+            return min_size
+    return COMPRESSION_MIN_SIZE
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Supported encoding with the highest q the client gives, br before gzip on a tie"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    wildcard = accepted.get("*", 0.0)
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    best = None
+    for encoding in supported:
+        quality = accepted.get(encoding, wildcard)
+        if quality > 0 and (best is None or quality > accepted.get(best, wildcard)):
+            best = encoding
+    return best
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+class _Compressor:
+    """Incremental compressor for streamed bodies"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        """Compressed data for a chunk, flushed so streamed responses reach the client promptly"""
+        if self._brotli:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self._brotli:
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL if level is None else level, mtime=0)
+
+def _weak_etag(headers: MutableHeaders):
+    # The compressed representation differs byte-wise from the identity one
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["etag"] = f"W/{etag}"
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        min_size = route_min_size(scope["path"])
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding")) if min_size is not None else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressingResponder(self.app, encoding, min_size)(scope, receive, send)
+
+class _CompressingResponder:
+    def __init__(self, app, encoding: str, min_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.min_size = min_size
+        self.send = None
+        self.start_message = None
+        self.passthrough = False
+        self.compressor: Optional[_Compressor] = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_with_compression)
+
+    async def send_with_compression(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or "content-range" in headers
+                or message["status"] in (204, 206, 304)
+                or not is_compressible(headers.get("content-type"))
+            )
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            # First body chunk decides: small complete bodies go out as they are
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            if not more_body and len(body) < self.min_size:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            headers["content-encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            _weak_etag(headers)
+            if not more_body:
+                compressed = compress(body, self.encoding)
+                headers["content-length"] = str(len(compressed))
+                await self.send(start)
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            del headers["content-length"]
+            self.compressor = _Compressor(self.encoding)
+            await self.send(start)
+
+        data = self.compressor.compress(body) if body else b""
+        if not more_body:
+            data += self.compressor.finish()
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+class PrecompressedBody:
+    """A rendered payload kept in identity, gzip and (when available) Brotli form"""
+
+    def __init__(self, body: bytes, media_type: str = "application/json"):
+        self.media_type = media_type
+        # Weak: the same tag stands for every encoding of the payload
+        self.etag = 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.encodings = {"identity": body}
+        if len(body) >= COMPRESSION_MIN_SIZE:
+            self.encodings["gzip"] = compress(body, "gzip", 9)
+            if brotli is not None:
+                self.encodings["br"] = compress(body, "br", PRECOMPRESS_BROTLI_QUALITY)
+
+def precompressed_response(request: Request, body: PrecompressedBody, cache_control: Optional[str] = None) -> Response:
+    headers = {"etag": body.etag, "vary": "Accept-Encoding"}
+    if cache_control:
+        headers["cache-control"] = cache_control
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and body.etag.removeprefix("W/") in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding in body.encodings:
+        headers["content-encoding"] = encoding
+        return Response(content=body.encodings[encoding], media_type=body.media_type, headers=headers)
+    return Response(content=body.encodings["identity"], media_type=body.media_type, headers=headers)
@@ -0,0 +1,66 @@
+"""
+Schema versioning with Alembic (migrations/ and alembic.ini).
+
+Migrations are applied once per deploy with `python migrate_db.py` (or
+`alembic upgrade head`). Application workers only run check_schema() at
+startup: one read of alembic_version compared with the head revision of the
+scripts, so booting a worker takes no schema lock and runs no DDL.
+"""
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+from database import engine
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+# Escape hatch for one-off scripts against a database that is mid-migration
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "1").lower() not in ("0", "false", "no")
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+def alembic_config() -> Config:
+    config = Config(str(BACKEND_DIR / "alembic.ini"))
+    # Independent of the working directory the app was started from
+    config.set_main_option("script_location", str(BACKEND_DIR / "migrations"))
+    # Keep the application's logging setup when called from code
+    config.attributes["configure_logger"] = False
+    return config
+
+def head_revisions() -> Tuple[str, ...]:
+    return tuple(ScriptDirectory.from_config(alembic_config()).get_heads())
+
+def current_revisions() -> Tuple[str, ...]:
+    with engine.connect() as conn:
+        return tuple(MigrationContext.configure(conn).get_current_heads())
+
+def is_unversioned_legacy() -> bool:
+    """Tables created by the old create_all startup, without alembic_version"""
+    tables = set(inspect(engine).get_table_names())
+    return "alembic_version" not in tables and "users" in tables
+
+def check_schema():
+    """Startup preflight: refuse to serve on a database that is not at head"""
+    if not SCHEMA_CHECK:
+        return
+    current, heads = current_revisions(), head_revisions()
+    if set(current) == set(heads):
+        return
+    if not current and is_unversioned_legacy():
+        hint = "The database predates migrations; run `python migrate_db.py` to baseline and upgrade it."
+    else:
+        hint = "Run `python migrate_db.py` (or `alembic upgrade head`)."
+    raise SchemaOutOfDate(
+        f"Database schema is at {', '.join(current) or 'no revision'}, application expects {', '.join(heads)}. {hint}"
+    )
+
+def upgrade(revision: str = "head"):
+    command.upgrade(alembic_config(), revision)
+
+def stamp(revision: str):
+    command.stamp(alembic_config(), revision)
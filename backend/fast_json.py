@@ -0,0 +1,136 @@
+"""
+Fast JSON path for large list responses.
+
+FastJSONResponse is the application's default response class (orjson instead of
+the stdlib json). The projection helpers below build plain dicts straight from
+selected columns for the hot list endpoints, skipping ORM object loading and
+per-row Pydantic validation. Keys, key order and value types follow the
+matching *Response schema, so the output is the same as before.
+"""
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Type
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from models import Partner, Product, Promotion, PartnerImage, Order, OrderItem
+from schemas import PartnerResponse, ProductResponse, PromotionResponse, PartnerImageResponse, OrderResponse, OrderItemResponse
+from order_queue import OPEN_STATUSES, now_like, tracker
+
+# SQLite allows at most 999 bound parameters per statement
+IN_CHUNK_SIZE = 500
+
+def dumps(content) -> bytes:
+    # UTC as "Z" like Pydantic does
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+class Projection:
+    """Selects the schema's fields as columns of `model` and turns rows into dicts"""
+
+    def __init__(self, schema: Type[BaseModel], model):
+        self.fields = list(schema.model_fields)
+        self.columns = [getattr(model, name) for name in self.fields]
+        # Float columns may hold integers (SQLite); the schema would turn them into floats
+        self.float_fields = [
+            index for index, name in enumerate(self.fields)
+            if schema.model_fields[name].annotation in (float, Optional[float])
+        ]
+
+    def to_dict(self, row) -> dict:
+        values = list(row)
+        for index in self.float_fields:
+            if values[index] is not None:
+                values[index] = float(values[index])
+        return dict(zip(self.fields, values))
+
+    def all(self, query) -> List[dict]:
+        return [self.to_dict(row) for row in query.with_entities(*self.columns)]
+
+partner_projection = Projection(PartnerResponse, Partner)
+product_projection = Projection(ProductResponse, Product)
+promotion_projection = Projection(PromotionResponse, Promotion)
+partner_image_projection = Projection(PartnerImageResponse, PartnerImage)
+
+ORDER_FIELDS = [name for name in OrderResponse.model_fields if name not in ("estimated_ready_at", "orders_ahead", "items", "partner")]
+ORDER_ITEM_FIELDS = [name for name in OrderItemResponse.model_fields if name != "product"]
+PRODUCT_ID_INDEX = product_projection.fields.index("id")
+
+def _chunks(values: List[int]) -> Iterable[List[int]]:
+    for start in range(0, len(values), IN_CHUNK_SIZE):
+        yield values[start:start + IN_CHUNK_SIZE]
+
+def _queue_positions(db: Session, orders) -> Dict[int, tuple]:
+    """order id -> (orders ahead, open orders of its partner) for the open orders in `orders`"""
+    partner_ids = list({order.partner_id for order in orders if order.status in OPEN_STATUSES})
+    queues: Dict[int, List[int]] = {partner_id: [] for partner_id in partner_ids}
+    for chunk in _chunks(partner_ids):
+        rows = db.query(Order.partner_id, Order.id).filter(
+            Order.partner_id.in_(chunk), Order.status.in_(OPEN_STATUSES)
+        ).order_by(Order.id)
+        for partner_id, order_id in rows:
+            queues[partner_id].append(order_id)
+    positions = {}
+    for partner_id, order_ids in queues.items():
+        for ahead, order_id in enumerate(order_ids):
+            positions[order_id] = (ahead, len(order_ids))
+    return positions
+
+def _estimated_ready_at(order, ahead: int, open_orders: int):
+    """
+    A partner with L open orders and an average time to ready of W finishes about
+    L / W orders per second (Little's law), so the order is ready after the ones
+    ahead of it and itself: (ahead + 1) * W / L from now.
+    """
+    average = tracker.snapshot(order.partner_id)["average_ready_seconds"]
+    return now_like(order.created_at) + timedelta(seconds=(ahead + 1) * average / open_orders)
+
+def order_dicts(db: Session, query) -> List[dict]:
+    """
+    OrderResponse dicts for the orders matched by `query` (in its order), loaded
+    with three flat queries: orders, items outer joined with products, partners.
+    """
+    orders = query.with_entities(*(getattr(Order, name) for name in ORDER_FIELDS)).all()
+    if not orders:
+        return []
+
+    order_ids = [order.id for order in orders]
+    items: Dict[int, List[dict]] = {order_id: [] for order_id in order_ids}
+    item_columns = [getattr(OrderItem, name) for name in ORDER_ITEM_FIELDS]
+    product_offset = len(item_columns)
+    for chunk in _chunks(order_ids):
+        # Outer join: items of products deleted since the order keep their row, with a null product
+        rows = db.query(OrderItem.order_id, *item_columns, *product_projection.columns).outerjoin(
+            Product, OrderItem.product_id == Product.id
+        ).filter(OrderItem.order_id.in_(chunk)).order_by(OrderItem.id)
+        for row in rows:
+            item = dict(zip(ORDER_ITEM_FIELDS, row[1:product_offset + 1]))
+            item["price"] = float(item["price"])
+            product = row[product_offset + 1:]
+            item["product"] = product_projection.to_dict(product) if product[PRODUCT_ID_INDEX] is not None else None
+            items[row[0]].append(item)
+
+    partner_ids = list({order.partner_id for order in orders})
+    partners = {}
+    for chunk in _chunks(partner_ids):
+        for partner in partner_projection.all(db.query(Partner).filter(Partner.id.in_(chunk))):
+            partners[partner["id"]] = partner
+
+    positions = _queue_positions(db, orders)
+    result = []
+    for order in orders:
+        data = dict(zip(ORDER_FIELDS, order))
+        data["status"] = order.status.value
+        data["total_amount"] = float(order.total_amount)
+        data["estimated_ready_at"] = data["orders_ahead"] = None
+        if order.id in positions and order.created_at:
+            ahead, open_orders = positions[order.id]
+            data["estimated_ready_at"] = _estimated_ready_at(order, ahead, open_orders)
+            data["orders_ahead"] = ahead
+        data["items"] = items[order.id]
+        data["partner"] = partners[order.partner_id]
+        result.append(data)
+    return result
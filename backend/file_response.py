@@ -0,0 +1,152 @@
+"""
+File responses with HTTP caching validators, conditional requests, single
+byte ranges and zero-copy sends (ASGI "http.response.zerocopysend" extension)
+when the server offers it.
+"""
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Mapping, Optional, Tuple
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 64 * 1024
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" range into inclusive (start, end).
+    Returns None for syntax we don't serve (the full file is sent instead)
+    and raises ValueError if the range can't be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or first == last == "" or not all(part == "" or part.isdigit() for part in (first, last)):
+        return None
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else None
+    if end is not None and start > end:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+class RangeFileResponse(Response):
+    def __init__(
+        self,
+        path: Path,
+        stat_result: os.stat_result,
+        start: int,
+        end: int,
+        status_code: int,
+        headers: Mapping[str, str],
+        media_type: str,
+        send_body: bool = True
+    ):
+        self.path = path
+        self.start = start
+        self.length = end - start + 1 if stat_result.st_size else 0
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        self.send_body = send_body
+        self.init_headers(headers)
+        self.headers["content-length"] = str(self.length)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or not self.length:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file.fileno(),
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                # File shrank underneath us; end the response rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+async def file_response(
+    request: Request,
+    path: Path,
+    cache_control: str,
+    etag: Optional[str] = None,
+    headers: Optional[Mapping[str, str]] = None
+) -> Response:
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    size = stat_result.st_size
+    etag = etag or f'"{stat_result.st_mtime_ns:x}-{size:x}"'
+    validators = {
+        "etag": etag,
+        "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "cache-control": cache_control,
+        **(headers or {}),
+    }
+    
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and _etag_matches(if_none_match, etag)) or (
+        not if_none_match and if_modified_since and _not_modified_since(if_modified_since, stat_result.st_mtime)
+    ):
+        return Response(status_code=304, headers=validators)
+    
+    media_type = guess_type(path.name)[0] or "application/octet-stream"
+    response_headers = {**validators, "accept-ranges": "bytes"}
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, validators["last-modified"])):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**response_headers, "content-range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            response_headers["content-range"] = f"bytes {start}-{end}/{size}"
+    
+    return RangeFileResponse(
+        path, stat_result, start, end, status_code, response_headers, media_type,
+        send_body=request.method != "HEAD"
+    )
@@ -0,0 +1,120 @@
+"""
+Resized WebP/JPEG derivatives of uploaded images.
+
+Variants are generated in a process pool after the upload has been stored,
+so resizing never runs on the request path. Until they exist the original
+file is served instead.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+VARIANT_WIDTHS = (160, 320, 640, 1280)
+VARIANTS_SUBDIR = "variants"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# format -> (Pillow format name, save options)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def variant_name(filename: str, width: int, fmt: str) -> str:
+    return f"{Path(filename).stem}_w{width}.{fmt}"
+
+def generate_variants(source: str, variants_dir: str) -> List[str]:
+    """Runs in a worker process. Never upscales: widths above the original are skipped."""
+    from PIL import Image, ImageOps
+    
+    created = []
+    os.makedirs(variants_dir, exist_ok=True)
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        for width in VARIANT_WIDTHS:
+            if width >= image.width:
+                break
+            resized = image.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            for fmt, (pil_format, options) in VARIANT_FORMATS.items():
+                converted = resized
+                if pil_format == "JPEG" and resized.mode != "RGB":
+                    converted = resized.convert("RGB")
+                elif resized.mode not in ("RGB", "RGBA"):
+                    converted = resized.convert("RGBA")
+                name = variant_name(source, width, fmt)
+                temp_path = os.path.join(variants_dir, f".{name}.part")
+                converted.save(temp_path, pil_format, **options)
+                os.replace(temp_path, os.path.join(variants_dir, name))
+                created.append(name)
+    return created
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that runs an event loop and threads is unsafe
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _log_result(future: Future):
+    error = future.exception()
+    if error:
+        logging.error(f"Image variant generation failed: {error}")
+
+def schedule_variants(source: Path, variants_dir: Path) -> Future:
+    """Queue variant generation and return immediately"""
+    future = _get_executor().submit(generate_variants, str(Path(source).resolve()), str(Path(variants_dir).resolve()))
+    future.add_done_callback(_log_result)
+    return future
+
+def schedule_remote_variants(storage, source: Path, key_prefix: str, remove_source: bool = False) -> Future:
+    """
+    For backends without local files: resize a local copy into a temp directory,
+    then upload the results next to the original under key_prefix.
+    """
+    work_dir = tempfile.mkdtemp(prefix="variants-")
+    future = _get_executor().submit(generate_variants, str(Path(source).resolve()), work_dir)
+    
+    def upload_results(done: Future):
+        try:
+            if done.exception() is None:
+                for name in done.result():
+                    storage.save_file(Path(work_dir) / name, f"{key_prefix}{name}")
+        except Exception as e:
+            logging.error(f"Image variant upload failed: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if remove_source:
+                source.unlink(missing_ok=True)
+    
+    future.add_done_callback(_log_result)
+    future.add_done_callback(upload_results)
+    return future
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def variant_urls(url: str) -> Dict[str, str]:
+    """Size-negotiated URLs for an uploaded file, keyed by width"""
+    return {str(width): f"{url}?w={width}" for width in VARIANT_WIDTHS}
+
+def pick_variant(filename: str, width: int, accept: str, exists: Callable[[str], bool]) -> Optional[str]:
+    """
+    Name of the smallest existing variant at least `width` wide, WebP when the client accepts it.
+    None means the original should be served (it is smaller than any matching variant).
+    """
+    fmt = "webp" if "image/webp" in (accept or "") else "jpg"
+    for candidate in (w for w in VARIANT_WIDTHS if w >= width):
+        name = variant_name(filename, candidate, fmt)
+        if exists(name):
+            return name
+    return None
@@ -1,12 +1,24 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from database import engine, Base
 from routers import auth, customer, partner, websocket, uploads
+import outbox
+import image_variants
+import upload_gc
+from fast_json import FastJSONResponse
+from compression import CompressionMiddleware
+import metrics
+import db_migrations
+import query_recorder
+from order_queue import rebuild_tracker
+import map_index
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+app = FastAPI(title="GoiEat API", version="1.0.0", default_response_class=FastJSONResponse)
 
-app = FastAPI(title="GoiEat API", version="1.0.0")
+# Innermost: caps image upload bodies before the multipart form is parsed
+app.add_middleware(uploads.UploadSizeLimitMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -17,6 +29,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/Brotli for JSON and text responses
+app.add_middleware(CompressionMiddleware)
+# Dev mode: warn about repeated statements (N+1) and oversized requests
+if query_recorder.QUERY_DEBUG:
+    app.add_middleware(query_recorder.QueryDebugMiddleware)
+# Outermost, so latency includes compression
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.register_connection_manager(websocket.manager)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(customer.router)
@@ -24,6 +45,24 @@ app.include_router(partner.router)
 app.include_router(websocket.router)
 app.include_router(uploads.router)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    # Schema is migrated by migrate_db.py before deploy; workers only verify the revision
+    await run_in_threadpool(db_migrations.check_schema)
+    await run_in_threadpool(rebuild_tracker)
+    await run_in_threadpool(map_index.rebuild_index)
+    app.state.outbox_task = asyncio.create_task(outbox.run_dispatcher())
+    app.state.upload_gc_task = None
+    if upload_gc.UPLOAD_GC_INTERVAL > 0:
+        app.state.upload_gc_task = asyncio.create_task(upload_gc.run_periodic())
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    app.state.outbox_task.cancel()
+    if app.state.upload_gc_task:
+        app.state.upload_gc_task.cancel()
+    image_variants.shutdown()
+
 @app.get("/")
 def root():
     return {"message": "GoiEat API"}
@@ -32,3 +71,7 @@ def root():
 def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
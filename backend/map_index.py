@@ -0,0 +1,236 @@
+"""
+Hierarchical grid index of partner locations for map clustering.
+
+Partners are projected to Web Mercator like map tiles. Every zoom level from 0
+to MAP_CLUSTER_MAX_ZOOM has a grid of MAP_CLUSTER_CELLS_PER_TILE x
+MAP_CLUSTER_CELLS_PER_TILE cells per tile, and each cell of level z is split
+into 4 cells of level z + 1. A cell keeps its partner count, the sum of their
+projected coordinates (for the centroid) and a few representative partner ids
+taken from its children, so moving one partner touches one cell per level.
+
+The index is built on startup, updated in place by register_partner and
+update_profile, and picks up partners changed by other worker processes from
+partners.updated_at every MAP_INDEX_REFRESH_SECONDS. Deleted partners leave no
+updated_at behind, so the refresh also drops ids that are no longer in the table.
+"""
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import Partner
+
+MAP_CLUSTER_MAX_ZOOM = int(os.getenv("MAP_CLUSTER_MAX_ZOOM", "18"))
+# 4 cells per 256px tile: a cluster covers about 64x64 screen pixels
+MAP_CLUSTER_CELLS_PER_TILE = int(os.getenv("MAP_CLUSTER_CELLS_PER_TILE", "4"))
+MAP_CLUSTER_REPRESENTATIVES = int(os.getenv("MAP_CLUSTER_REPRESENTATIVES", "3"))
+MAP_INDEX_REFRESH_SECONDS = float(os.getenv("MAP_INDEX_REFRESH_SECONDS", "30"))
+
+MAX_LATITUDE = 85.05112878  # Web Mercator limit
+
+CellKey = Tuple[int, int]
+
+def project(latitude: float, longitude: float) -> Tuple[float, float]:
+    """Latitude/longitude to Web Mercator x, y in [0, 1], y grows southwards"""
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = (longitude + 180) / 360
+    sin = math.sin(math.radians(latitude))
+    y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0), min(max(y, 0.0), 1.0)
+
+def unproject(x: float, y: float) -> Tuple[float, float]:
+    longitude = x * 360 - 180
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return latitude, longitude
+
+def _cells_per_side(zoom: int) -> int:
+    return MAP_CLUSTER_CELLS_PER_TILE << zoom
+
+def _cell(x: float, y: float, zoom: int) -> CellKey:
+    side = _cells_per_side(zoom)
+    return min(int(x * side), side - 1), min(int(y * side), side - 1)
+
+class Cell:
+    __slots__ = ("count", "x_sum", "y_sum", "representatives")
+
+    def __init__(self):
+        self.count = 0
+        self.x_sum = 0.0
+        self.y_sum = 0.0
+        self.representatives: List[int] = []
+
+def _merge_children(finer: Dict[CellKey, Cell], key: CellKey) -> List[int]:
+    """Representatives of a cell from those of its 4 cells on the next level"""
+    cx, cy = key
+    children = (finer.get((2 * cx + i, 2 * cy + j)) for i in (0, 1) for j in (0, 1))
+    return heapq.nsmallest(
+        MAP_CLUSTER_REPRESENTATIVES,
+        itertools.chain.from_iterable(child.representatives for child in children if child)
+    )
+
+class GridIndex:
+    def __init__(self):
+        self._levels: List[Dict[CellKey, Cell]] = [{} for _ in range(MAP_CLUSTER_MAX_ZOOM + 1)]
+        # Partner ids per cell of the finest level
+        self._members: Dict[CellKey, set] = {}
+        self._positions: Dict[int, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        # Latest partners.updated_at seen, and when to look for newer rows
+        self._synced_until: Optional[datetime] = None
+        self._next_refresh = 0.0
+
+    def _add(self, partner_id: int, x: float, y: float):
+        for zoom, level in enumerate(self._levels):
+            key = _cell(x, y, zoom)
+            cell = level.get(key)
+            if cell is None:
+                cell = level[key] = Cell()
+            cell.count += 1
+            cell.x_sum += x
+            cell.y_sum += y
+        self._members.setdefault(_cell(x, y, MAP_CLUSTER_MAX_ZOOM), set()).add(partner_id)
+        self._positions[partner_id] = (x, y)
+
+    def _remove(self, partner_id: int):
+        x, y = self._positions.pop(partner_id)
+        leaf = _cell(x, y, MAP_CLUSTER_MAX_ZOOM)
+        self._members[leaf].discard(partner_id)
+        if not self._members[leaf]:
+            del self._members[leaf]
+        for zoom, level in enumerate(self._levels):
+            key = _cell(x, y, zoom)
+            cell = level[key]
+            cell.count -= 1
+            if not cell.count:
+                del level[key]
+            else:
+                cell.x_sum -= x
+                cell.y_sum -= y
+        return x, y
+
+    def _update_representatives(self, x: float, y: float):
+        """Recompute the representatives along the path of (x, y), finest level first"""
+        key = _cell(x, y, MAP_CLUSTER_MAX_ZOOM)
+        cell = self._levels[MAP_CLUSTER_MAX_ZOOM].get(key)
+        if cell is not None:
+            cell.representatives = heapq.nsmallest(MAP_CLUSTER_REPRESENTATIVES, self._members[key])
+        for zoom in range(MAP_CLUSTER_MAX_ZOOM - 1, -1, -1):
+            cx, cy = _cell(x, y, zoom)
+            cell = self._levels[zoom].get((cx, cy))
+            if cell is None:
+                continue
+            cell.representatives = _merge_children(self._levels[zoom + 1], (cx, cy))
+
+    def _upsert(self, partner_id: int, latitude: float, longitude: float):
+        x, y = project(latitude, longitude)
+        old = self._positions.get(partner_id)
+        if old == (x, y):
+            return
+        if old is not None:
+            self._remove(partner_id)
+            self._update_representatives(*old)
+        self._add(partner_id, x, y)
+        self._update_representatives(x, y)
+
+    def upsert(self, partner_id: int, latitude: float, longitude: float):
+        """Add a partner or move it; a no-op when the position did not change"""
+        with self._lock:
+            self._upsert(partner_id, latitude, longitude)
+
+    def _discard(self, partner_id: int):
+        if partner_id in self._positions:
+            self._update_representatives(*self._remove(partner_id))
+
+    def remove(self, partner_id: int):
+        with self._lock:
+            self._discard(partner_id)
+
+    def clusters(self, south: float, west: float, north: float, east: float, zoom: int) -> List[dict]:
+        """Clusters of the cells intersecting the bounding box; west > east crosses the antimeridian"""
+        zoom = max(0, min(MAP_CLUSTER_MAX_ZOOM, zoom))
+        x_min, y_min = _cell(*project(north, west), zoom)
+        x_max, y_max = _cell(*project(south, east), zoom)
+        x_ranges = [(x_min, x_max)] if west <= east else [(x_min, _cells_per_side(zoom) - 1), (0, x_max)]
+
+        result = []
+        with self._lock:
+            level = self._levels[zoom]
+            area = sum(high - low + 1 for low, high in x_ranges) * (y_max - y_min + 1)
+            if area <= len(level):
+                keys = (
+                    (cx, cy) for low, high in x_ranges for cx in range(low, high + 1) for cy in range(y_min, y_max + 1)
+                )
+                cells = ((key, level.get(key)) for key in keys)
+            else:
+                # Large box: scanning the occupied cells is cheaper than enumerating the grid
+                cells = (
+                    (key, cell) for key, cell in level.items()
+                    if y_min <= key[1] <= y_max and any(low <= key[0] <= high for low, high in x_ranges)
+                )
+            for key, cell in cells:
+                if cell is None:
+                    continue
+                latitude, longitude = unproject(cell.x_sum / cell.count, cell.y_sum / cell.count)
+                result.append({
+                    "latitude": round(latitude, 6),
+                    "longitude": round(longitude, 6),
+                    "count": cell.count,
+                    "partner_ids": list(cell.representatives),
+                })
+        return result
+
+    def rebuild(self, db: Session):
+        fresh = GridIndex()
+        rows = db.query(Partner.id, Partner.latitude, Partner.longitude, Partner.updated_at).yield_per(1000)
+        for partner_id, latitude, longitude, updated_at in rows:
+            if latitude is not None and longitude is not None:
+                fresh._add(partner_id, *project(latitude, longitude))
+            if updated_at and (fresh._synced_until is None or updated_at > fresh._synced_until):
+                fresh._synced_until = updated_at
+        # Representatives of all cells at once, finest level first
+        for key, cell in fresh._levels[MAP_CLUSTER_MAX_ZOOM].items():
+            cell.representatives = heapq.nsmallest(MAP_CLUSTER_REPRESENTATIVES, fresh._members[key])
+        for zoom in range(MAP_CLUSTER_MAX_ZOOM - 1, -1, -1):
+            finer = fresh._levels[zoom + 1]
+            for key, cell in fresh._levels[zoom].items():
+                cell.representatives = _merge_children(finer, key)
+        with self._lock:
+            self._levels, self._members, self._positions = fresh._levels, fresh._members, fresh._positions
+            self._synced_until = fresh._synced_until
+            self._next_refresh = time.monotonic() + MAP_INDEX_REFRESH_SECONDS
+
+    def refresh(self, db: Session):
+        """Apply partners changed since the last refresh, at most once per MAP_INDEX_REFRESH_SECONDS"""
+        with self._lock:
+            if time.monotonic() < self._next_refresh:
+                return
+            self._next_refresh = time.monotonic() + MAP_INDEX_REFRESH_SECONDS
+            since = self._synced_until
+        query = db.query(Partner.id, Partner.latitude, Partner.longitude, Partner.updated_at)
+        if since is not None:
+            # >= so rows written within the same timestamp are not missed; upserts are idempotent
+            query = query.filter(Partner.updated_at >= since)
+        rows = query.all()
+        existing = {partner_id for (partner_id,) in db.query(Partner.id)}
+        with self._lock:
+            for partner_id in [p for p in self._positions if p not in existing]:
+                self._discard(partner_id)
+            for partner_id, latitude, longitude, updated_at in rows:
+                if latitude is not None and longitude is not None:
+                    self._upsert(partner_id, latitude, longitude)
+                if updated_at and (self._synced_until is None or updated_at > self._synced_until):
+                    self._synced_until = updated_at
+
+index = GridIndex()
+
+def rebuild_index():
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        index.rebuild(db)
+    finally:
+        db.close()
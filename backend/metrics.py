@@ -0,0 +1,220 @@
+"""
+Application metrics in Prometheus text format, served at /metrics.
+
+MetricsMiddleware records per-route request counts, latency and in-flight
+requests; SQLAlchemy engine events count and time the statements each request
+runs; WebSocket gauges are read from the ConnectionManager at scrape time.
+Recording is a dict lookup and an addition under a lock, so the hot path stays
+cheap. Routes are labelled with their path template (/api/partner/orders/{order_id}),
+never the raw path, to keep the number of series bounded.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from database import engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+QUERY_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [("", _format_labels(self.labelnames, labels), value) for labels, value in values]
+
+class Gauge(Metric):
+    """Either set directly or computed by `callback` at scrape time"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._callback = callback
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def samples(self):
+        if self._callback is not None:
+            return [("", "", float(self._callback()))]
+        with self._lock:
+            values = list(self._values.items())
+        return [("", _format_labels(self.labelnames, labels), value) for labels, value in values]
+
+class CounterFunction(Gauge):
+    """Monotonic value owned by another object, read at scrape time"""
+    type_name = "counter"
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, labels: tuple = ()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        result = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                result.append(("_bucket", _format_labels(names, labels + (le,)), cumulative))
+            plain = _format_labels(self.labelnames, labels)
+            result.append(("_count", plain, cumulative))
+            result.append(("_sum", plain, total))
+        return result
+
+REGISTRY: List[Metric] = []
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being processed")
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements executed per HTTP request", ("method", "route"), QUERY_COUNT_BUCKETS
+)
+REQUEST_QUERY_TIME = Counter("http_request_db_seconds_total", "Time spent in SQL statements by route", ("method", "route"))
+QUERY_LATENCY = Histogram("db_query_duration_seconds", "SQL statement latency", (), QUERY_LATENCY_BUCKETS)
+
+def register_connection_manager(manager):
+    """WebSocket gauges, read from the manager only when /metrics is scraped"""
+    Gauge("websocket_connections", "Open WebSocket connections",
+          callback=lambda: sum(len(sockets) for sockets in list(manager.active_connections.values())))
+    Gauge("websocket_users", "Users with at least one open WebSocket", callback=lambda: len(manager.active_connections))
+    Gauge("websocket_load_viewers", "Open partner load WebSockets",
+          callback=lambda: sum(len(sockets) for sockets in list(manager.viewers.values())))
+    CounterFunction("websocket_send_failures_total", "WebSocket messages that could not be sent",
+                    callback=lambda: manager.send_failures)
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+# SQL statements of the current request: [count, seconds]. The list is shared
+# with the threadpool workers running sync endpoints (they copy the context).
+_request_queries: ContextVar[Optional[list]] = ContextVar("request_queries", default=None)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    QUERY_LATENCY.observe(elapsed)
+    stats = _request_queries.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Callable, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        label = self._routes.get(endpoint)
+        if label is None:
+            label = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    label = route.path
+                    break
+            self._routes[endpoint] = label
+        return label
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        queries = [0, 0.0]
+        token = _request_queries.set(queries)
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            _request_queries.reset(token)
+            method = scope["method"]
+            route = self._route_label(scope)
+            REQUESTS.inc((method, route, str(status_code)))
+            REQUEST_LATENCY.observe(elapsed, (method, route))
+            REQUEST_QUERIES.observe(queries[0], (method, route))
+            REQUEST_QUERY_TIME.inc((method, route), queries[1])
@@ -1,44 +1,130 @@
 """
 Script to migrate database schema
-Run this script to update the database with new columns
+Run this script before starting the app: it applies Alembic migrations up to head.
+Databases created before migrations existed (tables made by create_all, no
+alembic_version table) are first brought up to the initial revision and stamped.
 """
-from database import engine, Base
+from database import engine, Base, SessionLocal
 from models import *
-import sqlite3
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import text, inspect, Float
+import sys
+import db_migrations
+import stats_rollup
+
+# Revision that matches the schema create_all produced before migrations;
+# later revisions skip the tables and indexes such a database already has
+BASELINE_REVISION = "0001"
 
 def migrate_database():
     """Add new columns to existing products table"""
-    conn = sqlite3.connect('goieat.db')
-    cursor = conn.cursor()
-    
-    try:
-        # Check if columns exist
-        cursor.execute("PRAGMA table_info(products)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
+    columns = [column["name"] for column in inspect(engine).get_columns("products")]
+    float_type = Float().compile(dialect=engine.dialect)
+    with engine.begin() as conn:
         # Add original_price if it doesn't exist
         if 'original_price' not in columns:
-            cursor.execute("ALTER TABLE products ADD COLUMN original_price REAL")
+            conn.execute(text(f"ALTER TABLE products ADD COLUMN original_price {float_type}"))
             print("Added original_price column")
         
         # Add discount_percent if it doesn't exist
         if 'discount_percent' not in columns:
-            cursor.execute("ALTER TABLE products ADD COLUMN discount_percent REAL")
+            conn.execute(text(f"ALTER TABLE products ADD COLUMN discount_percent {float_type}"))
             print("Added discount_percent column")
-        
-        # Make price nullable
-        # SQLite doesn't support ALTER COLUMN, so we need to recreate the table
-        # For now, we'll just add the columns and update existing products
-        # Existing products will have price set, which is fine
-        
-        conn.commit()
-        print("Database migration completed successfully")
-    except Exception as e:
-        print(f"Migration error: {e}")
-        conn.rollback()
+    
+    # Make price nullable
+    # SQLite doesn't support ALTER COLUMN, so we need to recreate the table
+    # For now, we'll just add the columns and update existing products
+    # Existing products will have price set, which is fine
+    print("Legacy column migration completed")
+
+# Hot path queries and the index each one must use (SQLite EXPLAIN QUERY PLAN)
+QUERY_PLAN_CHECKS = [
+    ("partner orders list",
+     "SELECT * FROM orders WHERE partner_id = 1 ORDER BY created_at DESC",
+     "ix_orders_partner_id_created_at"),
+    ("partner statistics by status",
+     "SELECT count(*) FROM orders WHERE partner_id = 1 AND status = 'COMPLETED'",
+     "ix_orders_partner_id_status"),
+    ("customer orders list",
+     "SELECT * FROM orders WHERE customer_id = 1 ORDER BY created_at DESC",
+     "ix_orders_customer_id_created_at"),
+    ("order items of an order",
+     "SELECT * FROM order_items WHERE order_id = 1",
+     "ix_order_items_order_id"),
+    ("order items of a product",
+     "SELECT * FROM order_items WHERE product_id = 1",
+     "ix_order_items_product_id"),
+    ("partner products",
+     "SELECT * FROM products WHERE partner_id = 1",
+     "ix_products_partner_id_is_available"),
+    ("partner active promotions",
+     "SELECT count(*) FROM promotions WHERE partner_id = 1 AND is_active = 1",
+     "ix_promotions_partner_id_is_active"),
+    ("partner images",
+     "SELECT * FROM partner_images WHERE partner_id = 1 ORDER BY created_at DESC",
+     "ix_partner_images_partner_id_created_at"),
+    ("analytics range",
+     "SELECT count(*) FROM orders WHERE partner_id = 1 AND created_at >= '2024-01-01' AND created_at < '2025-01-01'",
+     "ix_orders_partner_id_created_at"),
+]
+
+def check_query_plans() -> bool:
+    """Regression check: every hot path query must be served by its index"""
+    if engine.dialect.name != "sqlite":
+        print("Query plan check is only implemented for SQLite")
+        return True
+    ok = True
+    with engine.connect() as conn:
+        for name, sql, expected_index in QUERY_PLAN_CHECKS:
+            plan = " | ".join(row[3] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+            if expected_index in plan:
+                print(f"OK    {name}: {plan}")
+            else:
+                ok = False
+                print(f"FAIL  {name}: expected {expected_index}, got: {plan}")
+    return ok
+
+def backfill_rollups():
+    """Fill the statistics rollups of a baselined database from its existing orders"""
+    db = SessionLocal()
+    try:
+        if db.query(Order.id).first() and not db.query(PartnerDailyStats.id).first():
+            stats_rollup.rebuild(db)
+            print("Statistics rollups rebuilt from existing orders")
     finally:
-        conn.close()
+        db.close()
+
+def schema_differences() -> list:
+    """Differences between the database and models.py, as reported by autogenerate"""
+    with engine.connect() as conn:
+        context = MigrationContext.configure(conn, opts={"compare_type": True})
+        return compare_metadata(context, Base.metadata)
+
+def check_models() -> bool:
+    differences = schema_differences()
+    for difference in differences:
+        print(f"DIFF  {difference}")
+    if not differences:
+        print("Database schema matches models.py")
+    return not differences
+
+def migrate():
+    """Baseline a pre-migrations database if needed, then upgrade to head"""
+    legacy = db_migrations.is_unversioned_legacy()
+    if legacy:
+        print(f"Unversioned database, bringing it to revision {BASELINE_REVISION}")
+        migrate_database()
+        db_migrations.stamp(BASELINE_REVISION)
+    db_migrations.upgrade()
+    if legacy:
+        backfill_rollups()
+    print(f"Database is at revision {', '.join(db_migrations.current_revisions())}")
 
 if __name__ == "__main__":
-    migrate_database()
+    if "--check-plans" in sys.argv:
+        sys.exit(0 if check_query_plans() else 1)
+    if "--check-models" in sys.argv:
+        sys.exit(0 if check_models() else 1)
+    migrate()
 
@@ -0,0 +1,44 @@
+"""
+Alembic environment. Uses the application's engine and models metadata, so
+DATABASE_URL is the only setting. SQLite migrations run in batch mode (ALTER
+through table copy), since SQLite cannot alter or drop columns in place.
+"""
+from logging.config import fileConfig
+from alembic import context
+from database import engine, Base, DATABASE_URL
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+def run_migrations_offline():
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=DATABASE_URL.startswith("sqlite"),
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
+            # One transaction per revision: a revision can leave it with
+            # op.get_context().autocommit_block() to build an index CONCURRENTLY
+            transaction_per_migration=True,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
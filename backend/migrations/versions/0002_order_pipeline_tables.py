@@ -0,0 +1,255 @@
+"""order pipeline tables and indexes
+
+Tables and hot path indexes added after the initial schema: the outbox, order
+status history, statistics rollups and stored uploads. Databases baselined from
+create_all may already have some of them, so existing tables and indexes are
+skipped; migrate_db.py backfills the rollups afterwards.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 17:15:02.118734
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ORDER_STATUSES = ('IN_QUEUE', 'IN_PROCESS', 'READY', 'COMPLETED', 'CANCELLED')
+# order_status_changes reuses the type created with orders (PostgreSQL would fail on a second CREATE TYPE)
+existing_order_status = sa.Enum(*ORDER_STATUSES, name='orderstatus').with_variant(
+    postgresql.ENUM(*ORDER_STATUSES, name='orderstatus', create_type=False), 'postgresql'
+)
+
+
+# Indexes on tables that already hold production data
+HOT_PATH_INDEXES = [
+    ('orders', 'ix_orders_customer_id_created_at', ['customer_id', 'created_at']),
+    ('orders', 'ix_orders_partner_id_created_at', ['partner_id', 'created_at']),
+    ('orders', 'ix_orders_partner_id_status', ['partner_id', 'status']),
+    ('orders', 'ix_orders_updated_at', ['updated_at']),
+    ('partner_images', 'ix_partner_images_partner_id_created_at', ['partner_id', 'created_at']),
+    ('products', 'ix_products_partner_id_is_available', ['partner_id', 'is_available']),
+    ('promotions', 'ix_promotions_partner_id_is_active', ['partner_id', 'is_active']),
+    ('order_items', 'ix_order_items_order_id', ['order_id']),
+    ('order_items', 'ix_order_items_product_id', ['product_id']),
+]
+
+
+def _create_index(table: str, name: str, columns: list) -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY keeps the table writable while the index builds; it cannot
+        # run in a transaction. A failed build leaves an INVALID index behind that
+        # has to be dropped by hand before the migration is retried.
+        with op.get_context().autocommit_block():
+            op.create_index(op.f(name), table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_index(batch_op.f(name), columns, unique=False)
+
+
+def _drop_index(table: str, name: str) -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index(op.f(name), table_name=table, postgresql_concurrently=True)
+    else:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(name))
+
+
+def _name_unique_constraint(inspector, table: str, column: str) -> None:
+    """create_all without a naming convention left the constraint unnamed (SQLite) or named by the database"""
+    name = f'uq_{table}_{column}'
+    for constraint in inspector.get_unique_constraints(table):
+        if constraint['column_names'] != [column] or constraint['name'] == name:
+            continue
+        if op.get_bind().dialect.name == 'sqlite':
+            # The copied table gets the reflected constraint named by the convention
+            with op.batch_alter_table(table, recreate='always', naming_convention={'uq': 'uq_%(table_name)s_%(column_0_name)s'}):
+                pass
+        else:
+            op.drop_constraint(constraint['name'], table, type_='unique')
+            op.create_unique_constraint(name, table, [column])
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    _name_unique_constraint(inspector, 'orders', 'qr_code')
+    _name_unique_constraint(inspector, 'partners', 'user_id')
+
+    if 'outbox_events' not in tables:
+        op.create_table('outbox_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('event_type', sa.String(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('recipients', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('delivered_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_outbox_events'))
+        )
+        with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_outbox_events_delivered_at'), ['delivered_at'], unique=False)
+            batch_op.create_index(batch_op.f('ix_outbox_events_id'), ['id'], unique=False)
+
+    if 'stored_uploads' not in tables:
+        op.create_table('stored_uploads',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.Column('extension', sa.String(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_stored_uploads'))
+        )
+        with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_stored_uploads_content_hash'), ['content_hash'], unique=True)
+            batch_op.create_index(batch_op.f('ix_stored_uploads_id'), ['id'], unique=False)
+
+    if 'partner_daily_customers' not in tables:
+        op.create_table('partner_daily_customers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('partner_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('customer_id', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['customer_id'], ['users.id'], name=op.f('fk_partner_daily_customers_customer_id_users')),
+        sa.ForeignKeyConstraint(['partner_id'], ['partners.id'], name=op.f('fk_partner_daily_customers_partner_id_partners')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_partner_daily_customers')),
+        sa.UniqueConstraint('partner_id', 'day', 'customer_id', name=op.f('uq_partner_daily_customers_partner_id_day_customer_id'))
+        )
+        with op.batch_alter_table('partner_daily_customers', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_partner_daily_customers_id'), ['id'], unique=False)
+
+    if 'partner_daily_stats' not in tables:
+        op.create_table('partner_daily_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('partner_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.Column('completed_orders', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+        sa.Column('customers', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['partner_id'], ['partners.id'], name=op.f('fk_partner_daily_stats_partner_id_partners')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_partner_daily_stats')),
+        sa.UniqueConstraint('partner_id', 'day', name=op.f('uq_partner_daily_stats_partner_id_day'))
+        )
+        with op.batch_alter_table('partner_daily_stats', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_partner_daily_stats_id'), ['id'], unique=False)
+
+    if 'order_status_changes' not in tables:
+        op.create_table('order_status_changes',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('partner_id', sa.Integer(), nullable=False),
+        sa.Column('status', existing_order_status, nullable=False),
+        sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id'], name=op.f('fk_order_status_changes_order_id_orders')),
+        sa.ForeignKeyConstraint(['partner_id'], ['partners.id'], name=op.f('fk_order_status_changes_partner_id_partners')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_order_status_changes'))
+        )
+        with op.batch_alter_table('order_status_changes', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_order_status_changes_id'), ['id'], unique=False)
+            batch_op.create_index(batch_op.f('ix_order_status_changes_order_id'), ['order_id'], unique=False)
+            batch_op.create_index('ix_order_status_changes_status_changed_at', ['status', 'changed_at'], unique=False)
+
+    if 'partner_daily_product_stats' not in tables:
+        op.create_table('partner_daily_product_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('partner_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['partner_id'], ['partners.id'], name=op.f('fk_partner_daily_product_stats_partner_id_partners')),
+        sa.ForeignKeyConstraint(['product_id'], ['products.id'], name=op.f('fk_partner_daily_product_stats_product_id_products')),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_partner_daily_product_stats')),
+        sa.UniqueConstraint('partner_id', 'day', 'product_id', name=op.f('uq_partner_daily_product_stats_partner_id_day_product_id'))
+        )
+        with op.batch_alter_table('partner_daily_product_stats', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_partner_daily_product_stats_id'), ['id'], unique=False)
+
+
+    for table, name, columns in HOT_PATH_INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            _create_index(table, name, columns)
+
+
+def downgrade() -> None:
+    for table, name, columns in reversed(HOT_PATH_INDEXES):
+        _drop_index(table, name)
+
+    with op.batch_alter_table('partner_daily_product_stats', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_partner_daily_product_stats_id'), ['id'], unique=False)
+
+
+    for table, name, columns in HOT_PATH_INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            _create_index(table, name, columns)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('order_items', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_items_product_id')
+        batch_op.drop_index('ix_order_items_order_id')
+
+    with op.batch_alter_table('promotions', schema=None) as batch_op:
+        batch_op.drop_index('ix_promotions_partner_id_is_active')
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_index('ix_products_partner_id_is_available')
+
+    with op.batch_alter_table('partner_images', schema=None) as batch_op:
+        batch_op.drop_index('ix_partner_images_partner_id_created_at')
+
+    with op.batch_alter_table('orders', schema=None) as batch_op:
+        batch_op.drop_index('ix_orders_updated_at')
+        batch_op.drop_index('ix_orders_partner_id_status')
+        batch_op.drop_index('ix_orders_partner_id_created_at')
+        batch_op.drop_index('ix_orders_customer_id_created_at')
+
+    with op.batch_alter_table('partner_daily_product_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_partner_daily_product_stats_id'))
+
+    op.drop_table('partner_daily_product_stats')
+
+    with op.batch_alter_table('order_status_changes', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_status_changes_status_changed_at')
+        batch_op.drop_index(batch_op.f('ix_order_status_changes_order_id'))
+        batch_op.drop_index(batch_op.f('ix_order_status_changes_id'))
+
+    op.drop_table('order_status_changes')
+
+    with op.batch_alter_table('partner_daily_stats', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_partner_daily_stats_id'))
+
+    op.drop_table('partner_daily_stats')
+
+    with op.batch_alter_table('partner_daily_customers', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_partner_daily_customers_id'))
+
+    op.drop_table('partner_daily_customers')
+
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stored_uploads_id'))
+        batch_op.drop_index(batch_op.f('ix_stored_uploads_content_hash'))
+
+    op.drop_table('stored_uploads')
+
+    with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_outbox_events_id'))
+        batch_op.drop_index(batch_op.f('ix_outbox_events_delivered_at'))
+
+    op.drop_table('outbox_events')
@@ -0,0 +1,63 @@
+"""catalog updated_at and tombstones
+
+updated_at on partners, products, promotions and partner_images, plus the
+catalog_tombstones table, for the customer catalog delta sync.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 17:17:38.495981
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CATALOG_TABLES = ('partners', 'products', 'promotions', 'partner_images')
+
+
+def upgrade() -> None:
+    op.create_table('catalog_tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('partner_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_catalog_tombstones'))
+    )
+    with op.batch_alter_table('catalog_tombstones', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_catalog_tombstones_deleted_at'), ['deleted_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_catalog_tombstones_id'), ['id'], unique=False)
+
+    for table in CATALOG_TABLES:
+        # SQLite cannot ADD COLUMN with a non-constant default: add it bare,
+        # backfill existing rows, then set the default (batch mode copies the table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+        op.execute(f"UPDATE {table} SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)")
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(
+                'updated_at', existing_type=sa.DateTime(timezone=True), existing_nullable=True,
+                server_default=sa.func.now()
+            )
+            batch_op.create_index(batch_op.f(f'ix_{table}_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    for table in reversed(CATALOG_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_updated_at'))
+            batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('catalog_tombstones', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_catalog_tombstones_id'))
+        batch_op.drop_index(batch_op.f('ix_catalog_tombstones_deleted_at'))
+
+    op.drop_table('catalog_tombstones')
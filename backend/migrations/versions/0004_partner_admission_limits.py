@@ -0,0 +1,33 @@
+"""partner admission limits
+
+Per-partner max_open_orders and max_orders_per_window for order admission
+control; NULL means the server defaults apply.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 19:02:11.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('partners', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('max_open_orders', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('max_orders_per_window', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('partners', schema=None) as batch_op:
+        batch_op.drop_column('max_orders_per_window')
+        batch_op.drop_column('max_open_orders')
@@ -0,0 +1,39 @@
+"""stored upload last_uploaded_at
+
+When an upload last handed out a stored file, deduplicated uploads included;
+the upload GC grace period counts from it instead of the file time.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-20 10:12:41.530217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Same steps as the catalog updated_at columns: SQLite cannot add a column
+    # with a non-constant default, so it is added bare, backfilled, then altered
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_uploaded_at', sa.DateTime(timezone=True), nullable=True))
+    op.execute("UPDATE stored_uploads SET last_uploaded_at = COALESCE(created_at, CURRENT_TIMESTAMP)")
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.alter_column(
+            'last_uploaded_at', existing_type=sa.DateTime(timezone=True), existing_nullable=True,
+            server_default=sa.func.now()
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.drop_column('last_uploaded_at')
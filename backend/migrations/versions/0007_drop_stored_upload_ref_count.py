@@ -0,0 +1,32 @@
+"""drop stored upload ref_count
+
+The counter was only ever incremented: whether a file is still used is decided
+by the upload GC from the rows that reference it, and how long an unreferenced
+file is kept from last_uploaded_at.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-20 12:26:09.614372
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.drop_column('ref_count')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('stored_uploads', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ref_count', sa.Integer(), nullable=False, server_default='1'))
@@ -0,0 +1,46 @@
+"""outbox fan out
+
+Every worker now delivers every event to its own WebSockets, so the per-event
+delivery state (attempts, backoff, delivered_at, claims) goes away; rows are
+pruned by created_at.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-20 14:41:52.107336
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_outbox_events_delivered_at'))
+        batch_op.drop_column('claimed_until')
+        batch_op.drop_column('claimed_by')
+        batch_op.drop_column('delivered_at')
+        batch_op.drop_column('next_attempt_at')
+        batch_op.drop_column('last_error')
+        batch_op.drop_column('attempts')
+        batch_op.create_index(batch_op.f('ix_outbox_events_created_at'), ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('outbox_events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_outbox_events_created_at'))
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_error', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column('delivered_at', sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column('claimed_by', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('claimed_until', sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_index(batch_op.f('ix_outbox_events_delivered_at'), ['delivered_at'], unique=False)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, ForeignKey, Text, Index, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -44,6 +44,10 @@ class Partner(Base):
     address = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)  # catalog delta sync
+    # Admission control, NULL falls back to the server defaults (order_queue.ADMISSION_*)
+    max_open_orders = Column(Integer, nullable=True)
+    max_orders_per_window = Column(Integer, nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="partner_profile")
@@ -54,17 +58,24 @@ class Partner(Base):
 
 class PartnerImage(Base):
     __tablename__ = "partner_images"
+    __table_args__ = (
+        Index("ix_partner_images_partner_id_created_at", "partner_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
     image_url = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
     
     # Relationships
     partner = relationship("Partner", back_populates="images")
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        Index("ix_products_partner_id_is_available", "partner_id", "is_available"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
@@ -76,13 +87,18 @@ class Product(Base):
     image_url = Column(String, nullable=True)
     is_available = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
     
     # Relationships
     partner = relationship("Partner", back_populates="products")
-    order_items = relationship("OrderItem", back_populates="product")
+    # Deleting a product leaves past order items alone (the ORM would null their product_id)
+    order_items = relationship("OrderItem", back_populates="product", passive_deletes="all")
 
 class Promotion(Base):
     __tablename__ = "promotions"
+    __table_args__ = (
+        Index("ix_promotions_partner_id_is_active", "partner_id", "is_active"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
@@ -93,12 +109,19 @@ class Promotion(Base):
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
     
     # Relationships
     partner = relationship("Partner", back_populates="promotions")
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_partner_id_created_at", "partner_id", "created_at"),
+        Index("ix_orders_partner_id_status", "partner_id", "status"),
+        Index("ix_orders_customer_id_created_at", "customer_id", "created_at"),
+        Index("ix_orders_updated_at", "updated_at"),  # incremental snapshot export
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -113,16 +136,97 @@ class Order(Base):
     customer = relationship("User", back_populates="orders", foreign_keys=[customer_id])
     partner = relationship("Partner", back_populates="orders", foreign_keys=[partner_id])
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
+    status_changes = relationship("OrderStatusChange", back_populates="order", cascade="all, delete-orphan")
 
 class OrderItem(Base):
     __tablename__ = "order_items"
     
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
     quantity = Column(Integer, nullable=False, default=1)
     price = Column(Float, nullable=False)
     
     # Relationships
     order = relationship("Order", back_populates="items")
     product = relationship("Product", back_populates="order_items")
+
+class OrderStatusChange(Base):
+    __tablename__ = "order_status_changes"
+    __table_args__ = (
+        Index("ix_order_status_changes_status_changed_at", "status", "changed_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
+    status = Column(SQLEnum(OrderStatus), nullable=False)
+    changed_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    order = relationship("Order", back_populates="status_changes")
+
+class CatalogTombstone(Base):
+    """Deleted catalog rows, so delta sync clients can drop them"""
+    __tablename__ = "catalog_tombstones"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)  # partners, products, promotions, partner_images
+    entity_id = Column(Integer, nullable=False)
+    partner_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class StoredUpload(Base):
+    __tablename__ = "stored_uploads"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, index=True, nullable=False)  # SHA-256 hex digest
+    extension = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Refreshed whenever an upload or presign hands out this file; the GC grace period counts from it
+    last_uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON encoded message data
+    recipients = Column(Text, nullable=False)  # JSON encoded list of user ids
+    # Every worker delivers every event to its own sockets (see outbox.py); rows are pruned by age
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+# Statistics rollups, maintained incrementally by stats_rollup.py
+class PartnerDailyStats(Base):
+    __tablename__ = "partner_daily_stats"
+    __table_args__ = (UniqueConstraint("partner_id", "day"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    orders = Column(Integer, nullable=False, default=0)
+    completed_orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)  # Completed orders only
+    customers = Column(Integer, nullable=False, default=0)  # Distinct customers
+
+class PartnerDailyCustomer(Base):
+    __tablename__ = "partner_daily_customers"
+    __table_args__ = (UniqueConstraint("partner_id", "day", "customer_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    customer_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    orders = Column(Integer, nullable=False, default=0)
+
+class PartnerDailyProductStats(Base):
+    __tablename__ = "partner_daily_product_stats"
+    __table_args__ = (UniqueConstraint("partner_id", "day", "product_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    partner_id = Column(Integer, ForeignKey("partners.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False, default=0)  # Completed orders only
+    revenue = Column(Float, nullable=False, default=0.0)
@@ -0,0 +1,247 @@
+"""
+In-memory per-partner queue depth and ready-time estimator.
+
+Counters are updated in O(1) on every order transition and rebuilt from the
+orders and order_status_changes tables on startup. They are per process: with
+several workers each one sees the transitions it handled itself, which is good
+enough for the queue snapshot and the ready-time estimate.
+
+Admission control has to hold across workers, so admit() counts a partner's
+open orders and the orders accepted in the last ADMISSION_WINDOW_SECONDS in the
+database, inside the transaction that stores the order and after locking the
+partner row: concurrent requests for the same partner are serialized and
+cannot both take the last slot.
+"""
+import math
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import Order, OrderStatus, OrderStatusChange, Partner
+
+# Number of recent IN_QUEUE -> READY durations in the rolling average
+ROLLING_WINDOW = int(os.getenv("ETA_ROLLING_WINDOW", "50"))
+# Used until a partner has any history
+DEFAULT_READY_SECONDS = float(os.getenv("ETA_DEFAULT_READY_SECONDS", "900"))
+# How far back the history is replayed on rebuild
+REBUILD_HISTORY_DAYS = 30
+
+# Admission defaults for partners without their own limits, 0 means unlimited
+ADMISSION_MAX_OPEN_ORDERS = int(os.getenv("ADMISSION_MAX_OPEN_ORDERS", "0"))
+ADMISSION_MAX_ORDERS_PER_WINDOW = int(os.getenv("ADMISSION_MAX_ORDERS_PER_WINDOW", "0"))
+ADMISSION_WINDOW_SECONDS = float(os.getenv("ADMISSION_WINDOW_SECONDS", "600"))
+# Upper bound of the Retry-After hint
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "300"))
+
+OPEN_STATUSES = (OrderStatus.IN_QUEUE, OrderStatus.IN_PROCESS)
+
+def now_like(value: datetime) -> datetime:
+    return datetime.now(timezone.utc) if value.tzinfo else datetime.utcnow()
+
+class OrderRejected(Exception):
+    """The partner is at capacity; retry_after is a hint in whole seconds"""
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class PartnerQueue:
+    __slots__ = ("counts", "durations", "duration_sum")
+    
+    def __init__(self):
+        self.counts: Dict[OrderStatus, int] = {status: 0 for status in OrderStatus}
+        self.durations = deque()
+        self.duration_sum = 0.0
+    
+    def add_duration(self, seconds: float):
+        if len(self.durations) >= ROLLING_WINDOW:
+            self.duration_sum -= self.durations.popleft()
+        self.durations.append(seconds)
+        self.duration_sum += seconds
+    
+    @property
+    def average_ready_seconds(self) -> float:
+        if not self.durations:
+            return DEFAULT_READY_SECONDS
+        return self.duration_sum / len(self.durations)
+    
+    @property
+    def open_orders(self) -> int:
+        return self.counts[OrderStatus.IN_QUEUE] + self.counts[OrderStatus.IN_PROCESS]
+
+class QueueTracker:
+    def __init__(self):
+        self._partners: Dict[int, PartnerQueue] = {}
+        self._lock = threading.Lock()
+    
+    def _queue(self, partner_id: int) -> PartnerQueue:
+        queue = self._partners.get(partner_id)
+        if queue is None:
+            queue = self._partners[partner_id] = PartnerQueue()
+        return queue
+    
+    def order_created(self, partner_id: int, status: OrderStatus = OrderStatus.IN_QUEUE):
+        with self._lock:
+            self._queue(partner_id).counts[status] += 1
+    
+    def status_changed(
+        self,
+        partner_id: int,
+        old_status: OrderStatus,
+        new_status: OrderStatus,
+        queued_at: Optional[datetime] = None,
+        changed_at: Optional[datetime] = None
+    ):
+        if old_status == new_status:
+            return
+        with self._lock:
+            queue = self._queue(partner_id)
+            queue.counts[old_status] = max(0, queue.counts[old_status] - 1)
+            queue.counts[new_status] += 1
+            if new_status == OrderStatus.READY and old_status in OPEN_STATUSES and queued_at and changed_at:
+                queue.add_duration(max(0.0, (changed_at - queued_at).total_seconds()))
+    
+    def order_deleted(self, partner_id: int, status: OrderStatus):
+        with self._lock:
+            queue = self._queue(partner_id)
+            queue.counts[status] = max(0, queue.counts[status] - 1)
+    
+    def average_ready_seconds(self, partner_id: int) -> float:
+        queue = self._partners.get(partner_id)
+        return queue.average_ready_seconds if queue else DEFAULT_READY_SECONDS
+    
+    def snapshot(self, partner_id: int) -> dict:
+        with self._lock:
+            queue = self._partners.get(partner_id) or PartnerQueue()
+            counts = dict(queue.counts)
+            average = queue.average_ready_seconds
+        return {
+            "partner_id": partner_id,
+            "in_queue": counts[OrderStatus.IN_QUEUE],
+            "in_process": counts[OrderStatus.IN_PROCESS],
+            "ready": counts[OrderStatus.READY],
+            "open_orders": counts[OrderStatus.IN_QUEUE] + counts[OrderStatus.IN_PROCESS],
+            "average_ready_seconds": round(average),
+        }
+    
+    def rebuild(self, db: Session):
+        partners: Dict[int, PartnerQueue] = {}
+        counts = db.query(Order.partner_id, Order.status, func.count(Order.id)).group_by(
+            Order.partner_id, Order.status
+        ).all()
+        for partner_id, status, count in counts:
+            if status is not None:
+                partners.setdefault(partner_id, PartnerQueue()).counts[status] = count
+        
+        # Replay recent READY transitions in chronological order to refill the rolling windows
+        since = datetime.utcnow() - timedelta(days=REBUILD_HISTORY_DAYS)
+        history = db.query(OrderStatusChange.partner_id, Order.created_at, OrderStatusChange.changed_at).join(
+            Order, OrderStatusChange.order_id == Order.id
+        ).filter(
+            OrderStatusChange.status == OrderStatus.READY,
+            OrderStatusChange.changed_at >= since
+        ).order_by(OrderStatusChange.changed_at).yield_per(1000)
+        for partner_id, queued_at, ready_at in history:
+            if queued_at and ready_at:
+                partners.setdefault(partner_id, PartnerQueue()).add_duration(
+                    max(0.0, (ready_at - queued_at).total_seconds())
+                )
+        
+        with self._lock:
+            self._partners = partners
+
+tracker = QueueTracker()
+
+def admission_limits(partner: Partner) -> Tuple[int, int]:
+    """(max open orders, max orders per window), 0 means unlimited"""
+    max_open = partner.max_open_orders if partner.max_open_orders is not None else ADMISSION_MAX_OPEN_ORDERS
+    max_window = partner.max_orders_per_window if partner.max_orders_per_window is not None else ADMISSION_MAX_ORDERS_PER_WINDOW
+    return max_open, max_window
+
+def _admission_state(db: Session, partner: Partner) -> dict:
+    """Open orders and orders in the window from the database, and how long until one more is admitted"""
+    max_open, max_window = admission_limits(partner)
+    open_orders = db.query(func.count(Order.id)).filter(
+        Order.partner_id == partner.id, Order.status.in_(OPEN_STATUSES)
+    ).scalar()
+    in_window = db.query(Order.created_at).filter(
+        Order.partner_id == partner.id,
+        Order.created_at >= datetime.utcnow() - timedelta(seconds=ADMISSION_WINDOW_SECONDS)
+    )
+    waits = []
+    if max_window:
+        created = [created_at for (created_at,) in in_window.order_by(Order.created_at)]
+        orders_in_window = len(created)
+        if orders_in_window >= max_window:
+            # The oldest admissions leave the window first
+            oldest = created[orders_in_window - max_window]
+            waits.append((oldest - now_like(oldest)).total_seconds() + ADMISSION_WINDOW_SECONDS)
+    else:
+        orders_in_window = in_window.count()
+    if max_open and open_orders >= max_open:
+        # Open orders finish at about one per average ready time divided by the queue length
+        excess = open_orders - max_open + 1
+        waits.append(tracker.average_ready_seconds(partner.id) * excess / open_orders)
+    wait = max(waits) if waits else None
+    return {
+        "max_open_orders": max_open,
+        "max_orders_per_window": max_window,
+        "open_orders": open_orders,
+        "orders_in_window": orders_in_window,
+        "retry_after": None if wait is None else min(ADMISSION_MAX_RETRY_AFTER, max(1, math.ceil(wait))),
+    }
+
+def admit(db: Session, partner: Partner):
+    """
+    Raise OrderRejected if the partner is at capacity. Call it in the transaction
+    that stores the order: the partner row stays locked until the commit.
+    """
+    max_open, max_window = admission_limits(partner)
+    if not max_open and not max_window:
+        return
+    # SQLite has no FOR UPDATE, its writers are serialized anyway
+    db.query(Partner.id).filter(Partner.id == partner.id).with_for_update().one()
+    state = _admission_state(db, partner)
+    if state["retry_after"] is None:
+        return
+    if max_open and state["open_orders"] >= max_open:
+        reason = f"Partner has reached its limit of {max_open} open orders"
+    else:
+        reason = f"Partner has reached its limit of {max_window} orders per {round(ADMISSION_WINDOW_SECONDS)} seconds"
+    raise OrderRejected(reason, state["retry_after"])
+
+def partner_load(db: Session, partner: Partner) -> dict:
+    """Admission state and ready-time average, as broadcast to customers viewing the partner"""
+    state = _admission_state(db, partner)
+    return {
+        "partner_id": partner.id,
+        "open_orders": state["open_orders"],
+        "max_open_orders": state["max_open_orders"] or None,
+        "orders_in_window": state["orders_in_window"],
+        "max_orders_per_window": state["max_orders_per_window"] or None,
+        "window_seconds": round(ADMISSION_WINDOW_SECONDS),
+        "accepting_orders": state["retry_after"] is None,
+        "retry_after_seconds": state["retry_after"],
+        "average_ready_seconds": round(tracker.average_ready_seconds(partner.id)),
+    }
+
+def read_partner_load(partner_id: int) -> Optional[dict]:
+    """partner_load() in its own session, None if the partner does not exist"""
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        partner = db.query(Partner).filter(Partner.id == partner_id).first()
+        return partner_load(db, partner) if partner else None
+    finally:
+        db.close()
+
+def rebuild_tracker():
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        tracker.rebuild(db)
+    finally:
+        db.close()
@@ -0,0 +1,201 @@
+"""
+Transactional outbox for WebSocket notifications.
+
+Handlers add events to the session before commit, so a notification is stored
+if and only if the change it describes is stored. WebSockets live in the worker
+process that accepted them, so every worker runs a dispatcher that reads every
+event and sends it to its own sockets: events are fanned out, not claimed.
+Each dispatcher keeps a cursor (the last event id it handled) starting at the
+newest event when the process starts, and also re-reads the last
+OUTBOX_LATE_COMMIT_SECONDS of events so a transaction that took an id before
+another one but committed after it is not skipped. Rows are pruned
+OUTBOX_RETENTION_HOURS after they were written, delivered or not.
+
+A recipient without a socket in this process is skipped; a socket that fails is
+dropped, its client reconnects and the order pages load the current orders.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import OutboxEvent, Order
+from routers.websocket import manager, DeliveryError
+from order_queue import read_partner_load
+from query_recorder import mark_background
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_LATE_COMMIT_SECONDS = float(os.getenv("OUTBOX_LATE_COMMIT_SECONDS", "10"))
+OUTBOX_RETENTION = timedelta(hours=int(os.getenv("OUTBOX_RETENTION_HOURS", "24")))
+OUTBOX_PRUNE_INTERVAL = 600  # seconds
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_wakeup: Optional[asyncio.Event] = None
+
+class _Cursor:
+    """Position of this process in the event stream"""
+    def __init__(self):
+        self.last_id: Optional[int] = None
+        # Ids handled within the late commit window -> time.monotonic() they were handled
+        self.recent: Dict[int, float] = {}
+
+    def start_at_newest(self, db: Session):
+        """Nothing written before the process started can be meant for its sockets"""
+        self.last_id = db.query(func.max(OutboxEvent.id)).scalar() or 0
+        since = datetime.utcnow() - timedelta(seconds=OUTBOX_LATE_COMMIT_SECONDS)
+        now = time.monotonic()
+        self.recent = {
+            event_id: now for (event_id,) in db.query(OutboxEvent.id).filter(OutboxEvent.created_at >= since)
+        }
+
+    def handled(self, event_ids: Iterable[int]):
+        now = time.monotonic()
+        for event_id in event_ids:
+            self.recent[event_id] = now
+            if event_id > self.last_id:
+                self.last_id = event_id
+        for event_id in [i for i, at in self.recent.items() if at < now - 2 * OUTBOX_LATE_COMMIT_SECONDS]:
+            del self.recent[event_id]
+
+_cursor = _Cursor()
+
+def order_payload(order: Order) -> dict:
+    return {
+        "id": order.id,
+        "status": order.status.value,
+        "customer_id": order.customer_id,
+        "partner_id": order.partner_id,
+        "total_amount": order.total_amount,
+        "updated_at": order.updated_at.isoformat() if order.updated_at else None
+    }
+
+def enqueue(db: Session, event_type: str, payload: dict, recipient_ids: Iterable[int]):
+    """Add an event to the current transaction; it is delivered after commit"""
+    db.add(OutboxEvent(
+        event_type=event_type,
+        payload=json.dumps(payload),
+        recipients=json.dumps(list(recipient_ids))
+    ))
+
+def enqueue_order_update(db: Session, order: Order, recipient_ids: Iterable[int]):
+    enqueue(db, "order_update", order_payload(order), recipient_ids)
+
+def enqueue_partner_load(db: Session, partner_id: int):
+    """
+    Tell customers viewing the partner that its load changed. The load itself is
+    read at delivery time, so a burst of events sends the latest numbers. Viewers
+    may be connected to any worker, so the event is stored unconditionally.
+    """
+    enqueue(db, "partner_load", {"partner_id": partner_id}, [])
+
+def wake_dispatcher():
+    """Ask the dispatcher to run now instead of waiting for the next poll. Safe from any thread."""
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+def _fetch_batch() -> list:
+    """Events this process has not handled yet, oldest first"""
+    db = SessionLocal()
+    try:
+        if _cursor.last_id is None:
+            _cursor.start_at_newest(db)
+            return []
+        events = db.query(OutboxEvent).filter(OutboxEvent.id > _cursor.last_id).order_by(
+            OutboxEvent.id
+        ).limit(OUTBOX_BATCH_SIZE).all()
+        # Committed late with an id below the cursor
+        since = datetime.utcnow() - timedelta(seconds=OUTBOX_LATE_COMMIT_SECONDS)
+        late = [
+            event for event in db.query(OutboxEvent).filter(
+                OutboxEvent.id <= _cursor.last_id,
+                OutboxEvent.created_at >= since
+            )
+            if event.id not in _cursor.recent
+        ]
+        return [
+            (e.id, e.event_type, json.loads(e.payload), json.loads(e.recipients))
+            for e in sorted(late, key=lambda e: e.id) + events
+        ]
+    finally:
+        db.close()
+
+def _prune():
+    db = SessionLocal()
+    try:
+        db.query(OutboxEvent).filter(
+            OutboxEvent.created_at < datetime.utcnow() - OUTBOX_RETENTION
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+async def _deliver(event_type: str, payload: dict, recipients: list) -> int:
+    """Send one event to the sockets of this process, returns how many got it"""
+    if event_type == "partner_load":
+        partner_id = payload["partner_id"]
+        if not manager.has_viewers(partner_id):
+            return 0
+        load = await run_in_threadpool(read_partner_load, partner_id)
+        if load is None:
+            return 0
+        return await manager.send_to_viewers({"type": event_type, "data": load}, partner_id)
+    message = {"type": event_type, "data": payload}
+    sent = 0
+    for user_id in recipients:
+        try:
+            sent += await manager.send_personal_message(message, user_id)
+        except DeliveryError as e:
+            # The dead sockets are gone; the client reloads its orders when it reconnects
+            logging.info(f"Outbox event to user {user_id} not delivered: {e}")
+    return sent
+
+async def dispatch_pending() -> int:
+    """Deliver one batch of new events to this process's sockets, returns the batch size"""
+    batch = await run_in_threadpool(_fetch_batch)
+    if not batch:
+        return 0
+    load_sent = set()
+    for event_id, event_type, payload, recipients in batch:
+        if event_type == "partner_load":
+            # One message per partner and batch, they all carry the current load
+            if payload["partner_id"] in load_sent:
+                continue
+            load_sent.add(payload["partner_id"])
+        try:
+            await _deliver(event_type, payload, recipients)
+        except DeliveryError as e:
+            logging.info(f"Outbox event {event_id} not delivered: {e}")
+    _cursor.handled(event_id for event_id, *_ in batch)
+    return len(batch)
+
+async def run_dispatcher():
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    mark_background()
+    last_prune = 0.0
+    while True:
+        _wakeup.clear()
+        try:
+            processed = await dispatch_pending()
+            if _loop.time() - last_prune > OUTBOX_PRUNE_INTERVAL:
+                await run_in_threadpool(_prune)
+                last_prune = _loop.time()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Outbox dispatcher error: {e}")
+            processed = 0
+        if processed >= OUTBOX_BATCH_SIZE:
+            continue  # more events are probably waiting
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
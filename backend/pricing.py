@@ -0,0 +1,197 @@
+"""
+Product pricing: list price from a product's own discount, and per-partner
+price tables that also apply the partner's best active promotion.
+
+A promotion applies to the whole menu of its partner; when several are active
+the largest discount_percent wins, they do not stack. Tables are built with two
+queries (products, promotions) on first use and kept until a product or
+promotion write calls invalidate(), the next promotion expires, or
+PRICE_TABLE_TTL seconds pass (the bound on staleness across worker processes).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session
+from models import Product, Promotion
+
+PRICE_TABLE_TTL = float(os.getenv("PRICE_TABLE_TTL", "60"))
+PRICE_TABLE_MAX_PARTNERS = int(os.getenv("PRICE_TABLE_MAX_PARTNERS", "10000"))
+
+def _money(value: float) -> float:
+    return round(value, 2)
+
+def apply_discount(price: float, discount_percent: Optional[float]) -> float:
+    if not discount_percent:
+        return _money(price)
+    return _money(price * (1 - discount_percent / 100))
+
+def list_price(price: Optional[float], original_price: Optional[float], discount_percent: Optional[float]) -> Optional[float]:
+    """Product price before promotions: original_price less the product discount, else the plain price"""
+    if original_price:
+        return apply_discount(original_price, discount_percent)
+    return price
+
+def product_prices(price: Optional[float], original_price: Optional[float], discount_percent: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    (price, original_price) to store for a new product. A discount on a plain
+    price makes that price the original one, so the discount is not ignored.
+    """
+    if discount_percent and not original_price:
+        original_price = price
+    return list_price(price, original_price, discount_percent), original_price
+
+def reprice_update(values: dict, price: Optional[float], original_price: Optional[float], discount_percent: Optional[float]):
+    """
+    Recalculate the price in a product update `values` from the resulting
+    original_price and discount; the other arguments are the current columns.
+    A discount on a product with only a plain price turns that price into the
+    original price, unless the update clears original_price itself.
+    """
+    if "original_price" not in values and "discount_percent" not in values:
+        return
+    original_price = values.get("original_price", original_price)
+    discount_percent = values.get("discount_percent", discount_percent)
+    if discount_percent and not original_price and "original_price" not in values:
+        original_price = values["original_price"] = values.get("price", price)
+    if original_price:
+        values["price"] = list_price(values.get("price"), original_price, discount_percent)
+
+@dataclass
+class PriceEntry:
+    product_id: int
+    name: str
+    base_price: float  # Before any discount
+    list_price: float  # After the product's own discount
+    unit_price: float  # After the partner's best active promotion
+    is_available: bool
+
+@dataclass
+class PriceTable:
+    partner_id: int
+    promotion_id: Optional[int]
+    promotion_discount: Optional[float]
+    expires_at: float
+    entries: Dict[int, PriceEntry] = field(default_factory=dict)
+
+    def unit_price(self, product_price: float) -> float:
+        """Promotion applied to a list price, for products read outside the table"""
+        return apply_discount(product_price, self.promotion_discount)
+
+# partner_id -> table, least recently used first (shared by threadpool workers)
+_tables: "OrderedDict[int, PriceTable]" = OrderedDict()
+# Bumped by invalidate(), so a table built from rows read before a write is not stored
+_generations: Dict[int, int] = {}
+_lock = threading.Lock()
+
+def build_table(db: Session, partner_id: int) -> PriceTable:
+    now = datetime.utcnow()
+    promotions = db.query(Promotion.id, Promotion.discount_percent, Promotion.expires_at).filter(
+        Promotion.partner_id == partner_id,
+        Promotion.is_active == True
+    ).all()
+    active = [p for p in promotions if not p.expires_at or p.expires_at > now]
+    best = max((p for p in active if p.discount_percent), key=lambda p: p.discount_percent, default=None)
+    # Rebuild when the best promotion may change: at the next expiry of any active promotion
+    ttl = min([(p.expires_at - now).total_seconds() for p in active if p.expires_at] + [PRICE_TABLE_TTL])
+
+    table = PriceTable(
+        partner_id=partner_id,
+        promotion_id=best.id if best else None,
+        promotion_discount=best.discount_percent if best else None,
+        expires_at=time.monotonic() + ttl
+    )
+    rows = db.query(
+        Product.id, Product.name, Product.price, Product.original_price, Product.is_available
+    ).filter(Product.partner_id == partner_id)
+    for row in rows:
+        if row.price is None:
+            continue
+        table.entries[row.id] = PriceEntry(
+            product_id=row.id,
+            name=row.name,
+            base_price=float(row.original_price or row.price),
+            list_price=float(row.price),
+            unit_price=table.unit_price(row.price),
+            is_available=bool(row.is_available)
+        )
+    return table
+
+def get_table(db: Session, partner_id: int) -> PriceTable:
+    with _lock:
+        table = _tables.get(partner_id)
+        if table is not None and table.expires_at > time.monotonic():
+            _tables.move_to_end(partner_id)
+            return table
+        generation = _generations.get(partner_id, 0)
+    table = build_table(db, partner_id)
+    with _lock:
+        if _generations.get(partner_id, 0) != generation:
+            return table
+        _tables[partner_id] = table
+        while len(_tables) > PRICE_TABLE_MAX_PARTNERS:
+            _tables.popitem(last=False)
+    return table
+
+def invalidate(partner_id: int):
+    with _lock:
+        _tables.pop(partner_id, None)
+        _generations[partner_id] = _generations.get(partner_id, 0) + 1
+
+def clear():
+    with _lock:
+        _tables.clear()
+
+def quote(db: Session, items: Iterable[Tuple[int, int, int]]) -> dict:
+    """
+    CartQuoteResponse dict for (partner_id, product_id, quantity) items, one
+    price table per partner. Repeated products are merged into one line.
+    """
+    quantities: "OrderedDict[int, OrderedDict[int, int]]" = OrderedDict()
+    for partner_id, product_id, quantity in items:
+        lines = quantities.setdefault(partner_id, OrderedDict())
+        lines[product_id] = lines.get(product_id, 0) + quantity
+
+    partners: List[dict] = []
+    unavailable: List[int] = []
+    subtotal = total = 0.0
+    for partner_id, lines in quantities.items():
+        table = get_table(db, partner_id)
+        quoted = []
+        for product_id, quantity in lines.items():
+            entry = table.entries.get(product_id)
+            if entry is None or not entry.is_available:
+                unavailable.append(product_id)
+                continue
+            quoted.append({
+                "product_id": product_id,
+                "name": entry.name,
+                "quantity": quantity,
+                "base_price": entry.base_price,
+                "unit_price": entry.unit_price,
+                "line_total": _money(entry.unit_price * quantity),
+            })
+        if not quoted:
+            continue
+        partner_subtotal = _money(sum(line["base_price"] * line["quantity"] for line in quoted))
+        partner_total = _money(sum(line["line_total"] for line in quoted))
+        partners.append({
+            "partner_id": partner_id,
+            "promotion_id": table.promotion_id,
+            "promotion_discount_percent": table.promotion_discount,
+            "items": quoted,
+            "subtotal": partner_subtotal,
+            "total": partner_total,
+        })
+        subtotal += partner_subtotal
+        total += partner_total
+    return {
+        "partners": partners,
+        "unavailable": unavailable,
+        "subtotal": _money(subtotal),
+        "discount": _money(subtotal - total),
+        "total": _money(total),
+    }
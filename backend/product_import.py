@@ -0,0 +1,196 @@
+"""
+Bulk product import for partners (CSV file or JSON array).
+
+Rows are parsed, validated and written in one pass: valid rows are collected
+into chunks of PRODUCT_IMPORT_CHUNK_SIZE, and each chunk is written with one
+executemany INSERT and one executemany UPDATE in its own transaction, so a
+500-item menu costs a single commit instead of 500. Invalid rows are skipped
+and reported with their row number; a chunk that fails to write is reported
+row by row and the import goes on with the next one.
+
+A row updates an existing product of the partner when its `id` is given or its
+`name` matches exactly one product; otherwise it creates a product. Empty CSV
+cells and missing JSON keys leave the stored value unchanged.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+from pydantic import ValidationError
+from sqlalchemy import insert, update
+from sqlalchemy.exc import SQLAlchemyError
+from database import SessionLocal
+from models import Product
+from schemas import ProductImportRow
+import pricing
+
+PRODUCT_IMPORT_MAX_BYTES = int(os.getenv("PRODUCT_IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+PRODUCT_IMPORT_CHUNK_SIZE = int(os.getenv("PRODUCT_IMPORT_CHUNK_SIZE", "500"))
+
+FIELDS = list(ProductImportRow.model_fields)
+CREATE_DEFAULTS = {"description": None, "original_price": None, "discount_percent": None, "image_url": None, "is_available": True}
+
+class ImportFormatError(ValueError):
+    """The file as a whole cannot be read (encoding, JSON syntax, CSV header)"""
+
+def iter_csv(body: bytes) -> Iterator[Tuple[int, object]]:
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ImportFormatError("CSV must be UTF-8")
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames:
+        raise ImportFormatError("CSV has no header row")
+    unknown = [name for name in reader.fieldnames if name not in FIELDS]
+    if unknown:
+        raise ImportFormatError(f"Unknown CSV columns: {', '.join(unknown)}. Allowed: {', '.join(FIELDS)}")
+    for number, record in enumerate(reader, start=1):
+        # Empty cells mean "leave unchanged"
+        yield number, {key: value for key, value in record.items() if value not in ("", None)}
+
+def iter_json(body: bytes) -> Iterator[Tuple[int, object]]:
+    try:
+        data = json.loads(body)
+    except ValueError as exc:
+        raise ImportFormatError(f"Invalid JSON: {exc}")
+    if not isinstance(data, list):
+        raise ImportFormatError("JSON body must be an array of products")
+    yield from enumerate(data, start=1)
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+def validate_row(raw) -> ProductImportRow:
+    if not isinstance(raw, dict):
+        raise ValueError("Row must be an object")
+    if None in raw:
+        raise ValueError("Row has more values than the header")
+    unknown = [str(key) for key in raw if key not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    try:
+        row = ProductImportRow(**raw)
+    except ValidationError as exc:
+        raise ValueError(_validation_message(exc))
+    if "name" in row.model_fields_set and not (row.name or "").strip():
+        raise ValueError("name must not be empty")
+    for name in ("price", "original_price"):
+        value = getattr(row, name)
+        if value is not None and value < 0:
+            raise ValueError(f"{name} must not be negative")
+    if row.discount_percent is not None and not 0 <= row.discount_percent < 100:
+        raise ValueError("discount_percent must be between 0 and 100")
+    return row
+
+class _Importer:
+    def __init__(self, db, partner_id: int, dry_run: bool):
+        self.db = db
+        self.partner_id = partner_id
+        self.dry_run = dry_run
+        self.created = self.updated = 0
+        self.errors: List[dict] = []
+        # The partner's current menu, kept up to date as rows are planned
+        self.products: Dict[int, dict] = {}
+        self.ids_by_name: Dict[str, List[int]] = {}
+        self.new_names = set()
+        rows = db.query(
+            Product.id, Product.name, Product.price, Product.original_price, Product.discount_percent
+        ).filter(Product.partner_id == partner_id)
+        for row in rows:
+            self.products[row.id] = dict(row._mapping)
+            self.ids_by_name.setdefault(row.name, []).append(row.id)
+        self.now = datetime.utcnow()
+        self.inserts: List[Tuple[int, dict]] = []
+        self.updates: List[Tuple[int, dict]] = []
+
+    def plan(self, row: ProductImportRow) -> Tuple[str, dict]:
+        product_id = row.id
+        if product_id is not None:
+            if product_id not in self.products:
+                raise ValueError(f"Product {product_id} not found")
+        elif row.name is not None:
+            matches = self.ids_by_name.get(row.name, [])
+            if len(matches) > 1:
+                raise ValueError(f"Name '{row.name}' matches {len(matches)} products, use id")
+            if matches:
+                product_id = matches[0]
+            elif row.name in self.new_names:
+                raise ValueError(f"Duplicate new product '{row.name}' in this import")
+
+        if product_id is None:
+            if row.name is None:
+                raise ValueError("name is required for a new product")
+            values = {**CREATE_DEFAULTS, **row.model_dump(exclude_unset=True, exclude={"id"})}
+            values["price"], values["original_price"] = pricing.product_prices(
+                values.get("price"), values["original_price"], values["discount_percent"]
+            )
+            if not values["price"]:
+                raise ValueError("Either price or original_price must be provided")
+            values["partner_id"] = self.partner_id
+            self.new_names.add(row.name)
+            return "insert", values
+
+        # Same rule as update_product: the price follows original_price and discount
+        current = self.products[product_id]
+        values = row.model_dump(exclude_unset=True, exclude={"id"})
+        pricing.reprice_update(values, current["price"], current["original_price"], current["discount_percent"])
+        if "name" in values and values["name"] != current["name"]:
+            self.ids_by_name[current["name"]].remove(product_id)
+            self.ids_by_name.setdefault(values["name"], []).append(product_id)
+        current.update({key: value for key, value in values.items() if key in current})
+        values["id"] = product_id
+        values["updated_at"] = self.now
+        return "update", values
+
+    def add(self, number: int, raw):
+        try:
+            kind, values = self.plan(validate_row(raw))
+        except ValueError as exc:
+            self.errors.append({"row": number, "error": str(exc)})
+            return
+        (self.inserts if kind == "insert" else self.updates).append((number, values))
+        if len(self.inserts) + len(self.updates) >= PRODUCT_IMPORT_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        inserts, updates = self.inserts, self.updates
+        self.inserts, self.updates = [], []
+        if self.dry_run:
+            self.created += len(inserts)
+            self.updated += len(updates)
+            return
+        try:
+            if inserts:
+                self.db.execute(insert(Product), [values for _, values in inserts])
+            if updates:
+                # ORM bulk UPDATE by primary key: one executemany per set of columns
+                self.db.execute(update(Product), [values for _, values in updates])
+            self.db.commit()
+        except SQLAlchemyError as exc:
+            self.db.rollback()
+            message = f"Could not be saved: {getattr(exc, 'orig', None) or exc}"
+            self.errors.extend({"row": number, "error": message} for number, _ in inserts + updates)
+            return
+        self.created += len(inserts)
+        self.updated += len(updates)
+
+def import_products(partner_id: int, rows: Iterable[Tuple[int, object]], dry_run: bool = False) -> dict:
+    """ProductImportResponse dict; `rows` yields (row number, raw row). Runs in its own session."""
+    db = SessionLocal()
+    try:
+        importer = _Importer(db, partner_id, dry_run)
+        for number, raw in rows:
+            importer.add(number, raw)
+        importer.flush()
+    finally:
+        db.close()
+    importer.errors.sort(key=lambda error: error["row"])
+    return {
+        "created": importer.created,
+        "updated": importer.updated,
+        "failed": len(importer.errors),
+        "dry_run": dry_run,
+        "errors": importer.errors,
+    }
@@ -0,0 +1,166 @@
+"""
+SQL statement recording for tests and development.
+
+QueryRecorder is a context manager that records every statement the engine
+runs inside the block and can enforce a budget:
+
+    with QueryRecorder(max_queries=5) as recorder:
+        client.get("/api/partner/orders", headers=headers)
+    print(recorder.count, recorder.repeated())
+
+In tests, enable the fixture with `pytest_plugins = ["query_recorder"]` in
+conftest.py:
+
+    def test_orders(client, query_recorder):
+        with query_recorder(max_queries=5):
+            client.get("/api/partner/orders", headers=headers)
+
+In dev mode (QUERY_DEBUG=1) QueryDebugMiddleware watches every request and logs
+a warning with a stack trace when the same statement shape runs more than
+QUERY_DEBUG_REPEAT_THRESHOLD times in one request, the usual sign of an N+1
+query, and when a request exceeds QUERY_DEBUG_MAX_STATEMENTS.
+"""
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+from sqlalchemy import event
+from database import engine
+
+QUERY_DEBUG = os.getenv("QUERY_DEBUG", "").lower() in ("1", "true", "yes")
+QUERY_DEBUG_REPEAT_THRESHOLD = int(os.getenv("QUERY_DEBUG_REPEAT_THRESHOLD", "5"))
+QUERY_DEBUG_MAX_STATEMENTS = int(os.getenv("QUERY_DEBUG_MAX_STATEMENTS", "50"))
+
+logger = logging.getLogger("query_debug")
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+|\$\d+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+|\$\d+))*\s*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+def statement_shape(statement: str) -> str:
+    """Statement with literals and IN-list lengths removed, so repeats compare equal"""
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("(...)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+def _app_stack() -> str:
+    """Call stack without SQLAlchemy and server frames"""
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if "site-packages" not in frame.filename and "/lib/python" not in frame.filename
+    ]
+    return "".join(traceback.format_list(frames))
+
+# Statements of background jobs (outbox dispatcher, upload GC) are not attributed to recorders
+_background: ContextVar[bool] = ContextVar("query_recorder_background", default=False)
+
+def mark_background():
+    """Called at the start of a background task; applies to that task's context only"""
+    _background.set(True)
+
+@dataclass
+class RecordedStatement:
+    statement: str
+    parameters: object
+    duration: float
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryRecorder:
+    """Records all statements executed on the engine while the block runs"""
+
+    def __init__(self, max_queries: Optional[int] = None, bind=engine):
+        self.max_queries = max_queries
+        self.bind = bind
+        self.statements: List[RecordedStatement] = []
+        self._started: List[float] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def repeated(self, threshold: int = 1) -> List[Tuple[str, int]]:
+        """Statement shapes executed more than `threshold` times, most frequent first"""
+        counts = Counter(statement_shape(s.statement) for s in self.statements)
+        return [(shape, count) for shape, count in counts.most_common() if count > threshold]
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if _background.get():
+            return
+        self._started.append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if _background.get():
+            return
+        started = self._started.pop() if self._started else time.perf_counter()
+        self.statements.append(RecordedStatement(statement, parameters, time.perf_counter() - started))
+
+    def __enter__(self) -> "QueryRecorder":
+        event.listen(self.bind, "before_cursor_execute", self._before)
+        event.listen(self.bind, "after_cursor_execute", self._after)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.bind, "before_cursor_execute", self._before)
+        event.remove(self.bind, "after_cursor_execute", self._after)
+        if exc_type is None and self.max_queries is not None and self.count > self.max_queries:
+            listing = "\n".join(f"  {i + 1}. {statement_shape(s.statement)}" for i, s in enumerate(self.statements))
+            raise QueryBudgetExceeded(f"{self.count} SQL statements executed, budget is {self.max_queries}:\n{listing}")
+        return False
+
+try:
+    import pytest
+except ImportError:  # the fixture is only needed under pytest
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def query_recorder():
+        """Factory fixture: `with query_recorder(max_queries=n): ...`"""
+        return QueryRecorder
+
+# Dev mode: per-request shape counts, shared with threadpool workers through the context
+_request_shapes: ContextVar[Optional[Counter]] = ContextVar("request_shapes", default=None)
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    shapes = _request_shapes.get()
+    if shapes is None:
+        return
+    shape = statement_shape(statement)
+    shapes[shape] += 1
+    if shapes[shape] == QUERY_DEBUG_REPEAT_THRESHOLD + 1:
+        logger.warning(
+            f"Possible N+1: statement repeated more than {QUERY_DEBUG_REPEAT_THRESHOLD} times "
+            f"in one request: {shape}\n{_app_stack()}"
+        )
+
+class QueryDebugMiddleware:
+    def __init__(self, app):
+        self.app = app
+        if not event.contains(engine, "before_cursor_execute", _count_statement):
+            event.listen(engine, "before_cursor_execute", _count_statement)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        shapes = Counter()
+        token = _request_shapes.set(shapes)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_shapes.reset(token)
+            total = sum(shapes.values())
+            if total > QUERY_DEBUG_MAX_STATEMENTS:
+                logger.warning(
+                    f"{scope['method']} {scope['path']} executed {total} SQL statements "
+                    f"(budget {QUERY_DEBUG_MAX_STATEMENTS})"
+                )
@@ -9,6 +9,8 @@ from auth import (
     get_password_hash, authenticate_user, create_access_token,
     get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
 )
+import catalog_cache
+from map_index import index as map_index
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -81,7 +83,9 @@ def register_partner(
     )
     db.add(db_partner)
     db.commit()
+    catalog_cache.invalidate(db_partner.id)
     db.refresh(db_partner)
+    map_index.upsert(db_partner.id, db_partner.latitude, db_partner.longitude)
     
     return db_partner
 
@@ -1,21 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from database import get_db
-from models import User, Partner, Product, Promotion, Order, OrderItem, OrderStatus, UserType, PartnerImage, PartnerImage
+from models import User, Partner, Product, Promotion, Order, OrderItem, OrderStatus, UserType, PartnerImage, PartnerImage, OrderStatusChange
 from schemas import (
     PartnerResponse, ProductResponse, PromotionResponse,
-    OrderCreate, OrderResponse, OrderUpdate
+    OrderCreate, OrderResponse, OrderUpdate, PartnerQueueResponse, PartnerLoadResponse, CatalogChangesResponse,
+    CartQuoteRequest, CartQuoteResponse, MapClustersResponse
 )
 from auth import get_current_user
-from routers.websocket import manager
+from outbox import enqueue_order_update, enqueue_partner_load, wake_dispatcher
+from order_queue import tracker, admit, partner_load, OrderRejected
+import stats_rollup
+import stats_cache
+from fast_json import FastJSONResponse, dumps, order_dicts, partner_projection, product_projection, promotion_projection
+from compression import precompressed_response
+import catalog_cache
+import catalog_sync
+import pricing
+from map_index import index as map_index
 import uuid
+from datetime import datetime
 
 router = APIRouter(prefix="/api/customer", tags=["customer"])
 
+# Catalog responses are cached server-side; clients revalidate with the ETag
+CATALOG_CACHE_CONTROL = "public, no-cache"
+
+def _partner_exists(db: Session, partner_id: Optional[int]) -> bool:
+    """Lists of unknown partner ids are not cached, so arbitrary ids cannot fill the cache"""
+    if not partner_id:
+        return True
+    return db.query(Partner.id).filter(Partner.id == partner_id).first() is not None
+
 @router.get("/partners", response_model=List[PartnerResponse])
-def get_partners(db: Session = Depends(get_db)):
-    return db.query(Partner).all()
+def get_partners(request: Request, db: Session = Depends(get_db)):
+    body = catalog_cache.get_or_render(
+        "partners", None, lambda: (dumps(partner_projection.all(db.query(Partner))), None)
+    )
+    return precompressed_response(request, body, CATALOG_CACHE_CONTROL)
 
 @router.get("/partners/{partner_id}", response_model=PartnerResponse)
 def get_partner(partner_id: int, db: Session = Depends(get_db)):
@@ -24,12 +48,47 @@ def get_partner(partner_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Partner not found")
     return partner
 
+@router.get("/partners/{partner_id}/queue", response_model=PartnerQueueResponse)
+def get_partner_queue(partner_id: int, db: Session = Depends(get_db)):
+    if not db.query(Partner.id).filter(Partner.id == partner_id).first():
+        raise HTTPException(status_code=404, detail="Partner not found")
+    return tracker.snapshot(partner_id)
+
+@router.get("/partners/{partner_id}/load", response_model=PartnerLoadResponse)
+def get_partner_load(partner_id: int, db: Session = Depends(get_db)):
+    partner = db.query(Partner).filter(Partner.id == partner_id).first()
+    if not partner:
+        raise HTTPException(status_code=404, detail="Partner not found")
+    return partner_load(db, partner)
+
+@router.get("/map/clusters", response_model=MapClustersResponse)
+def get_map_clusters(
+    south: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=30),
+    db: Session = Depends(get_db)
+):
+    """Partners in the map viewport grouped into grid cells of the zoom level; west > east crosses the antimeridian"""
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not be greater than north")
+    map_index.refresh(db)
+    return FastJSONResponse({"zoom": zoom, "clusters": map_index.clusters(south, west, north, east, zoom)})
+
 @router.get("/products", response_model=List[ProductResponse])
-def get_products(partner_id: int = None, db: Session = Depends(get_db)):
-    query = db.query(Product).filter(Product.is_available == True)
-    if partner_id:
-        query = query.filter(Product.partner_id == partner_id)
-    return query.all()
+def get_products(request: Request, partner_id: int = None, db: Session = Depends(get_db)):
+    def render():
+        query = db.query(Product).filter(Product.is_available == True)
+        if partner_id:
+            query = query.filter(Product.partner_id == partner_id)
+        products = product_projection.all(query)
+        if not products and not _partner_exists(db, partner_id):
+            return dumps(products), 0
+        return dumps(products), None
+    
+    body = catalog_cache.get_or_render("products", partner_id or None, render)
+    return precompressed_response(request, body, CATALOG_CACHE_CONTROL)
 
 @router.get("/products/{product_id}", response_model=ProductResponse)
 def get_product(product_id: int, db: Session = Depends(get_db)):
@@ -39,14 +98,38 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
     return product
 
 @router.get("/promotions", response_model=List[PromotionResponse])
-def get_promotions(partner_id: int = None, db: Session = Depends(get_db)):
-    from datetime import datetime
-    query = db.query(Promotion).filter(Promotion.is_active == True)
-    if partner_id:
-        query = query.filter(Promotion.partner_id == partner_id)
-    # Filter expired promotions
-    promotions = query.all()
-    return [p for p in promotions if not p.expires_at or p.expires_at > datetime.utcnow()]
+def get_promotions(request: Request, partner_id: int = None, db: Session = Depends(get_db)):
+    def render():
+        query = db.query(Promotion).filter(Promotion.is_active == True)
+        if partner_id:
+            query = query.filter(Promotion.partner_id == partner_id)
+        # Filter expired promotions
+        now = datetime.utcnow()
+        promotions = [p for p in promotion_projection.all(query) if not p["expires_at"] or p["expires_at"] > now]
+        # Keep the cached list only until the next promotion expires
+        expirations = [(p["expires_at"] - now).total_seconds() for p in promotions if p["expires_at"]]
+        if not promotions and not _partner_exists(db, partner_id):
+            return dumps(promotions), 0
+        return dumps(promotions), min(expirations, default=None)
+    
+    body = catalog_cache.get_or_render("promotions", partner_id or None, render)
+    return precompressed_response(request, body, CATALOG_CACHE_CONTROL)
+
+@router.get("/catalog/changes", response_model=CatalogChangesResponse)
+def get_catalog_changes(since: Optional[str] = None, partner_id: int = None, db: Session = Depends(get_db)):
+    """Catalog rows changed or deleted since the token of the previous call; the full catalog without `since`"""
+    try:
+        since_at = catalog_sync.decode_token(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return FastJSONResponse(catalog_sync.changes(db, since_at, partner_id))
+
+@router.post("/cart/quote", response_model=CartQuoteResponse)
+def quote_cart(cart: CartQuoteRequest, db: Session = Depends(get_db)):
+    """Price the whole cart (product discounts and the best active promotion) in one call"""
+    if any(item.quantity <= 0 for item in cart.items):
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    return FastJSONResponse(pricing.quote(db, ((item.partner_id, item.product_id, item.quantity) for item in cart.items)))
 
 @router.post("/orders", response_model=OrderResponse)
 async def create_order(
@@ -57,29 +140,51 @@ async def create_order(
     if current_user.user_type != UserType.CUSTOMER:
         raise HTTPException(status_code=403, detail="Only customers can create orders")
     
+    db_order = _store_order(order_data, current_user, db)
+    tracker.order_created(db_order.partner_id)
+    stats_cache.invalidate(db_order.partner_id)
+    wake_dispatcher()
+    
+    # Flat queries instead of lazy-loading every item's product
+    return FastJSONResponse(order_dicts(db, db.query(Order).filter(Order.id == db_order.id))[0])
+
+def _store_order(order_data: OrderCreate, current_user: User, db: Session) -> Order:
     # Verify partner exists
     partner = db.query(Partner).filter(Partner.id == order_data.partner_id).first()
     if not partner:
         raise HTTPException(status_code=404, detail="Partner not found")
     
-    # Calculate total and verify products
+    # Admission control, counted in the database so the limits hold across workers
+    try:
+        admit(db, partner)
+    except OrderRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+    
+    # Calculate total and verify products; prices come from the server, not the client
+    price_table = pricing.get_table(db, order_data.partner_id)
     total_amount = 0
     order_items = []
+    product_ids = {item_data.product_id for item_data in order_data.items}
+    products = {product.id: product for product in db.query(Product).filter(Product.id.in_(product_ids))}
     for item_data in order_data.items:
-        product = db.query(Product).filter(Product.id == item_data.product_id).first()
+        product = products.get(item_data.product_id)
         if not product:
             raise HTTPException(status_code=404, detail=f"Product {item_data.product_id} not found")
         if product.partner_id != order_data.partner_id:
             raise HTTPException(status_code=400, detail="Product does not belong to this partner")
-        if not product.is_available:
+        if not product.is_available or product.price is None:
             raise HTTPException(status_code=400, detail=f"Product {product.name} is not available")
         
-        total_amount += item_data.price * item_data.quantity
-        order_items.append(OrderItem(
-            product_id=item_data.product_id,
-            quantity=item_data.quantity,
-            price=item_data.price
-        ))
+        if item_data.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantity must be positive")
+        
+        unit_price = price_table.unit_price(product.price)
+        total_amount += unit_price * item_data.quantity
+        order_items.append({
+            "product_id": item_data.product_id,
+            "quantity": item_data.quantity,
+            "price": unit_price
+        })
     
     # Create order
     qr_code = str(uuid.uuid4())
@@ -87,31 +192,30 @@ async def create_order(
         customer_id=current_user.id,
         partner_id=order_data.partner_id,
         status=OrderStatus.IN_QUEUE,
-        total_amount=total_amount,
+        total_amount=round(total_amount, 2),
         qr_code=qr_code
     )
     db.add(db_order)
     db.flush()
     
-    # Add order items
+    # Add order items (one executemany)
     for item in order_items:
-        item.order_id = db_order.id
-        db.add(item)
-    
-    db.commit()
-    db.refresh(db_order)
+        item["order_id"] = db_order.id
+    db.execute(insert(OrderItem), order_items)
+    db.add(OrderStatusChange(
+        order_id=db_order.id,
+        partner_id=db_order.partner_id,
+        status=OrderStatus.IN_QUEUE,
+        changed_at=datetime.utcnow()
+    ))
     
-    # Notify partner via WebSocket
-    order_data_dict = {
-        "id": db_order.id,
-        "status": db_order.status.value,
-        "customer_id": db_order.customer_id,
-        "partner_id": db_order.partner_id,
-        "total_amount": db_order.total_amount,
-        "updated_at": db_order.updated_at.isoformat() if db_order.updated_at else None
-    }
-    await manager.broadcast_order_update(order_data_dict, current_user.id, partner.user_id)
+    db.flush()
+    stats_rollup.record_order_created(db, db_order)
     
+    # Notify partner via WebSocket (delivered by the outbox dispatcher after commit)
+    enqueue_order_update(db, db_order, [current_user.id, partner.user_id])
+    enqueue_partner_load(db, db_order.partner_id)
+    db.commit()
     return db_order
 
 @router.get("/orders", response_model=List[OrderResponse])
@@ -122,8 +226,8 @@ def get_my_orders(
     if current_user.user_type != UserType.CUSTOMER:
         raise HTTPException(status_code=403, detail="Only customers can view orders")
     
-    orders = db.query(Order).filter(Order.customer_id == current_user.id).order_by(Order.created_at.desc()).all()
-    return orders
+    query = db.query(Order).filter(Order.customer_id == current_user.id).order_by(Order.created_at.desc())
+    return FastJSONResponse(order_dicts(db, query))
 
 @router.get("/orders/{order_id}", response_model=OrderResponse)
 def get_order(
@@ -136,5 +240,5 @@ def get_order(
         raise HTTPException(status_code=404, detail="Order not found")
     if order.customer_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not your order")
-    return order
+    return FastJSONResponse(order_dicts(db, db.query(Order).filter(Order.id == order.id))[0])
 
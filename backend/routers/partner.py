@@ -1,18 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from typing import List
-from database import get_db
-from models import User, Partner, Product, Promotion, Order, OrderItem, OrderStatus, UserType, PartnerImage
-from routers.websocket import manager
+from typing import List, Optional
+from datetime import datetime
+import csv
+import json
+from database import get_db, SessionLocal
+from models import (
+    User, Partner, Product, Promotion, Order, OrderItem, OrderStatus, UserType, PartnerImage, OrderStatusChange,
+    PartnerDailyStats, PartnerDailyProductStats
+)
+from outbox import enqueue_order_update, enqueue_partner_load, wake_dispatcher
 from schemas import (
-    PartnerResponse, PartnerUpdate,
+    PartnerResponse, PartnerProfileResponse, PartnerUpdate,
     ProductCreate, ProductResponse, ProductUpdate,
+    ProductImportResponse, ProductAvailabilityUpdate, ProductAvailabilityResponse,
     PromotionCreate, PromotionResponse, PromotionUpdate,
     OrderResponse, OrderUpdate,
     StatisticsResponse, PartnerImageResponse, PartnerImageCreate,
-    DailySalesData, PopularProduct
+    DailySalesData, PopularProduct, PartnerQueueResponse, AnalyticsResponse
 )
+from order_queue import tracker
+import stats_rollup
+import stats_cache
+import catalog_cache
+import catalog_sync
+import pricing
+import product_import
+import analytics
+from map_index import index as map_index
+from fast_json import FastJSONResponse, order_dicts, product_projection, promotion_projection, partner_image_projection
 from auth import get_current_user
 
 router = APIRouter(prefix="/api/partner", tags=["partner"])
@@ -27,27 +46,125 @@ def get_partner_profile(current_user: User = Depends(get_current_user), db: Sess
     return partner
 
 # Partner Profile
-@router.get("/profile", response_model=PartnerResponse)
+@router.get("/profile", response_model=PartnerProfileResponse)
 def get_profile(partner: Partner = Depends(get_partner_profile)):
     return partner
 
-@router.put("/profile", response_model=PartnerResponse)
+@router.put("/profile", response_model=PartnerProfileResponse)
 def update_profile(
     partner_data: PartnerUpdate,
     partner: Partner = Depends(get_partner_profile),
     db: Session = Depends(get_db)
 ):
-    for key, value in partner_data.dict(exclude_unset=True).items():
+    values = partner_data.dict(exclude_unset=True)
+    for key in ("max_open_orders", "max_orders_per_window"):
+        if values.get(key) is not None and values[key] < 0:
+            raise HTTPException(status_code=400, detail=f"{key} must not be negative")
+    for key, limit in (("latitude", 90), ("longitude", 180)):
+        if key in values and (values[key] is None or not -limit <= values[key] <= limit):
+            raise HTTPException(status_code=400, detail=f"{key} must be between -{limit} and {limit}")
+    for key, value in values.items():
         setattr(partner, key, value)
+    enqueue_partner_load(db, partner.id)
     db.commit()
+    catalog_cache.invalidate(partner.id)
     db.refresh(partner)
+    map_index.upsert(partner.id, partner.latitude, partner.longitude)
+    wake_dispatcher()
     return partner
 
 # Orders
 @router.get("/orders", response_model=List[OrderResponse])
 def get_orders(partner: Partner = Depends(get_partner_profile), db: Session = Depends(get_db)):
-    orders = db.query(Order).filter(Order.partner_id == partner.id).order_by(Order.created_at.desc()).all()
-    return orders
+    query = db.query(Order).filter(Order.partner_id == partner.id).order_by(Order.created_at.desc())
+    return FastJSONResponse(order_dicts(db, query))
+
+@router.get("/queue", response_model=PartnerQueueResponse)
+def get_queue(partner: Partner = Depends(get_partner_profile)):
+    return tracker.snapshot(partner.id)
+
+# Order history export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = [
+    "order_id", "created_at", "updated_at", "status", "customer_id", "total_amount",
+    "product_id", "product_name", "quantity", "price"
+]
+
+class _LineBuffer:
+    """File-like object for csv.writer that returns the written line instead of storing it"""
+    def write(self, value):
+        return value
+
+def _iter_export_rows(partner_id: int, date_from: Optional[datetime], date_to: Optional[datetime]):
+    # The export can outlive the request session, so it uses its own one.
+    # yield_per streams rows with a server-side cursor instead of loading the whole history.
+    db = SessionLocal()
+    try:
+        query = db.query(
+            Order.id, Order.created_at, Order.updated_at, Order.status, Order.customer_id, Order.total_amount,
+            OrderItem.product_id, Product.name, OrderItem.quantity, OrderItem.price
+        ).outerjoin(
+            OrderItem, OrderItem.order_id == Order.id
+        ).outerjoin(
+            Product, OrderItem.product_id == Product.id
+        ).filter(Order.partner_id == partner_id)
+        if date_from:
+            query = query.filter(Order.created_at >= date_from)
+        if date_to:
+            query = query.filter(Order.created_at < date_to)
+        query = query.order_by(Order.created_at, Order.id, OrderItem.id).yield_per(EXPORT_BATCH_SIZE)
+        for row in query:
+            yield [
+                row[0],
+                row[1].isoformat() if row[1] else None,
+                row[2].isoformat() if row[2] else None,
+                row[3].value if row[3] else None,
+                *row[4:]
+            ]
+    finally:
+        db.close()
+
+def _batched(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+def _export_csv(rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(EXPORT_COLUMNS)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+def _export_ndjson(rows):
+    yield from _batched(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+    )
+
+@router.get("/orders/export")
+def export_orders(
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    partner: Partner = Depends(get_partner_profile)
+):
+    """Stream order history, one line per order item, in CSV or NDJSON"""
+    date_from = catalog_sync.naive_utc(date_from) if date_from else None
+    date_to = catalog_sync.naive_utc(date_to) if date_to else None
+    rows = _iter_export_rows(partner.id, date_from, date_to)
+    if export_format == "ndjson":
+        body, media_type = _export_ndjson(rows), "application/x-ndjson"
+    else:
+        body, media_type = _export_csv(rows), "text/csv"
+    filename = f"orders-{partner.id}.{export_format}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @router.get("/orders/{order_id}", response_model=OrderResponse)
 def get_order(
@@ -58,7 +175,7 @@ def get_order(
     order = db.query(Order).filter(Order.id == order_id, Order.partner_id == partner.id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    return FastJSONResponse(order_dicts(db, db.query(Order).filter(Order.id == order.id))[0])
 
 @router.put("/orders/{order_id}", response_model=OrderResponse)
 async def update_order(
@@ -71,23 +188,33 @@ async def update_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if order_data.status:
+    old_status = order.status
+    changed_at = None
+    if order_data.status and order_data.status != old_status:
         order.status = order_data.status
+        changed_at = datetime.utcnow()
+        db.add(OrderStatusChange(
+            order_id=order.id,
+            partner_id=order.partner_id,
+            status=order.status,
+            changed_at=changed_at
+        ))
+        stats_rollup.record_status_change(db, order, old_status)
+    db.flush()
+    
+    # Notify via WebSocket (delivered by the outbox dispatcher after commit)
+    enqueue_order_update(db, order, [order.customer_id, partner.user_id])
+    if changed_at:
+        enqueue_partner_load(db, partner.id)
     db.commit()
+    stats_cache.invalidate(partner.id)
     db.refresh(order)
+    # Before the wakeup, so the dispatcher sends the new load
+    if changed_at:
+        tracker.status_changed(order.partner_id, old_status, order.status, order.created_at, changed_at)
+    wake_dispatcher()
     
-    # Notify via WebSocket
-    order_data_dict = {
-        "id": order.id,
-        "status": order.status.value,
-        "customer_id": order.customer_id,
-        "partner_id": order.partner_id,
-        "total_amount": order.total_amount,
-        "updated_at": order.updated_at.isoformat() if order.updated_at else None
-    }
-    await manager.broadcast_order_update(order_data_dict, order.customer_id, partner.user_id)
-    
-    return order
+    return FastJSONResponse(order_dicts(db, db.query(Order).filter(Order.id == order.id))[0])
 
 @router.delete("/orders/{order_id}")
 def delete_order(
@@ -102,14 +229,17 @@ def delete_order(
     if order.status != OrderStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="Can only delete completed orders")
     
+    stats_rollup.record_order_deleted(db, order)
     db.delete(order)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    tracker.order_deleted(partner.id, OrderStatus.COMPLETED)
     return {"message": "Order deleted successfully"}
 
 # Products
 @router.get("/products", response_model=List[ProductResponse])
 def get_products(partner: Partner = Depends(get_partner_profile), db: Session = Depends(get_db)):
-    return db.query(Product).filter(Product.partner_id == partner.id).all()
+    return FastJSONResponse(product_projection.all(db.query(Product).filter(Product.partner_id == partner.id)))
 
 @router.post("/products", response_model=ProductResponse)
 def create_product(
@@ -117,13 +247,10 @@ def create_product(
     partner: Partner = Depends(get_partner_profile),
     db: Session = Depends(get_db)
 ):
-    # Calculate final price if original_price and discount_percent are provided
-    final_price = product_data.price
-    if product_data.original_price and product_data.discount_percent:
-        final_price = product_data.original_price * (1 - product_data.discount_percent / 100)
-    elif product_data.original_price:
-        final_price = product_data.original_price
-    elif not final_price:
+    final_price, original_price = pricing.product_prices(
+        product_data.price, product_data.original_price, product_data.discount_percent
+    )
+    if not final_price:
         raise HTTPException(status_code=400, detail="Either price or original_price must be provided")
     
     db_product = Product(
@@ -131,16 +258,74 @@ def create_product(
         name=product_data.name,
         description=product_data.description,
         price=final_price,
-        original_price=product_data.original_price,
+        original_price=original_price,
         discount_percent=product_data.discount_percent,
         image_url=product_data.image_url,
         is_available=product_data.is_available
     )
     db.add(db_product)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     db.refresh(db_product)
     return db_product
 
+async def _read_import_body(request: Request) -> bytes:
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > product_import.PRODUCT_IMPORT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {product_import.PRODUCT_IMPORT_MAX_BYTES} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+@router.post("/products/bulk", response_model=ProductImportResponse)
+async def bulk_import_products(
+    request: Request,
+    dry_run: bool = False,
+    partner: Partner = Depends(get_partner_profile)
+):
+    """Create or update many products from a CSV file (text/csv) or a JSON array (application/json)"""
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        parse = product_import.iter_csv
+    elif "json" in content_type:
+        parse = product_import.iter_json
+    else:
+        raise HTTPException(status_code=415, detail="Send the products as text/csv or application/json")
+    
+    body = await _read_import_body(request)
+    try:
+        result = await run_in_threadpool(product_import.import_products, partner.id, parse(body), dry_run)
+    except product_import.ImportFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if not dry_run and (result["created"] or result["updated"]):
+        stats_cache.invalidate(partner.id)
+        catalog_cache.invalidate(partner.id)
+        pricing.invalidate(partner.id)
+    return result
+
+@router.post("/products/availability", response_model=ProductAvailabilityResponse)
+def set_products_availability(
+    availability: ProductAvailabilityUpdate,
+    partner: Partner = Depends(get_partner_profile),
+    db: Session = Depends(get_db)
+):
+    """Mark many products (or the whole menu) available or sold out with a single UPDATE"""
+    query = db.query(Product).filter(
+        Product.partner_id == partner.id,
+        Product.is_available.isnot(availability.is_available)
+    )
+    if availability.product_ids is not None:
+        query = query.filter(Product.id.in_(availability.product_ids))
+    updated = query.update({Product.is_available: availability.is_available}, synchronize_session=False)
+    db.commit()
+    if updated:
+        catalog_cache.invalidate(partner.id)
+        pricing.invalidate(partner.id)
+    return {"updated": updated}
+
 @router.put("/products/{product_id}", response_model=ProductResponse)
 def update_product(
     product_id: int,
@@ -152,18 +337,16 @@ def update_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Calculate final price if original_price and discount_percent are provided
+    # Recalculate the final price from the resulting original_price and discount
     update_data = product_data.dict(exclude_unset=True)
-    if 'original_price' in update_data and 'discount_percent' in update_data:
-        if update_data['original_price'] is not None and update_data['discount_percent'] is not None:
-            update_data['price'] = update_data['original_price'] * (1 - update_data['discount_percent'] / 100)
-    elif 'original_price' in update_data and update_data['original_price'] is not None:
-        if 'discount_percent' not in update_data or update_data.get('discount_percent') is None:
-            update_data['price'] = update_data['original_price']
+    pricing.reprice_update(update_data, product.price, product.original_price, product.discount_percent)
     
     for key, value in update_data.items():
         setattr(product, key, value)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     db.refresh(product)
     return product
 
@@ -177,14 +360,18 @@ def delete_product(
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    catalog_sync.record_deleted(db, product)
     db.delete(product)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     return {"message": "Product deleted successfully"}
 
 # Promotions
 @router.get("/promotions", response_model=List[PromotionResponse])
 def get_promotions(partner: Partner = Depends(get_partner_profile), db: Session = Depends(get_db)):
-    return db.query(Promotion).filter(Promotion.partner_id == partner.id).all()
+    return FastJSONResponse(promotion_projection.all(db.query(Promotion).filter(Promotion.partner_id == partner.id)))
 
 @router.post("/promotions", response_model=PromotionResponse)
 def create_promotion(
@@ -203,6 +390,9 @@ def create_promotion(
     )
     db.add(db_promotion)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     db.refresh(db_promotion)
     return db_promotion
 
@@ -220,6 +410,9 @@ def update_promotion(
     for key, value in promotion_data.dict(exclude_unset=True).items():
         setattr(promotion, key, value)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     db.refresh(promotion)
     return promotion
 
@@ -233,104 +426,123 @@ def delete_promotion(
     if not promotion:
         raise HTTPException(status_code=404, detail="Promotion not found")
     
+    catalog_sync.record_deleted(db, promotion)
     db.delete(promotion)
     db.commit()
+    stats_cache.invalidate(partner.id)
+    catalog_cache.invalidate(partner.id)
+    pricing.invalidate(partner.id)
     return {"message": "Promotion deleted successfully"}
 
 # Statistics
 @router.get("/statistics", response_model=StatisticsResponse)
 def get_statistics(partner: Partner = Depends(get_partner_profile), db: Session = Depends(get_db)):
-    from datetime import datetime, timedelta
-    from collections import defaultdict
+    body = stats_cache.get(partner.id)
+    if body is None:
+        body = compute_statistics(partner, db).model_dump_json().encode()
+        stats_cache.put(partner.id, body)
+    return Response(content=body, media_type="application/json")
+
+def compute_statistics(partner: Partner, db: Session) -> StatisticsResponse:
+    from datetime import timedelta
     
-    total_orders = db.query(Order).filter(Order.partner_id == partner.id).count()
-    completed_orders = db.query(Order).filter(
-        Order.partner_id == partner.id,
-        Order.status == OrderStatus.COMPLETED
-    ).count()
-    total_revenue = db.query(Order).filter(
-        Order.partner_id == partner.id,
-        Order.status == OrderStatus.COMPLETED
-    ).with_entities(func.sum(Order.total_amount)).scalar() or 0.0
+    # Served from the daily rollups maintained by stats_rollup
+    totals = db.query(
+        func.sum(PartnerDailyStats.orders),
+        func.sum(PartnerDailyStats.completed_orders),
+        func.sum(PartnerDailyStats.revenue)
+    ).filter(PartnerDailyStats.partner_id == partner.id).one()
     active_promotions = db.query(Promotion).filter(
         Promotion.partner_id == partner.id,
         Promotion.is_active == True
     ).count()
     total_products = db.query(Product).filter(Product.partner_id == partner.id).count()
     
-    # Получаем заказы за последние 30 дней
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_orders = db.query(Order).filter(
-        Order.partner_id == partner.id,
-        Order.created_at >= thirty_days_ago
-    ).all()
-    
-    # Группируем по дням
-    daily_data = defaultdict(lambda: {'orders': 0, 'revenue': 0.0, 'customers': set()})
-    for order in recent_orders:
-        date_str = order.created_at.date().isoformat()
-        daily_data[date_str]['orders'] += 1
-        if order.status == OrderStatus.COMPLETED:
-            daily_data[date_str]['revenue'] += order.total_amount
-        daily_data[date_str]['customers'].add(order.customer_id)
-    
-    # Формируем список за последние 30 дней
+    # Данные за последние 30 дней
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=29)
+    daily_rows = {
+        row.day: row
+        for row in db.query(PartnerDailyStats).filter(
+            PartnerDailyStats.partner_id == partner.id,
+            PartnerDailyStats.day >= first_day
+        )
+    }
     daily_sales = []
     for i in range(30):
-        date = (datetime.utcnow() - timedelta(days=i)).date()
-        date_str = date.isoformat()
-        data = daily_data.get(date_str, {'orders': 0, 'revenue': 0.0, 'customers': set()})
-        daily_sales.append({
-            'date': date_str,
-            'orders': data['orders'],
-            'revenue': data['revenue'],
-            'customers': len(data['customers'])
-        })
-    daily_sales.reverse()  # От старых к новым
+        day = first_day + timedelta(days=i)  # От старых к новым
+        row = daily_rows.get(day)
+        daily_sales.append(DailySalesData(
+            date=day.isoformat(),
+            orders=row.orders if row else 0,
+            revenue=row.revenue if row else 0.0,
+            customers=row.customers if row else 0
+        ))
     
     # Популярные товары (топ 10)
+    total_quantity = func.sum(PartnerDailyProductStats.quantity)
     popular_items = db.query(
-        OrderItem.product_id,
+        PartnerDailyProductStats.product_id,
         Product.name,
-        func.sum(OrderItem.quantity).label('total_quantity'),
-        func.sum(OrderItem.price * OrderItem.quantity).label('total_revenue')
-    ).join(
-        Product, OrderItem.product_id == Product.id
+        total_quantity.label('total_quantity'),
+        func.sum(PartnerDailyProductStats.revenue).label('total_revenue')
     ).join(
-        Order, OrderItem.order_id == Order.id
+        Product, PartnerDailyProductStats.product_id == Product.id
     ).filter(
-        Order.partner_id == partner.id,
-        Order.status == OrderStatus.COMPLETED
+        PartnerDailyProductStats.partner_id == partner.id
     ).group_by(
-        OrderItem.product_id, Product.name
+        PartnerDailyProductStats.product_id, Product.name
+    ).having(
+        total_quantity > 0
     ).order_by(
-        func.sum(OrderItem.quantity).desc()
+        total_quantity.desc()
     ).limit(10).all()
     
-    popular_products = [
-        {
-            'product_id': item.product_id,
-            'product_name': item.name,
-            'total_quantity': int(item.total_quantity),
-            'total_revenue': float(item.total_revenue or 0.0)
-        }
-        for item in popular_items
-    ]
-    
     return StatisticsResponse(
-        total_orders=total_orders,
-        completed_orders=completed_orders,
-        total_revenue=total_revenue,
+        total_orders=totals[0] or 0,
+        completed_orders=totals[1] or 0,
+        total_revenue=totals[2] or 0.0,
         active_promotions=active_promotions,
         total_products=total_products,
-        daily_sales=[DailySalesData(**d) for d in daily_sales],
-        popular_products=[PopularProduct(**p) for p in popular_products]
+        daily_sales=daily_sales,
+        popular_products=[
+            PopularProduct(
+                product_id=item.product_id,
+                product_name=item.name,
+                total_quantity=int(item.total_quantity),
+                total_revenue=float(item.total_revenue or 0.0)
+            )
+            for item in popular_items
+        ]
     )
 
+@router.get("/analytics", response_model=AnalyticsResponse)
+def get_analytics(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    granularity: str = Query("day", pattern="^(hour|day|week|month)$"),
+    dimensions: str = Query("", description="Comma separated: status, product, heatmap, customers"),
+    partner: Partner = Depends(get_partner_profile),
+    db: Session = Depends(get_db)
+):
+    from datetime import timedelta
+    
+    # Timestamps are stored as naive UTC; bounds with an offset are converted to it
+    date_to = catalog_sync.naive_utc(date_to) if date_to else datetime.utcnow()
+    date_from = catalog_sync.naive_utc(date_from) if date_from else date_to - timedelta(days=30)
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="date_from must be earlier than date_to")
+    requested = [d.strip() for d in dimensions.split(",") if d.strip()]
+    unknown = set(requested) - set(analytics.DIMENSIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown dimensions: {', '.join(sorted(unknown))}")
+    return analytics.build_report(db, partner.id, date_from, date_to, granularity, requested)
+
 # Partner Images
 @router.get("/images", response_model=List[PartnerImageResponse])
 def get_partner_images(partner: Partner = Depends(get_partner_profile), db: Session = Depends(get_db)):
-    return db.query(PartnerImage).filter(PartnerImage.partner_id == partner.id).order_by(PartnerImage.created_at.desc()).all()
+    query = db.query(PartnerImage).filter(PartnerImage.partner_id == partner.id).order_by(PartnerImage.created_at.desc())
+    return FastJSONResponse(partner_image_projection.all(query))
 
 @router.post("/images", response_model=PartnerImageResponse)
 async def upload_partner_image(
@@ -356,6 +568,7 @@ def delete_partner_image(
     image = db.query(PartnerImage).filter(PartnerImage.id == image_id, PartnerImage.partner_id == partner.id).first()
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
+    catalog_sync.record_deleted(db, image)
     db.delete(image)
     db.commit()
     return {"message": "Image deleted successfully"}
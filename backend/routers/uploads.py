@@ -1,52 +1,409 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, UploadFile, File, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import RedirectResponse, JSONResponse
+from file_response import file_response
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User, UserType
+from models import User, UserType, StoredUpload
 from auth import get_current_user
+from schemas import UploadPresignRequest, UploadCompleteRequest
+from storage import storage, LocalStorage, verify_direct_upload
+from typing import AsyncIterator, Optional
+import image_variants
+import aiofiles
+import aiofiles.os
+import hashlib
 import os
+import re
 import uuid
 from pathlib import Path
+from starlette.datastructures import Headers
 
 router = APIRouter(prefix="/api/uploads", tags=["uploads"])
 
-UPLOAD_DIR = Path("uploads")
+# Scratch space for uploads in progress; with the local backend it is also the storage root
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "uploads"))
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+CONTENT_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+EXTENSIONS_BY_CONTENT_TYPE = {content_type: ext for ext, content_type in CONTENT_TYPES.items()}
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Multipart request bodies: the file plus room for the boundaries and part headers
+MAX_UPLOAD_BODY_SIZE = MAX_UPLOAD_SIZE + UPLOAD_CHUNK_SIZE
+
+# File signatures of the allowed image types; IMAGE_HEADER_SIZE bytes cover all of them
+IMAGE_HEADER_SIZE = 16
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+
+# Content-addressed files are named <sha256><ext>
+CONTENT_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z]+$")
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+# Anything else that may be requested: uuid-named legacy uploads
+SAFE_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,127}\.(jpg|jpeg|png|gif|webp)$", re.IGNORECASE)
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+LEGACY_CACHE = "public, max-age=86400"
+# Negotiated ?w= responses may switch to a resized variant once it has been generated
+PENDING_VARIANT_CACHE = "public, max-age=60"
+REDIRECT_CACHE = "public, max-age=300"
+
+# Variants never change once they exist, so remote existence checks are remembered
+_known_remote_keys = set()
+KNOWN_REMOTE_KEYS_LIMIT = 10000
+
+class _BodyTooLarge(Exception):
+    pass
+
+class UploadSizeLimitMiddleware:
+    """
+    Caps the body of POST /api/uploads/image before FastAPI parses the multipart
+    form (which spools the whole file to disk before the handler runs): a
+    Content-Length over the cap is rejected without reading anything, and
+    bodies without one are counted while they stream in.
+    """
+    def __init__(self, app, path: str = "/api/uploads/image", max_body_size: int = MAX_UPLOAD_BODY_SIZE):
+        self.app = app
+        self.path = path
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        too_large = JSONResponse(
+            status_code=413, content={"detail": f"File too large. Maximum size: {MAX_UPLOAD_SIZE} bytes"}
+        )
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def counting_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # FastAPI turns errors while parsing the form into a 400; answer 413 instead
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                if exceeded:
+                    await too_large(scope, receive, send)
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await too_large(scope, receive, send)
 
 def is_allowed_file(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
+def detect_image_type(header: bytes) -> Optional[str]:
+    """Returns the extension matching the file's magic bytes, or None if it is not an allowed image"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return extension
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(CONTENT_NAME.match(filename))
+
+def storage_key(filename: str) -> str:
+    """
+    Content-addressed files live in a two-level fan-out (ab/cd/abcd...ext) to keep
+    directories small; older uuid-named uploads stay at the top level.
+    """
+    if is_content_addressed(filename):
+        return f"{filename[:2]}/{filename[2:4]}/{filename}"
+    return filename
+
+def variant_prefix(filename: str) -> str:
+    if is_content_addressed(filename):
+        return f"{filename[:2]}/{filename[2:4]}/"
+    return f"{image_variants.VARIANTS_SUBDIR}/"
+
+def upload_response(filename: str) -> dict:
+    url = f"/api/uploads/{filename}"
+    return {"url": url, "variants": image_variants.variant_urls(url)}
+
+async def _remove_quietly(path: Path):
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def _stream_to_temp(chunks: AsyncIterator[bytes], temp_path: Path):
+    """Write chunks to temp_path enforcing the size cap, returns (extension, sha256 hex, size)"""
+    digest = hashlib.sha256()
+    file_ext = None
+    size = 0
+    async with aiofiles.open(temp_path, "wb") as buffer:
+        async for chunk in chunks:
+            if file_ext is None:
+                file_ext = detect_image_type(chunk)
+                if not file_ext:
+                    raise HTTPException(status_code=400, detail="File content is not a valid jpg, png, gif or webp image")
+            size += len(chunk)
+            if size > MAX_UPLOAD_SIZE:
+                raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {MAX_UPLOAD_SIZE} bytes")
+            digest.update(chunk)
+            await buffer.write(chunk)
+    if file_ext is None:
+        raise HTTPException(status_code=400, detail="Empty file")
+    return file_ext, digest.hexdigest(), size
+
+async def _read_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def _register_upload(db: Session, content_hash: str, file_ext: str, size: int) -> bool:
+    """
+    Record the content or restart its GC grace period if it is known,
+    returns True if it was not known before
+    """
+    updated = db.query(StoredUpload).filter(StoredUpload.content_hash == content_hash).update(
+        {StoredUpload.last_uploaded_at: func.now()}, synchronize_session=False
+    )
+    if updated:
+        db.commit()
+        return False
+    try:
+        db.add(StoredUpload(content_hash=content_hash, extension=file_ext, size=size))
+        db.commit()
+        return True
+    except IntegrityError:
+        # A concurrent upload of the same content registered it first
+        db.rollback()
+        return _register_upload(db, content_hash, file_ext, size)
+
+def _schedule_variants(filename: str, local_source: Optional[Path] = None, remove_source: bool = False):
+    key = storage_key(filename)
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        image_variants.schedule_variants(local_path, storage.local_path(variant_prefix(filename)))
+    elif local_source is not None:
+        image_variants.schedule_remote_variants(storage, local_source, variant_prefix(filename), remove_source)
+
+def _download_and_schedule_variants(filename: str):
+    temp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    storage.download(storage_key(filename), temp_path)
+    _schedule_variants(filename, temp_path, remove_source=True)
+
 @router.post("/image")
 async def upload_image(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
+    # The request body is capped by UploadSizeLimitMiddleware before the form is parsed
     if not is_allowed_file(file.filename):
         raise HTTPException(status_code=400, detail="Invalid file type. Allowed: jpg, jpeg, png, gif, webp")
     
-    # Generate unique filename
-    file_ext = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOAD_DIR / unique_filename
-    
-    # Save file
+    # Stream into a temp file while hashing, then store it under its content address
+    temp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    keep_temp = False
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        file_ext, content_hash, size = await _stream_to_temp(_read_upload(file), temp_path)
+        filename = f"{content_hash}{file_ext}"
+        key = storage_key(filename)
+        
+        known = db.query(StoredUpload.id).filter(StoredUpload.content_hash == content_hash).first()
+        if known and await run_in_threadpool(storage.exists, key):
+            # Same bytes were uploaded before: reuse the existing file, unless the
+            # GC deleted its record (and so the file) in the meantime
+            if not _register_upload(db, content_hash, file_ext, size):
+                return upload_response(filename)
+        
+        if isinstance(storage, LocalStorage):
+            await run_in_threadpool(storage.move_file, temp_path, key)
+        else:
+            await run_in_threadpool(storage.save_file, temp_path, key)
+            keep_temp = True  # source for the variant workers, removed by them
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving file: {str(e)}")
+    finally:
+        if not keep_temp:
+            await _remove_quietly(temp_path)
     
-    # Return URL
-    return {"url": f"/api/uploads/{unique_filename}"}
+    _register_upload(db, content_hash, file_ext, size)
+    # Resized variants are produced in the background
+    _schedule_variants(filename, temp_path, remove_source=True)
+    return upload_response(filename)
 
-@router.get("/{filename}")
-async def get_uploaded_file(filename: str):
-    file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path)
+# Direct uploads: the client sends bytes straight to storage using a presigned URL,
+# then calls /complete so the API records the metadata.
+@router.post("/presign")
+def presign_upload(
+    upload: UploadPresignRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    content_hash = upload.sha256.lower()
+    file_ext = EXTENSIONS_BY_CONTENT_TYPE.get(upload.content_type)
+    if not SHA256_HEX.match(content_hash):
+        raise HTTPException(status_code=400, detail="sha256 must be a hex encoded SHA-256 digest")
+    if not file_ext:
+        raise HTTPException(status_code=400, detail="Invalid content type. Allowed: image/jpeg, image/png, image/gif, image/webp")
+    if not 0 < upload.size <= MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {MAX_UPLOAD_SIZE} bytes")
+    
+    filename = f"{content_hash}{file_ext}"
+    key = storage_key(filename)
+    known = db.query(StoredUpload.id).filter(StoredUpload.content_hash == content_hash).first()
+    if known and storage.exists(key) and not _register_upload(db, content_hash, file_ext, upload.size):
+        return {**upload_response(filename), "upload": None}
+    
+    presigned = storage.presigned_put(key, upload.content_type, upload.size, content_hash)
+    return {
+        **upload_response(filename),
+        "upload": {
+            "url": presigned.url,
+            "method": presigned.method,
+            "headers": presigned.headers,
+            "expires_in": presigned.expires_in,
+        }
+    }
 
+@router.put("/direct/{filename}")
+async def direct_upload(
+    filename: str,
+    request: Request,
+    size: int = Query(...),
+    expires: int = Query(...),
+    signature: str = Query(...)
+):
+    """Target of presigned PUT URLs issued by the local storage backend"""
+    if not isinstance(storage, LocalStorage):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not is_content_addressed(filename) or not verify_direct_upload(filename, size, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload URL")
+    
+    temp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    try:
+        file_ext, content_hash, received = await _stream_to_temp(request.stream(), temp_path)
+        if received != size or f"{content_hash}{file_ext}" != filename:
+            raise HTTPException(status_code=400, detail="Uploaded content does not match the presigned hash or size")
+        await run_in_threadpool(storage.move_file, temp_path, storage_key(filename))
+    finally:
+        await _remove_quietly(temp_path)
+    return {"url": f"/api/uploads/{filename}"}
+
+@router.post("/complete")
+def complete_upload(
+    upload: UploadCompleteRequest,
+    background_tasks: BackgroundTasks,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    content_hash = upload.sha256.lower()
+    file_ext = EXTENSIONS_BY_CONTENT_TYPE.get(upload.content_type)
+    if not SHA256_HEX.match(content_hash) or not file_ext:
+        raise HTTPException(status_code=400, detail="Invalid sha256 or content type")
+    
+    filename = f"{content_hash}{file_ext}"
+    key = storage_key(filename)
+    # The bytes went straight to storage: check them like upload_image does before
+    # recording anything, and remove what does not pass so it cannot be served
+    stored_object = storage.stat(key)
+    if stored_object is None:
+        raise HTTPException(status_code=404, detail="Upload not found in storage")
+    if stored_object.size > MAX_UPLOAD_SIZE:
+        storage.delete(key)
+        raise HTTPException(status_code=413, detail=f"File too large. Maximum size: {MAX_UPLOAD_SIZE} bytes")
+    if detect_image_type(storage.read_head(key, IMAGE_HEADER_SIZE)) != file_ext:
+        storage.delete(key)
+        raise HTTPException(status_code=400, detail="File content is not a valid image of the declared type")
+    
+    if _register_upload(db, content_hash, file_ext, stored_object.size):
+        if isinstance(storage, LocalStorage):
+            _schedule_variants(filename)
+        else:
+            background_tasks.add_task(_download_and_schedule_variants, filename)
+    return upload_response(filename)
+
+def _remote_exists(key: str) -> bool:
+    if key in _known_remote_keys:
+        return True
+    if not storage.exists(key):
+        return False
+    if len(_known_remote_keys) >= KNOWN_REMOTE_KEYS_LIMIT:
+        _known_remote_keys.clear()
+    _known_remote_keys.add(key)
+    return True
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_uploaded_file(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, gt=0, description="Preferred width, served from the nearest resized variant")
+):
+    # Strict names only: no separators, dots or traversal can reach the storage
+    if not SAFE_NAME.match(filename):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    key = storage_key(filename)
+    immutable = is_content_addressed(filename)
+    cache_control = IMMUTABLE_CACHE if immutable else LEGACY_CACHE
+    headers = {}
+    local = isinstance(storage, LocalStorage)
+    if w:
+        headers["vary"] = "Accept"
+        prefix = variant_prefix(filename)
+        if local:
+            exists = lambda name: storage.local_path(prefix + name).is_file()
+        else:
+            exists = lambda name: _remote_exists(prefix + name)
+        variant = await run_in_threadpool(
+            image_variants.pick_variant, filename, w, request.headers.get("accept"), exists
+        )
+        if variant:
+            key = prefix + variant
+        else:
+            cache_control = PENDING_VARIANT_CACHE
+    
+    if not local:
+        if not w and not await run_in_threadpool(_remote_exists, key):
+            raise HTTPException(status_code=404, detail="File not found")
+        return RedirectResponse(storage.presigned_get_url(key), status_code=307, headers={
+            **headers, "cache-control": REDIRECT_CACHE
+        })
+    
+    file_path = storage.local_path(key)
+    if not file_path.resolve().is_relative_to(storage.root.resolve()):
+        raise HTTPException(status_code=404, detail="File not found")
+    # A content hash is the perfect strong validator; variant names extend it with size and format
+    etag = f'"{file_path.name}"' if immutable else None
+    try:
+        return await file_response(request, file_path, cache_control, etag=etag, headers=headers)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
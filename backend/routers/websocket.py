@@ -2,6 +2,8 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPExcept
 from sqlalchemy.orm import Session
 from database import get_db
 from models import Order, User
+from fastapi.concurrency import run_in_threadpool
+from order_queue import read_partner_load
 from auth import get_user_by_username, get_user_by_email, SECRET_KEY, ALGORITHM
 from typing import Dict, List, Optional
 from jose import JWTError, jwt
@@ -9,9 +11,15 @@ import json
 
 router = APIRouter(prefix="/api/ws", tags=["websocket"])
 
+class DeliveryError(Exception):
+    """A message reached none of the sockets it was meant for"""
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[int, List[WebSocket]] = {}
+        # partner_id -> sockets of customers viewing that partner's load
+        self.viewers: Dict[int, List[WebSocket]] = {}
+        self.send_failures = 0
     
     async def connect(self, websocket: WebSocket, user_id: int):
         await websocket.accept()
@@ -20,18 +28,66 @@ class ConnectionManager:
         self.active_connections[user_id].append(websocket)
     
     def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
+        if user_id in self.active_connections and websocket in self.active_connections[user_id]:
             self.active_connections[user_id].remove(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
     
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                try:
-                    await connection.send_json(message)
-                except:
-                    pass
+    async def _send_all(self, message: dict, sockets: List[WebSocket]) -> int:
+        """
+        Send to every socket, removing the ones that fail from the list; raises
+        DeliveryError when there were sockets and none of them got the message
+        """
+        sent = 0
+        last_error = None
+        for connection in list(sockets):
+            try:
+                await connection.send_json(message)
+                sent += 1
+            except Exception as e:
+                self.send_failures += 1
+                last_error = e
+                # A socket that failed once is dead, its receive loop cleans up the rest
+                if connection in sockets:
+                    sockets.remove(connection)
+        if last_error is not None and not sent:
+            raise DeliveryError(str(last_error) or type(last_error).__name__)
+        return sent
+    
+    async def send_personal_message(self, message: dict, user_id: int) -> int:
+        """Returns the number of sockets that got the message; an offline user gets none"""
+        sockets = self.active_connections.get(user_id)
+        if not sockets:
+            return 0
+        try:
+            return await self._send_all(message, sockets)
+        finally:
+            if not sockets and self.active_connections.get(user_id) is sockets:
+                del self.active_connections[user_id]
+    
+    async def connect_viewer(self, websocket: WebSocket, partner_id: int):
+        await websocket.accept()
+        self.viewers.setdefault(partner_id, []).append(websocket)
+    
+    def disconnect_viewer(self, websocket: WebSocket, partner_id: int):
+        sockets = self.viewers.get(partner_id)
+        if sockets and websocket in sockets:
+            sockets.remove(websocket)
+            if not sockets:
+                del self.viewers[partner_id]
+    
+    def has_viewers(self, partner_id: int) -> bool:
+        return partner_id in self.viewers
+    
+    async def send_to_viewers(self, message: dict, partner_id: int) -> int:
+        sockets = self.viewers.get(partner_id)
+        if not sockets:
+            return 0
+        try:
+            return await self._send_all(message, sockets)
+        finally:
+            if not sockets and self.viewers.get(partner_id) is sockets:
+                del self.viewers[partner_id]
     
     async def broadcast_order_update(self, order_data: dict, customer_id: int, partner_id: int):
         # Send to customer
@@ -68,31 +124,48 @@ async def get_user_from_token(token: Optional[str], db: Session) -> Optional[Use
 
 @router.websocket("/orders/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int, token: Optional[str] = Query(None)):
-    # Get database session manually
+    # Get database session manually; it is only needed for authentication, so the
+    # pooled connection is released before the socket starts its long idle life
     db_gen = get_db()
     db = next(db_gen)
     try:
         # Verify authentication
         user = await get_user_from_token(token, db)
-        if not user:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        
-        # Verify user_id matches authenticated user
-        if user.id != user_id:
-            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-            return
-        
-        await manager.connect(websocket, user_id)
-        try:
-            while True:
-                data = await websocket.receive_text()
-                # Echo back or handle incoming messages
-                await websocket.send_json({"type": "ping", "message": "connected"})
-        except WebSocketDisconnect:
-            manager.disconnect(websocket, user_id)
     finally:
         db.close()
+    if not user:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    # Verify user_id matches authenticated user
+    if user.id != user_id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await manager.connect(websocket, user_id)
+    try:
+        while True:
+            data = await websocket.receive_text()
+            # Echo back or handle incoming messages
+            await websocket.send_json({"type": "ping", "message": "connected"})
+    except WebSocketDisconnect:
+        manager.disconnect(websocket, user_id)
+
+@router.websocket("/partners/{partner_id}/load")
+async def partner_load_endpoint(websocket: WebSocket, partner_id: int):
+    # Public like GET /api/customer/partners/{id}/queue: sends the current load on
+    # connect, then a "partner_load" message whenever it changes
+    await manager.connect_viewer(websocket, partner_id)
+    try:
+        load = await run_in_threadpool(read_partner_load, partner_id)
+        if load is not None:
+            await websocket.send_json({"type": "partner_load", "data": load})
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.disconnect_viewer(websocket, partner_id)
 
 # Helper function to notify about order updates
 async def notify_order_update(order: Order, db: Session):
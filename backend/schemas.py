@@ -43,11 +43,20 @@ class PartnerResponse(PartnerBase):
     class Config:
         from_attributes = True
 
+class PartnerProfileResponse(PartnerResponse):
+    max_open_orders: Optional[int] = None
+    max_orders_per_window: Optional[int] = None
+
 class PartnerUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     address: Optional[str] = None
     phone: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    # null resets to the server default, 0 means unlimited
+    max_open_orders: Optional[int] = None
+    max_orders_per_window: Optional[int] = None
 
 # Partner Image Schemas
 class PartnerImageResponse(BaseModel):
@@ -92,6 +101,36 @@ class ProductUpdate(BaseModel):
     image_url: Optional[str] = None
     is_available: Optional[bool] = None
 
+# Bulk product import
+class ProductImportRow(BaseModel):
+    """One CSV/JSON row: `id` or `name` selects an existing product to update, otherwise a new one is created"""
+    id: Optional[int] = None
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    original_price: Optional[float] = None
+    discount_percent: Optional[float] = None
+    image_url: Optional[str] = None
+    is_available: Optional[bool] = None
+
+class ProductImportError(BaseModel):
+    row: int  # 1-based data row, the CSV header is not counted
+    error: str
+
+class ProductImportResponse(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    dry_run: bool
+    errors: List[ProductImportError]
+
+class ProductAvailabilityUpdate(BaseModel):
+    is_available: bool
+    product_ids: Optional[List[int]] = None  # All of the partner's products when omitted
+
+class ProductAvailabilityResponse(BaseModel):
+    updated: int
+
 # Promotion Schemas
 class PromotionBase(BaseModel):
     title: str
@@ -120,18 +159,34 @@ class PromotionUpdate(BaseModel):
     is_active: Optional[bool] = None
     expires_at: Optional[datetime] = None
 
+# Catalog delta sync
+class CatalogDeletions(BaseModel):
+    partners: List[int]
+    products: List[int]
+    promotions: List[int]
+    partner_images: List[int]
+
+class CatalogChangesResponse(BaseModel):
+    token: str  # Pass back as `since` on the next sync
+    reset: bool  # True when this is the full catalog, not a delta
+    partners: List[PartnerResponse]
+    products: List[ProductResponse]
+    promotions: List[PromotionResponse]
+    partner_images: List[PartnerImageResponse]
+    deleted: CatalogDeletions
+
 # Order Schemas
 class OrderItemCreate(BaseModel):
     product_id: int
     quantity: int
-    price: float
+    price: Optional[float] = None  # Ignored, orders are priced by the server (pricing.py)
 
 class OrderItemResponse(BaseModel):
     id: int
     product_id: int
     quantity: int
     price: float
-    product: ProductResponse
+    product: Optional[ProductResponse] = None  # None once the product has been deleted
     
     class Config:
         from_attributes = True
@@ -149,6 +204,8 @@ class OrderResponse(BaseModel):
     qr_code: Optional[str] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
+    estimated_ready_at: Optional[datetime] = None
+    orders_ahead: Optional[int] = None  # Open orders of the partner placed before this one
     items: List[OrderItemResponse]
     partner: PartnerResponse
     
@@ -158,6 +215,77 @@ class OrderResponse(BaseModel):
 class OrderUpdate(BaseModel):
     status: Optional[OrderStatus] = None
 
+# Cart quote
+class CartQuoteItem(BaseModel):
+    partner_id: int
+    product_id: int
+    quantity: int
+
+class CartQuoteRequest(BaseModel):
+    items: List[CartQuoteItem]
+
+class CartQuoteLine(BaseModel):
+    product_id: int
+    name: str
+    quantity: int
+    base_price: float  # Before any discount
+    unit_price: float  # After product discount and promotion
+    line_total: float
+
+class PartnerQuote(BaseModel):
+    partner_id: int
+    promotion_id: Optional[int] = None  # Best active promotion, applied to every line
+    promotion_discount_percent: Optional[float] = None
+    items: List[CartQuoteLine]
+    subtotal: float  # At base prices
+    total: float
+
+class CartQuoteResponse(BaseModel):
+    partners: List[PartnerQuote]
+    unavailable: List[int]  # Product ids that are unknown, unavailable or not sold by that partner
+    subtotal: float
+    discount: float
+    total: float
+
+class PartnerQueueResponse(BaseModel):
+    partner_id: int
+    in_queue: int
+    in_process: int
+    ready: int
+    open_orders: int
+    average_ready_seconds: int
+
+class MapCluster(BaseModel):
+    latitude: float  # Centroid of the partners in the cluster
+    longitude: float
+    count: int
+    partner_ids: List[int]  # A few representatives, all of them for small clusters
+
+class MapClustersResponse(BaseModel):
+    zoom: int
+    clusters: List[MapCluster]
+
+class PartnerLoadResponse(BaseModel):
+    partner_id: int
+    open_orders: int
+    max_open_orders: Optional[int] = None  # None: unlimited
+    orders_in_window: int
+    max_orders_per_window: Optional[int] = None
+    window_seconds: int
+    accepting_orders: bool
+    retry_after_seconds: Optional[int] = None
+    average_ready_seconds: int
+
+# Upload Schemas
+class UploadPresignRequest(BaseModel):
+    sha256: str  # Hex digest of the file, it becomes the file name
+    size: int
+    content_type: str
+
+class UploadCompleteRequest(BaseModel):
+    sha256: str
+    content_type: str
+
 # Auth Schemas
 class Token(BaseModel):
     access_token: str
@@ -188,3 +316,38 @@ class StatisticsResponse(BaseModel):
     daily_sales: List[DailySalesData]
     popular_products: List[PopularProduct]
 
+
+# Analytics Schemas
+class AnalyticsBucket(BaseModel):
+    bucket: str
+    orders: int
+    completed_orders: int
+    revenue: float
+    customers: int
+
+class StatusBreakdown(BaseModel):
+    status: OrderStatus
+    orders: int
+    amount: float
+
+class ProductBreakdown(BaseModel):
+    product_id: int
+    product_name: Optional[str] = None
+    quantity: int
+    revenue: float
+    orders: int
+
+class CustomerBreakdown(BaseModel):
+    bucket: str
+    new_customers: int
+    returning_customers: int
+
+class AnalyticsResponse(BaseModel):
+    date_from: datetime
+    date_to: datetime
+    granularity: str
+    timeseries: List[AnalyticsBucket]
+    by_status: Optional[List[StatusBreakdown]] = None
+    by_product: Optional[List[ProductBreakdown]] = None
+    heatmap: Optional[List[List[int]]] = None  # 7 weekdays (Monday first) x 24 hours
+    customers: Optional[List[CustomerBreakdown]] = None
@@ -0,0 +1,257 @@
+"""
+Synthetic data generator for load tests and benchmarks.
+
+Seeds partners with coordinates around a few city centres, their products and
+promotions, customers, and orders with items spread over the last --days days.
+Output is reproducible for a given --seed. Rows are written with multi-row
+executemany batches and explicit ids, so a run takes minutes, not hours.
+
+    python seed_data.py                 # 10k partners, 1M products, 5M orders
+    python seed_data.py --scale 0.01    # 1% of that, for a quick local run
+
+All seeded users have the password "password":
+partner<N>@bench.goieat.local and customer<N>@bench.goieat.local.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select
+from database import engine, SessionLocal
+from models import User, UserType, Partner, Product, Promotion, Order, OrderItem, OrderStatus
+from auth import get_password_hash
+import stats_rollup
+import migrate_db
+
+BENCH_PASSWORD = "password"
+BENCH_DOMAIN = "bench.goieat.local"
+
+# (latitude, longitude, spread in degrees)
+CITY_CENTRES = [
+    (55.7558, 37.6173, 0.25),  # Moscow
+    (59.9343, 30.3351, 0.18),  # Saint Petersburg
+    (55.7963, 49.1088, 0.10),  # Kazan
+    (56.8389, 60.6057, 0.10),  # Yekaterinburg
+    (55.0084, 82.9357, 0.10),  # Novosibirsk
+]
+CITY_WEIGHTS = [0.45, 0.25, 0.1, 0.1, 0.1]
+
+DISHES = ["Soup", "Salad", "Burger", "Pizza", "Pasta", "Sushi", "Pie", "Wrap", "Bowl", "Coffee", "Tea", "Cake"]
+ADJECTIVES = ["Fresh", "Spicy", "Classic", "Vegan", "Homemade", "Grilled", "Daily", "Big"]
+
+# Older orders are mostly finished, recent ones are still in progress
+OLD_STATUSES = [(OrderStatus.COMPLETED, 0.85), (OrderStatus.CANCELLED, 0.15)]
+RECENT_STATUSES = [
+    (OrderStatus.IN_QUEUE, 0.3), (OrderStatus.IN_PROCESS, 0.3), (OrderStatus.READY, 0.2),
+    (OrderStatus.COMPLETED, 0.15), (OrderStatus.CANCELLED, 0.05),
+]
+
+def partner_email(index: int) -> str:
+    return f"partner{index}@{BENCH_DOMAIN}"
+
+def customer_email(index: int) -> str:
+    return f"customer{index}@{BENCH_DOMAIN}"
+
+def _next_id(conn, model) -> int:
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def _choose(rng: random.Random, weighted):
+    values, weights = zip(*weighted)
+    return rng.choices(values, weights)[0]
+
+class Seeder:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.batch_size = args.batch_size
+        self.now = datetime.utcnow()
+
+    def _flush(self, conn, model, rows):
+        if rows:
+            conn.execute(insert(model), rows)
+            rows.clear()
+
+    def _progress(self, label: str, done: int, total: int, started: float, final: bool = False):
+        if final or done % (self.batch_size * 10) == 0:
+            rate = done / max(time.monotonic() - started, 1e-9)
+            print(f"  {label}: {done}/{total} ({rate:,.0f} rows/s)", flush=True)
+
+    def seed_users(self, conn):
+        args = self.args
+        # Hash once: every seeded user shares the password
+        password_hash = get_password_hash(BENCH_PASSWORD)
+        self.first_user_id = _next_id(conn, User)
+        rows, started = [], time.monotonic()
+        total = args.partners + args.customers
+        for index in range(total):
+            is_partner = index < args.partners
+            number = index if is_partner else index - args.partners
+            email = partner_email(number) if is_partner else customer_email(number)
+            rows.append({
+                "id": self.first_user_id + index,
+                "email": email,
+                "username": email.split("@")[0],
+                "hashed_password": password_hash,
+                "full_name": f"{'Partner' if is_partner else 'Customer'} {number}",
+                "user_type": UserType.PARTNER if is_partner else UserType.CUSTOMER,
+                "is_active": True,
+            })
+            if len(rows) >= self.batch_size:
+                self._flush(conn, User, rows)
+                self._progress("users", index + 1, total, started)
+        self._flush(conn, User, rows)
+        self._progress("users", total, total, started, final=True)
+        self.first_customer_id = self.first_user_id + args.partners
+
+    def seed_partners(self, conn):
+        args = self.args
+        self.first_partner_id = _next_id(conn, Partner)
+        rows, started = [], time.monotonic()
+        for index in range(args.partners):
+            latitude, longitude, spread = self.rng.choices(CITY_CENTRES, CITY_WEIGHTS)[0]
+            rows.append({
+                "id": self.first_partner_id + index,
+                "user_id": self.first_user_id + index,
+                "name": f"{self.rng.choice(ADJECTIVES)} Kitchen {index}",
+                "description": "Seeded partner",
+                "latitude": round(self.rng.gauss(latitude, spread / 2), 6),
+                "longitude": round(self.rng.gauss(longitude, spread), 6),
+                "address": f"Street {self.rng.randint(1, 500)}, {self.rng.randint(1, 120)}",
+                "created_at": self.now - timedelta(days=args.days + self.rng.randint(0, 365)),
+            })
+            if len(rows) >= self.batch_size:
+                self._flush(conn, Partner, rows)
+                self._progress("partners", index + 1, args.partners, started)
+        self._flush(conn, Partner, rows)
+        self._progress("partners", args.partners, args.partners, started, final=True)
+
+    def seed_catalog(self, conn):
+        args = self.args
+        self.first_product_id = _next_id(conn, Product)
+        # Prices are needed to build order items without reading them back
+        self.prices = []
+        rows, promotions, started = [], [], time.monotonic()
+        total = args.partners * args.products_per_partner
+        for partner_index in range(args.partners):
+            partner_id = self.first_partner_id + partner_index
+            for k in range(args.products_per_partner):
+                original = float(self.rng.randrange(90, 1500, 10))
+                discount = self.rng.choice([None, None, None, 10.0, 20.0, 30.0])
+                price = round(original * (100 - discount) / 100, 2) if discount else original
+                self.prices.append(price)
+                rows.append({
+                    "id": self.first_product_id + len(self.prices) - 1,
+                    "partner_id": partner_id,
+                    "name": f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(DISHES)} {k}",
+                    "price": price,
+                    "original_price": original,
+                    "discount_percent": discount,
+                    "is_available": self.rng.random() > 0.05,
+                    "created_at": self.now - timedelta(days=args.days),
+                })
+                if len(rows) >= self.batch_size:
+                    self._flush(conn, Product, rows)
+                    self._progress("products", len(self.prices), total, started)
+            for _ in range(self.rng.randint(0, args.promotions_per_partner)):
+                discount = self.rng.choice([10, 15, 20, 25])
+                promotions.append({
+                    "partner_id": partner_id,
+                    "title": f"-{discount}% today",
+                    "discount_percent": float(discount),
+                    "is_active": True,
+                    "expires_at": self.now + timedelta(days=self.rng.randint(1, 30)),
+                })
+            if len(promotions) >= self.batch_size:
+                self._flush(conn, Promotion, promotions)
+        self._flush(conn, Product, rows)
+        self._flush(conn, Promotion, promotions)
+        self._progress("products", total, total, started, final=True)
+
+    def seed_orders(self, conn):
+        args = self.args
+        order_id = _next_id(conn, Order)
+        item_id = _next_id(conn, OrderItem)
+        orders, items, started = [], [], time.monotonic()
+        recent = timedelta(hours=6)
+        span_seconds = args.days * 86400
+        for index in range(args.orders):
+            partner_index = self.rng.randrange(args.partners)
+            created_at = self.now - timedelta(seconds=self.rng.randrange(span_seconds))
+            status = _choose(self.rng, RECENT_STATUSES if self.now - created_at < recent else OLD_STATUSES)
+            total = 0.0
+            for _ in range(self.rng.randint(1, args.max_items)):
+                product_index = partner_index * args.products_per_partner + self.rng.randrange(args.products_per_partner)
+                quantity = self.rng.randint(1, 3)
+                price = self.prices[product_index]
+                total += price * quantity
+                items.append({
+                    "id": item_id,
+                    "order_id": order_id,
+                    "product_id": self.first_product_id + product_index,
+                    "quantity": quantity,
+                    "price": price,
+                })
+                item_id += 1
+            orders.append({
+                "id": order_id,
+                "customer_id": self.first_customer_id + self.rng.randrange(args.customers),
+                "partner_id": self.first_partner_id + partner_index,
+                "status": status,
+                "total_amount": round(total, 2),
+                "qr_code": f"bench-{order_id}",
+                "created_at": created_at,
+                "updated_at": None if status == OrderStatus.IN_QUEUE else created_at + timedelta(minutes=self.rng.randint(5, 40)),
+            })
+            order_id += 1
+            if len(orders) >= self.batch_size:
+                self._flush(conn, Order, orders)
+                self._flush(conn, OrderItem, items)
+                self._progress("orders", index + 1, args.orders, started)
+        self._flush(conn, Order, orders)
+        self._flush(conn, OrderItem, items)
+        self._progress("orders", args.orders, args.orders, started, final=True)
+
+    def run(self):
+        migrate_db.migrate()
+        started = time.monotonic()
+        # One transaction per table group keeps a failed run easy to clean up
+        with engine.begin() as conn:
+            self.seed_users(conn)
+            self.seed_partners(conn)
+        with engine.begin() as conn:
+            self.seed_catalog(conn)
+        with engine.begin() as conn:
+            self.seed_orders(conn)
+        if not self.args.skip_rollups:
+            print("  rebuilding statistics rollups", flush=True)
+            db = SessionLocal()
+            try:
+                stats_rollup.rebuild(db)
+            finally:
+                db.close()
+        print(f"Seeded in {time.monotonic() - started:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the database with synthetic benchmark data")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for the default volumes")
+    parser.add_argument("--partners", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=200_000)
+    parser.add_argument("--products-per-partner", type=int, default=100)
+    parser.add_argument("--promotions-per-partner", type=int, default=3)
+    parser.add_argument("--orders", type=int, default=5_000_000)
+    parser.add_argument("--max-items", type=int, default=4, help="Items per order are 1..max")
+    parser.add_argument("--days", type=int, default=90, help="Orders are spread over this many days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--skip-rollups", action="store_true", help="Do not rebuild statistics rollups")
+    args = parser.parse_args()
+    for name in ("partners", "customers", "orders"):
+        setattr(args, name, max(1, int(getattr(args, name) * args.scale)))
+    print(
+        f"Seeding {args.partners} partners, {args.partners * args.products_per_partner} products, "
+        f"{args.customers} customers, {args.orders} orders", flush=True
+    )
+    Seeder(args).run()
+
+if __name__ == "__main__":
+    main()
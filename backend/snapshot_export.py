@@ -0,0 +1,165 @@
+"""
+Incremental export of orders, order_items, products and partners into
+zstd-compressed Parquet files for offline analytics (see snapshot_reports.py).
+
+    python snapshot_export.py [--out snapshots] [--full]
+
+Fact tables are appended as new part files after a watermark (max id, plus
+updated_at for orders whose status changed). Products and partners are small
+and are rewritten on every run. Reads happen in short keyset-paginated
+batches, so the export never holds a long transaction on the live database.
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select
+from database import SessionLocal
+from models import Order, OrderItem, Product, Partner
+
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", "snapshots"))
+BATCH_SIZE = 50000
+WATERMARK_FILE = "_watermarks.json"
+
+TABLES = {
+    "orders": (
+        [Order.id, Order.customer_id, Order.partner_id, Order.status, Order.total_amount,
+         Order.created_at, Order.updated_at],
+        pa.schema([
+            ("id", pa.int64()), ("customer_id", pa.int64()), ("partner_id", pa.int64()),
+            ("status", pa.string()), ("total_amount", pa.float64()),
+            ("created_at", pa.timestamp("us")), ("updated_at", pa.timestamp("us")),
+        ]),
+    ),
+    "order_items": (
+        [OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity, OrderItem.price],
+        pa.schema([
+            ("id", pa.int64()), ("order_id", pa.int64()), ("product_id", pa.int64()),
+            ("quantity", pa.int64()), ("price", pa.float64()),
+        ]),
+    ),
+    "products": (
+        [Product.id, Product.partner_id, Product.name, Product.price, Product.is_available, Product.created_at],
+        pa.schema([
+            ("id", pa.int64()), ("partner_id", pa.int64()), ("name", pa.string()),
+            ("price", pa.float64()), ("is_available", pa.bool_()), ("created_at", pa.timestamp("us")),
+        ]),
+    ),
+    "partners": (
+        [Partner.id, Partner.name, Partner.latitude, Partner.longitude, Partner.address, Partner.created_at],
+        pa.schema([
+            ("id", pa.int64()), ("name", pa.string()), ("latitude", pa.float64()),
+            ("longitude", pa.float64()), ("address", pa.string()), ("created_at", pa.timestamp("us")),
+        ]),
+    ),
+}
+
+def _plain(value):
+    if hasattr(value, "value"):  # enums
+        return value.value
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.replace(tzinfo=None) - value.utcoffset()
+    return value
+
+def _to_arrow(name: str, rows: list) -> pa.Table:
+    _, schema = TABLES[name]
+    columns = list(zip(*rows))
+    return pa.table(
+        [pa.array([_plain(v) for v in column], type=field.type) for column, field in zip(columns, schema)],
+        schema=schema
+    )
+
+def _fetch_batches(name: str, *conditions, after_id: int = 0):
+    """Keyset pagination over the table's id, one short session per batch"""
+    columns, _ = TABLES[name]
+    id_column = columns[0]
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(*columns).where(id_column > after_id, *conditions).order_by(id_column).limit(BATCH_SIZE)
+            ).all()
+        finally:
+            db.close()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+def _write_parts(table_dir: Path, name: str, batches, run_id: str):
+    """Write each batch as a part file, returns (rows written, last id seen)"""
+    table_dir.mkdir(parents=True, exist_ok=True)
+    written, last_id = 0, None
+    for n, rows in enumerate(batches):
+        pq.write_table(_to_arrow(name, rows), table_dir / f"part-{run_id}-{n:05d}.parquet", compression="zstd")
+        written += len(rows)
+        last_id = rows[-1][0]
+    return written, last_id
+
+def _rewrite_table(out: Path, name: str, run_id: str) -> int:
+    staging = out / f".{name}-{run_id}"
+    written, _ = _write_parts(staging, name, _fetch_batches(name), run_id)
+    target = out / name
+    if target.exists():
+        shutil.rmtree(target)
+    if written:
+        staging.rename(target)
+    return written
+
+def load_watermarks(out: Path) -> dict:
+    path = out / WATERMARK_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def export_snapshot(out: Path = SNAPSHOT_DIR, full: bool = False) -> dict:
+    out.mkdir(parents=True, exist_ok=True)
+    if full:
+        for name in TABLES:
+            shutil.rmtree(out / name, ignore_errors=True)
+    marks = {} if full else load_watermarks(out)
+    started_at = datetime.utcnow()
+    run_id = started_at.strftime("%Y%m%dT%H%M%S")
+    orders_max_id = marks.get("orders_max_id", 0)
+    items_max_id = marks.get("order_items_max_id", 0)
+    counts = {}
+    
+    # Orders changed since the last run are written again; readers keep the newest copy
+    changed_orders = 0
+    if marks.get("orders_updated_at"):
+        since = datetime.fromisoformat(marks["orders_updated_at"])
+        changed_orders, _ = _write_parts(out / "orders", "orders", _fetch_batches(
+            "orders", Order.id <= orders_max_id, Order.updated_at >= since
+        ), run_id + "u")
+    
+    new_orders, last_id = _write_parts(out / "orders", "orders", _fetch_batches("orders", after_id=orders_max_id), run_id)
+    counts["orders"] = changed_orders + new_orders
+    orders_max_id = last_id or orders_max_id
+    
+    counts["order_items"], last_id = _write_parts(
+        out / "order_items", "order_items", _fetch_batches("order_items", after_id=items_max_id), run_id
+    )
+    items_max_id = last_id or items_max_id
+    
+    counts["products"] = _rewrite_table(out, "products", run_id)
+    counts["partners"] = _rewrite_table(out, "partners", run_id)
+    
+    # Watermarks are saved last, so an interrupted run is simply repeated
+    marks = {
+        "orders_max_id": orders_max_id,
+        "orders_updated_at": started_at.isoformat(),
+        "order_items_max_id": items_max_id,
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    (out / WATERMARK_FILE).write_text(json.dumps(marks, indent=2))
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export analytics snapshot to Parquet")
+    parser.add_argument("--out", type=Path, default=SNAPSHOT_DIR)
+    parser.add_argument("--full", action="store_true", help="Discard the existing snapshot and export everything")
+    args = parser.parse_args()
+    counts = export_snapshot(args.out, args.full)
+    print(json.dumps(counts))
@@ -0,0 +1,141 @@
+"""
+Platform-wide reports computed from the Parquet snapshot written by
+snapshot_export.py. Aggregation is vectorized with NumPy over column arrays;
+the production database is never touched.
+
+    python snapshot_reports.py gmv|top-products|cohorts [--snapshot snapshots]
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from snapshot_export import SNAPSHOT_DIR, TABLES
+
+# Partners are grouped into districts by a lat/lon grid of this size (~2 km)
+DISTRICT_CELL_DEGREES = 0.02
+
+def load_table(snapshot: Path, name: str) -> pa.Table:
+    """Read all part files of a table, keeping only the newest copy of every id"""
+    files = sorted((snapshot / name).glob("*.parquet"))
+    if not files:
+        return TABLES[name][1].empty_table()
+    table = pa.concat_tables(pq.read_table(f, memory_map=True) for f in files)
+    ids = table["id"].to_numpy()
+    # Parts are sorted oldest first, so the last occurrence of an id is the newest one
+    _, first_in_reversed = np.unique(ids[::-1], return_index=True)
+    return table.take(len(ids) - 1 - first_in_reversed)
+
+def _completed_orders(snapshot: Path) -> pa.Table:
+    orders = load_table(snapshot, "orders")
+    return orders.filter(pc.equal(orders["status"], "completed"))
+
+def _lookup(sorted_ids: np.ndarray, ids: np.ndarray):
+    """Positions of ids in sorted_ids and a mask of the ids that were found"""
+    positions = np.searchsorted(sorted_ids, ids)
+    positions = np.minimum(positions, max(len(sorted_ids) - 1, 0))
+    found = sorted_ids[positions] == ids if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return positions, found
+
+def gmv_by_district(snapshot: Path = SNAPSHOT_DIR, cell: float = DISTRICT_CELL_DEGREES) -> List[Dict]:
+    orders = _completed_orders(snapshot)
+    partners = load_table(snapshot, "partners").sort_by("id")
+    positions, found = _lookup(partners["id"].to_numpy(), orders["partner_id"].to_numpy())
+    amounts = orders["total_amount"].to_numpy()[found]
+    lat = partners["latitude"].to_numpy()[positions[found]]
+    lon = partners["longitude"].to_numpy()[positions[found]]
+    cells = np.stack([np.floor(lat / cell), np.floor(lon / cell)], axis=1).astype(np.int64)
+    if not len(cells):
+        return []
+    districts, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    gmv = np.bincount(inverse, weights=amounts)
+    counts = np.bincount(inverse)
+    return [
+        {
+            "district": f"{(lat_cell + 0.5) * cell:.4f},{(lon_cell + 0.5) * cell:.4f}",
+            "gmv": round(float(gmv[i]), 2),
+            "orders": int(counts[i]),
+        }
+        for i in np.argsort(-gmv)
+        for lat_cell, lon_cell in [districts[i]]
+    ]
+
+def top_products(snapshot: Path = SNAPSHOT_DIR, limit: int = 20) -> List[Dict]:
+    completed_ids = np.sort(_completed_orders(snapshot)["id"].to_numpy())
+    items = load_table(snapshot, "order_items")
+    _, found = _lookup(completed_ids, items["order_id"].to_numpy())
+    product_ids = items["product_id"].to_numpy()[found]
+    quantity = items["quantity"].to_numpy()[found]
+    revenue = items["price"].to_numpy()[found] * quantity
+    if not len(product_ids):
+        return []
+    unique_ids, inverse = np.unique(product_ids, return_inverse=True)
+    total_quantity = np.bincount(inverse, weights=quantity)
+    total_revenue = np.bincount(inverse, weights=revenue)
+    
+    products = load_table(snapshot, "products").sort_by("id")
+    partners = load_table(snapshot, "partners").sort_by("id")
+    top = np.argsort(-total_quantity)[:limit]
+    product_pos, product_found = _lookup(products["id"].to_numpy(), unique_ids[top])
+    names = products["name"].to_pylist()
+    product_partners = products["partner_id"].to_numpy()
+    partner_pos, partner_found = _lookup(
+        partners["id"].to_numpy(),
+        np.where(product_found, product_partners[product_pos] if len(product_partners) else 0, -1)
+    )
+    partner_names = partners["name"].to_pylist()
+    return [
+        {
+            "product_id": int(unique_ids[i]),
+            "product_name": names[product_pos[n]] if product_found[n] else None,
+            "partner_name": partner_names[partner_pos[n]] if partner_found[n] else None,
+            "quantity": int(total_quantity[i]),
+            "revenue": round(float(total_revenue[i]), 2),
+        }
+        for n, i in enumerate(top)
+    ]
+
+def cohort_retention(snapshot: Path = SNAPSHOT_DIR) -> List[Dict]:
+    """Share of each monthly first-order cohort that ordered again N months later"""
+    orders = _completed_orders(snapshot)
+    if not orders.num_rows:
+        return []
+    customers = orders["customer_id"].to_numpy()
+    months = orders["created_at"].to_numpy().astype("datetime64[M]").astype(np.int64)
+    month_base = months.min()
+    span = int(months.max() - month_base) + 1
+    # Distinct (customer, month) pairs, sorted by customer then month
+    pairs = np.unique(customers * span + (months - month_base))
+    pair_customers, pair_months = pairs // span, pairs % span
+    _, first, inverse = np.unique(pair_customers, return_index=True, return_inverse=True)
+    cohorts = pair_months[first][inverse]
+    active = np.zeros((span, span), dtype=np.int64)
+    np.add.at(active, (cohorts, pair_months - cohorts), 1)
+    report = []
+    for cohort in range(span):
+        size = int(active[cohort, 0])
+        if not size:
+            continue
+        report.append({
+            "cohort": str(np.datetime64(int(month_base + cohort), "M")),
+            "customers": size,
+            "retention": [round(float(v) / size, 4) for v in active[cohort, :span - cohort]],
+        })
+    return report
+
+REPORTS = {
+    "gmv": gmv_by_district,
+    "top-products": top_products,
+    "cohorts": cohort_retention,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline platform-wide analytics")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("--snapshot", type=Path, default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    print(json.dumps(REPORTS[args.report](args.snapshot), ensure_ascii=False, indent=2))
@@ -0,0 +1,35 @@
+"""
+Per-partner cache of rendered statistics responses.
+
+Entries are dropped by invalidate() whenever the partner's orders, products or
+promotions change, and expire after STATS_CACHE_TTL seconds or at the end of
+the UTC day so the 30-day window keeps rolling.
+"""
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))
+
+# partner_id -> (expires_at, day, rendered JSON body)
+_cache: Dict[int, Tuple[float, str, bytes]] = {}
+
+def get(partner_id: int) -> Optional[bytes]:
+    entry = _cache.get(partner_id)
+    if entry is None:
+        return None
+    expires_at, day, body = entry
+    if expires_at < time.monotonic() or day != datetime.utcnow().date().isoformat():
+        _cache.pop(partner_id, None)
+        return None
+    return body
+
+def put(partner_id: int, body: bytes):
+    _cache[partner_id] = (time.monotonic() + STATS_CACHE_TTL, datetime.utcnow().date().isoformat(), body)
+
+def invalidate(partner_id: int):
+    _cache.pop(partner_id, None)
+
+def clear():
+    _cache.clear()
@@ -0,0 +1,151 @@
+"""
+Daily sales rollups for partner statistics.
+
+The record_* functions are called inside the transaction that changes the
+order, so the rollup tables always match the orders table. Run this module
+to rebuild them from scratch:
+
+    python stats_rollup.py rebuild [--partner-id ID]
+"""
+import argparse
+from datetime import date
+from typing import Optional
+from sqlalchemy import func, case, delete, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import (
+    Order, OrderItem, OrderStatus,
+    PartnerDailyStats, PartnerDailyCustomer, PartnerDailyProductStats
+)
+
+_DIALECT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def _increment(db: Session, model, keys: dict, deltas: dict) -> tuple:
+    """
+    Add deltas to the row identified by keys, creating it if needed, in one
+    INSERT ... ON CONFLICT DO UPDATE so concurrent transactions cannot both
+    insert it. Returns the new values of the delta columns.
+    """
+    stmt = _DIALECT_INSERTS[db.get_bind().dialect.name](model).values(**keys, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={k: getattr(model, k) + stmt.excluded[k] for k in deltas}
+    ).returning(*(getattr(model, k) for k in deltas))
+    return tuple(db.execute(stmt).one())
+
+def _order_day(order: Order) -> date:
+    return order.created_at.date()
+
+def _record_completed(db: Session, order: Order, sign: int):
+    day = _order_day(order)
+    _increment(db, PartnerDailyStats, {"partner_id": order.partner_id, "day": day}, {
+        "completed_orders": sign,
+        "revenue": sign * order.total_amount
+    })
+    for item in order.items:
+        _increment(db, PartnerDailyProductStats, {
+            "partner_id": order.partner_id, "day": day, "product_id": item.product_id
+        }, {
+            "quantity": sign * item.quantity,
+            "revenue": sign * item.price * item.quantity
+        })
+
+def record_order_created(db: Session, order: Order):
+    """Call after the order has been flushed"""
+    day = _order_day(order)
+    # Rows are deleted when their count drops to 0, so 1 means the customer is new for the day
+    customer_orders, = _increment(db, PartnerDailyCustomer, {
+        "partner_id": order.partner_id, "day": day, "customer_id": order.customer_id
+    }, {"orders": 1})
+    _increment(db, PartnerDailyStats, {"partner_id": order.partner_id, "day": day}, {
+        "orders": 1,
+        "customers": 1 if customer_orders == 1 else 0
+    })
+    if order.status == OrderStatus.COMPLETED:
+        _record_completed(db, order, 1)
+
+def record_status_change(db: Session, order: Order, old_status: OrderStatus):
+    if old_status != OrderStatus.COMPLETED and order.status == OrderStatus.COMPLETED:
+        _record_completed(db, order, 1)
+    elif old_status == OrderStatus.COMPLETED and order.status != OrderStatus.COMPLETED:
+        _record_completed(db, order, -1)
+
+def record_order_deleted(db: Session, order: Order):
+    day = _order_day(order)
+    if order.status == OrderStatus.COMPLETED:
+        _record_completed(db, order, -1)
+    
+    customer_keys = [
+        PartnerDailyCustomer.partner_id == order.partner_id,
+        PartnerDailyCustomer.day == day,
+        PartnerDailyCustomer.customer_id == order.customer_id
+    ]
+    db.execute(update(PartnerDailyCustomer).where(*customer_keys).values(orders=PartnerDailyCustomer.orders - 1))
+    last_order = db.execute(delete(PartnerDailyCustomer).where(*customer_keys, PartnerDailyCustomer.orders <= 0)).rowcount
+    _increment(db, PartnerDailyStats, {"partner_id": order.partner_id, "day": day}, {
+        "orders": -1,
+        "customers": -1 if last_order else 0
+    })
+
+def rebuild(db: Session, partner_id: Optional[int] = None):
+    """Recompute rollups for one partner or for everyone with GROUP BY queries"""
+    rollups = (PartnerDailyStats, PartnerDailyCustomer, PartnerDailyProductStats)
+    for model in rollups:
+        stmt = delete(model)
+        if partner_id is not None:
+            stmt = stmt.where(model.partner_id == partner_id)
+        db.execute(stmt)
+    
+    day = func.date(Order.created_at)
+    completed = Order.status == OrderStatus.COMPLETED
+    
+    def scoped(query):
+        return query if partner_id is None else query.where(Order.partner_id == partner_id)
+    
+    db.execute(insert(PartnerDailyStats).from_select(
+        ["partner_id", "day", "orders", "completed_orders", "revenue", "customers"],
+        scoped(select(
+            Order.partner_id,
+            day,
+            func.count(Order.id),
+            func.sum(case((completed, 1), else_=0)),
+            func.sum(case((completed, Order.total_amount), else_=0.0)),
+            func.count(func.distinct(Order.customer_id))
+        )).group_by(Order.partner_id, day)
+    ))
+    db.execute(insert(PartnerDailyCustomer).from_select(
+        ["partner_id", "day", "customer_id", "orders"],
+        scoped(select(
+            Order.partner_id, day, Order.customer_id, func.count(Order.id)
+        )).group_by(Order.partner_id, day, Order.customer_id)
+    ))
+    db.execute(insert(PartnerDailyProductStats).from_select(
+        ["partner_id", "day", "product_id", "quantity", "revenue"],
+        scoped(select(
+            Order.partner_id,
+            day,
+            OrderItem.product_id,
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.price * OrderItem.quantity)
+        ).join(OrderItem, OrderItem.order_id == Order.id).where(completed)).group_by(
+            Order.partner_id, day, OrderItem.product_id
+        )
+    ))
+    db.commit()
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    import db_migrations
+    
+    parser = argparse.ArgumentParser(description="Maintain partner statistics rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--partner-id", type=int, default=None)
+    args = parser.parse_args()
+    
+    db_migrations.check_schema()
+    db = SessionLocal()
+    try:
+        rebuild(db, args.partner_id)
+        print("Statistics rollups rebuilt")
+    finally:
+        db.close()
@@ -0,0 +1,276 @@
+"""
+Storage backends for uploaded files.
+
+Keys are relative paths such as "ab/cd/<sha256>.jpg". The local backend keeps
+files under UPLOAD_DIR; the S3 backend works with AWS S3 and compatible
+servers such as MinIO (set S3_ENDPOINT_URL). Both can hand out presigned URLs
+so clients upload and download bytes without passing them through the API.
+
+    STORAGE_BACKEND=local|s3
+    UPLOAD_DIR=uploads
+    S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY
+    S3_PUBLIC_URL  (optional, e.g. a CDN in front of the bucket)
+"""
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import time
+from dataclasses import dataclass
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlencode
+from auth import SECRET_KEY
+
+PRESIGN_EXPIRES_SECONDS = int(os.getenv("PRESIGN_EXPIRES_SECONDS", "900"))
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    modified_at: float  # Unix timestamp
+
+@dataclass
+class PresignedUpload:
+    url: str
+    method: str
+    headers: Dict[str, str]
+    expires_in: int
+
+class StorageBackend:
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path of the object if the backend stores files locally"""
+        return None
+    
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        raise NotImplementedError
+    
+    def save_file(self, source: Path, key: str):
+        """Store a finished local file under key. The source file is left in place."""
+        raise NotImplementedError
+    
+    def download(self, key: str, target: Path):
+        raise NotImplementedError
+    
+    def read_head(self, key: str, length: int) -> bytes:
+        """The first length bytes of the object (a ranged GET for remote backends)"""
+        raise NotImplementedError
+    
+    def delete(self, key: str):
+        raise NotImplementedError
+    
+    def iter_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        raise NotImplementedError
+    
+    def presigned_get_url(self, key: str, expires: int = PRESIGN_EXPIRES_SECONDS) -> str:
+        raise NotImplementedError
+    
+    def presigned_put(
+        self, key: str, content_type: str, size: int, sha256_hex: str, expires: int = PRESIGN_EXPIRES_SECONDS
+    ) -> PresignedUpload:
+        raise NotImplementedError
+
+def sign_direct_upload(filename: str, size: int, expires_at: int) -> str:
+    message = f"PUT\n{filename}\n{size}\n{expires_at}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+def verify_direct_upload(filename: str, size: int, expires_at: int, signature: str) -> bool:
+    if expires_at < time.time():
+        return False
+    return hmac.compare_digest(sign_direct_upload(filename, size, expires_at), signature)
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: Path):
+        self.root = root.resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+    
+    def local_path(self, key: str) -> Path:
+        return self.root / key
+    
+    def exists(self, key: str) -> bool:
+        return self.local_path(key).is_file()
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            st = self.local_path(key).stat()
+        except FileNotFoundError:
+            return None
+        return StoredObject(key, st.st_size, st.st_mtime)
+    
+    def save_file(self, source: Path, key: str):
+        target = self.local_path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp = target.with_name(f".{target.name}.{os.getpid()}.part")
+        shutil.copyfile(source, temp)
+        os.replace(temp, target)
+    
+    def move_file(self, source: Path, key: str):
+        """Cheaper than save_file when the source is on the same filesystem and no longer needed"""
+        target = self.local_path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source, target)
+    
+    def download(self, key: str, target: Path):
+        shutil.copyfile(self.local_path(key), target)
+    
+    def read_head(self, key: str, length: int) -> bytes:
+        with open(self.local_path(key), "rb") as f:
+            return f.read(length)
+    
+    def delete(self, key: str):
+        try:
+            self.local_path(key).unlink()
+        except FileNotFoundError:
+            pass
+    
+    def iter_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        start = self.root / prefix if prefix else self.root
+        for directory, dirnames, filenames in os.walk(start):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.startswith("."):
+                    continue  # temp files of uploads in progress
+                path = Path(directory) / name
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield StoredObject(path.relative_to(self.root).as_posix(), st.st_size, st.st_mtime)
+    
+    def presigned_get_url(self, key: str, expires: int = PRESIGN_EXPIRES_SECONDS) -> str:
+        # Local uploads are public and served by the API itself
+        return f"/api/uploads/{Path(key).name}"
+    
+    def presigned_put(
+        self, key: str, content_type: str, size: int, sha256_hex: str, expires: int = PRESIGN_EXPIRES_SECONDS
+    ) -> PresignedUpload:
+        filename = Path(key).name
+        expires_at = int(time.time()) + expires
+        query = urlencode({
+            "size": size,
+            "expires": expires_at,
+            "signature": sign_direct_upload(filename, size, expires_at),
+        })
+        return PresignedUpload(
+            url=f"/api/uploads/direct/{filename}?{query}",
+            method="PUT",
+            headers={"Content-Type": content_type},
+            expires_in=expires,
+        )
+
+class S3Storage(StorageBackend):
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        public_url: Optional[str] = None
+    ):
+        # Imported lazily so the local backend does not pay for botocore at startup
+        import boto3
+        from botocore.config import Config
+        
+        self.bucket = bucket
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            config=Config(signature_version="s3v4", s3={"addressing_style": "path" if endpoint_url else "auto"}),
+        )
+    
+    def _is_missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+    
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+    
+    def stat(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return StoredObject(key, head["ContentLength"], head["LastModified"].timestamp())
+    
+    def save_file(self, source: Path, key: str):
+        content_type = guess_type(key)[0] or "application/octet-stream"
+        self.client.upload_file(str(source), self.bucket, key, ExtraArgs={
+            "ContentType": content_type,
+            "CacheControl": "public, max-age=31536000, immutable",
+        })
+    
+    def download(self, key: str, target: Path):
+        self.client.download_file(self.bucket, key, str(target))
+    
+    def read_head(self, key: str, length: int) -> bytes:
+        response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes=0-{length - 1}")
+        return response["Body"].read()
+    
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+    
+    def iter_objects(self, prefix: str = "") -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield StoredObject(item["Key"], item["Size"], item["LastModified"].timestamp())
+    
+    def presigned_get_url(self, key: str, expires: int = PRESIGN_EXPIRES_SECONDS) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires
+        )
+    
+    def presigned_put(
+        self, key: str, content_type: str, size: int, sha256_hex: str, expires: int = PRESIGN_EXPIRES_SECONDS
+    ) -> PresignedUpload:
+        # The checksum is part of the signature, so the bucket rejects bytes that don't match the key's hash
+        checksum = base64.b64encode(bytes.fromhex(sha256_hex)).decode()
+        url = self.client.generate_presigned_url("put_object", Params={
+            "Bucket": self.bucket,
+            "Key": key,
+            "ContentType": content_type,
+            "ContentLength": size,
+            "ChecksumSHA256": checksum,
+            "CacheControl": "public, max-age=31536000, immutable",
+        }, ExpiresIn=expires)
+        return PresignedUpload(
+            url=url,
+            method="PUT",
+            headers={
+                "Content-Type": content_type,
+                "x-amz-checksum-sha256": checksum,
+                "Cache-Control": "public, max-age=31536000, immutable",
+            },
+            expires_in=expires,
+        )
+
+def create_storage() -> StorageBackend:
+    backend = os.getenv("STORAGE_BACKEND", "local").lower()
+    if backend == "s3":
+        return S3Storage(
+            bucket=os.environ["S3_BUCKET"],
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            region=os.getenv("S3_REGION"),
+            access_key=os.getenv("S3_ACCESS_KEY_ID"),
+            secret_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            public_url=os.getenv("S3_PUBLIC_URL"),
+        )
+    if backend != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return LocalStorage(Path(os.getenv("UPLOAD_DIR", "uploads")))
+
+storage = create_storage()
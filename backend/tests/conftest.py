@@ -0,0 +1,95 @@
+"""
+The application modules bind the engine, the upload directory and the storage
+at import time, so the environment is pointed at a scratch directory before
+anything from the backend is imported.
+"""
+import itertools
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix="goieat-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_scratch}/test.db"
+os.environ["UPLOAD_DIR"] = os.path.join(_scratch, "uploads")
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["UPLOAD_GC_INTERVAL_SECONDS"] = "0"
+
+pytest_plugins = ["query_recorder"]
+
+_user_numbers = itertools.count(1)
+
+@dataclass
+class World:
+    """A partner with products and a customer, with auth headers for both"""
+    partner_headers: Dict[str, str]
+    customer_headers: Dict[str, str]
+    partner_id: int
+    product_ids: List[int]
+
+@pytest.fixture(scope="session")
+def client():
+    import migrate_db
+    migrate_db.migrate()
+    from fastapi.testclient import TestClient
+    import main
+    # Startup jobs (outbox dispatcher, upload GC) are not started: the client is not entered
+    return TestClient(main.app)
+
+@pytest.fixture
+def db(client):
+    from database import SessionLocal
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def scratch_database(tmp_path, monkeypatch):
+    """An empty SQLite file behind database.engine and SessionLocal for one test, returns its path"""
+    from sqlalchemy import create_engine
+    import database
+    import db_migrations
+    import migrate_db
+    app_engine = database.engine
+    path = tmp_path / "scratch.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    for module in (database, db_migrations, migrate_db):
+        monkeypatch.setattr(module, "engine", engine)
+    database.SessionLocal.configure(bind=engine)
+    yield path
+    database.SessionLocal.configure(bind=app_engine)
+    engine.dispose()
+
+def _login(client, user_type: str) -> Dict[str, str]:
+    n = next(_user_numbers)
+    email = f"{user_type}{n}@example.com"
+    response = client.post("/api/auth/register", json={
+        "email": email, "username": f"{user_type}{n}", "password": "secret", "user_type": user_type
+    })
+    assert response.status_code == 200, response.text
+    token = client.post("/api/auth/login", data={"username": email, "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def world(client) -> World:
+    partner_headers = _login(client, "partner")
+    partner = client.post("/api/auth/register-partner", headers=partner_headers, json={
+        "name": "Cafe", "latitude": 55.75, "longitude": 37.61
+    }).json()
+    product_ids = [
+        client.post("/api/partner/products", headers=partner_headers, json={
+            "name": f"Dish {i}", "original_price": 100 + i, "discount_percent": 10
+        }).json()["id"]
+        for i in range(3)
+    ]
+    return World(partner_headers, _login(client, "customer"), partner["id"], product_ids)
+
+def place_order(client, world: World, quantity: int = 1):
+    response = client.post("/api/customer/orders", headers=world.customer_headers, json={
+        "partner_id": world.partner_id,
+        "items": [{"product_id": product_id, "quantity": quantity} for product_id in world.product_ids]
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
@@ -0,0 +1,111 @@
+-- Schema create_all produced before migrations existed (SQLite), used to test baselining
+
+CREATE TABLE users (
+	id INTEGER NOT NULL, 
+	email VARCHAR NOT NULL, 
+	username VARCHAR NOT NULL, 
+	hashed_password VARCHAR NOT NULL, 
+	user_type VARCHAR(8) NOT NULL, 
+	full_name VARCHAR, 
+	phone VARCHAR, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	is_active BOOLEAN, 
+	PRIMARY KEY (id)
+);
+
+CREATE INDEX ix_users_id ON users (id);
+
+CREATE UNIQUE INDEX ix_users_email ON users (email);
+
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+
+CREATE TABLE partners (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	name VARCHAR NOT NULL, 
+	description TEXT, 
+	latitude FLOAT NOT NULL, 
+	longitude FLOAT NOT NULL, 
+	address VARCHAR, 
+	phone VARCHAR, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	PRIMARY KEY (id), 
+	UNIQUE (user_id), 
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE INDEX ix_partners_id ON partners (id);
+
+CREATE TABLE partner_images (
+	id INTEGER NOT NULL, 
+	partner_id INTEGER NOT NULL, 
+	image_url VARCHAR NOT NULL, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(partner_id) REFERENCES partners (id)
+);
+
+CREATE INDEX ix_partner_images_id ON partner_images (id);
+
+CREATE TABLE products (
+	id INTEGER NOT NULL, 
+	partner_id INTEGER NOT NULL, 
+	name VARCHAR NOT NULL, 
+	description TEXT, 
+	price FLOAT, 
+	original_price FLOAT, 
+	discount_percent FLOAT, 
+	image_url VARCHAR, 
+	is_available BOOLEAN, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(partner_id) REFERENCES partners (id)
+);
+
+CREATE INDEX ix_products_id ON products (id);
+
+CREATE TABLE promotions (
+	id INTEGER NOT NULL, 
+	partner_id INTEGER NOT NULL, 
+	title VARCHAR NOT NULL, 
+	description TEXT, 
+	image_url VARCHAR, 
+	discount_percent FLOAT, 
+	is_active BOOLEAN, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	expires_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(partner_id) REFERENCES partners (id)
+);
+
+CREATE INDEX ix_promotions_id ON promotions (id);
+
+CREATE TABLE orders (
+	id INTEGER NOT NULL, 
+	customer_id INTEGER NOT NULL, 
+	partner_id INTEGER NOT NULL, 
+	status VARCHAR(10), 
+	total_amount FLOAT NOT NULL, 
+	qr_code VARCHAR, 
+	created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), 
+	updated_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(customer_id) REFERENCES users (id), 
+	FOREIGN KEY(partner_id) REFERENCES partners (id), 
+	UNIQUE (qr_code)
+);
+
+CREATE INDEX ix_orders_id ON orders (id);
+
+CREATE TABLE order_items (
+	id INTEGER NOT NULL, 
+	order_id INTEGER NOT NULL, 
+	product_id INTEGER NOT NULL, 
+	quantity INTEGER NOT NULL, 
+	price FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(order_id) REFERENCES orders (id), 
+	FOREIGN KEY(product_id) REFERENCES products (id)
+);
+
+CREATE INDEX ix_order_items_id ON order_items (id);
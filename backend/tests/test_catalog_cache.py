@@ -0,0 +1,24 @@
+import catalog_cache
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    monkeypatch.setattr(catalog_cache, "CATALOG_CACHE_MAX_ENTRIES", 2)
+    catalog_cache.clear()
+    catalog_cache.put("products", 1, b"[1]")
+    catalog_cache.put("products", 2, b"[2]")
+    assert catalog_cache.get("products", 1) is not None
+    catalog_cache.put("products", 3, b"[3]")
+    assert catalog_cache.get("products", 2) is None
+    assert catalog_cache.get("products", 1) is not None and catalog_cache.get("products", 3) is not None
+
+def test_expired_entries_are_dropped_on_write():
+    catalog_cache.clear()
+    catalog_cache.put("promotions", 1, b"[]", ttl=-1)
+    catalog_cache.put("promotions", 2, b"[]")
+    assert list(catalog_cache._cache) == [("promotions", 2)]
+
+def test_unknown_partners_are_not_cached(client, world):
+    catalog_cache.clear()
+    for path in ("/api/customer/products", "/api/customer/promotions"):
+        assert client.get(f"{path}?partner_id=999999").json() == []
+        assert client.get(f"{path}?partner_id={world.partner_id}").status_code == 200
+    assert sorted(catalog_cache._cache) == [("products", world.partner_id), ("promotions", world.partner_id)]
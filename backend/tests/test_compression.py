@@ -0,0 +1,18 @@
+import pytest
+
+import compression
+from compression import choose_encoding
+
+@pytest.mark.skipif(compression.brotli is None, reason="brotli is not installed")
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("br;q=0.1, gzip", "gzip"),
+    ("gzip;q=0.8, br;q=0.9", "br"),
+    ("gzip, br", "br"),  # a tie goes to the server's preference
+    ("br;q=0, *;q=0.3", "gzip"),
+    ("*", "br"),
+    ("gzip;q=0, deflate", None),
+    ("identity", None),
+    (None, None),
+])
+def test_choose_encoding(accept_encoding, expected):
+    assert choose_encoding(accept_encoding) == expected
@@ -0,0 +1,75 @@
+"""complete_upload against an S3 stand-in (moto) instead of a real bucket"""
+import hashlib
+
+import boto3
+import pytest
+from fastapi import BackgroundTasks, HTTPException
+from moto import mock_aws
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import routers.uploads as uploads
+from database import Base
+from models import StoredUpload
+from schemas import UploadCompleteRequest
+from storage import S3Storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="uploads")
+        backend = S3Storage("uploads", region="us-east-1", access_key="test", secret_key="test")
+        monkeypatch.setattr(uploads, "storage", backend)
+        yield backend
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+def put_object(s3, content: bytes, ext: str = ".png") -> str:
+    content_hash = hashlib.sha256(content).hexdigest()
+    s3.client.put_object(Bucket=s3.bucket, Key=uploads.storage_key(f"{content_hash}{ext}"), Body=content)
+    return content_hash
+
+def complete(db, content_hash: str, content_type: str = "image/png"):
+    tasks = BackgroundTasks()
+    response = uploads.complete_upload(
+        UploadCompleteRequest(sha256=content_hash, content_type=content_type), tasks, current_user=None, db=db
+    )
+    return response, tasks
+
+def test_valid_image_is_registered(s3, db):
+    content_hash = put_object(s3, PNG)
+    response, tasks = complete(db, content_hash)
+    assert response["url"] == f"/api/uploads/{content_hash}.png"
+    assert db.query(StoredUpload).filter_by(content_hash=content_hash).one().size == len(PNG)
+    assert len(tasks.tasks) == 1  # variants
+
+def test_content_that_is_not_the_declared_image_is_deleted(s3, db):
+    content_hash = put_object(s3, b"<?php system($_GET['c']);")
+    with pytest.raises(HTTPException) as error:
+        complete(db, content_hash)
+    assert error.value.status_code == 400
+    assert s3.stat(uploads.storage_key(f"{content_hash}.png")) is None
+    assert db.query(StoredUpload).count() == 0
+
+def test_declared_type_must_match_the_magic_bytes(s3, db):
+    content_hash = put_object(s3, PNG, ".jpg")
+    with pytest.raises(HTTPException) as error:
+        complete(db, content_hash, "image/jpeg")
+    assert error.value.status_code == 400
+    assert s3.stat(uploads.storage_key(f"{content_hash}.jpg")) is None
+
+def test_oversized_object_is_deleted(s3, db, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_SIZE", 100)
+    content_hash = put_object(s3, PNG)
+    with pytest.raises(HTTPException) as error:
+        complete(db, content_hash)
+    assert error.value.status_code == 413
+    assert s3.stat(uploads.storage_key(f"{content_hash}.png")) is None
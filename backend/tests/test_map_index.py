@@ -0,0 +1,90 @@
+import math
+import random
+
+import map_index
+from map_index import GridIndex, MAP_CLUSTER_CELLS_PER_TILE, MAP_CLUSTER_MAX_ZOOM
+from models import Partner, User, UserType
+
+def brute_force(positions, south, west, north, east, zoom):
+    """Partner ids per grid cell the box touches, computed straight from the coordinates"""
+    side = MAP_CLUSTER_CELLS_PER_TILE * 2 ** zoom
+
+    def cell(latitude, longitude):
+        latitude = max(-map_index.MAX_LATITUDE, min(map_index.MAX_LATITUDE, latitude))
+        x = (longitude + 180) / 360
+        y = (1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2
+        return min(int(x * side), side - 1), min(int(y * side), side - 1)
+
+    x_min, y_min = cell(north, west)
+    x_max, y_max = cell(south, east)
+    x_ranges = [(x_min, x_max)] if west <= east else [(x_min, side - 1), (0, x_max)]
+    cells = {}
+    for partner_id, (latitude, longitude) in positions.items():
+        cx, cy = cell(latitude, longitude)
+        if y_min <= cy <= y_max and any(low <= cx <= high for low, high in x_ranges):
+            cells.setdefault((cx, cy), []).append(partner_id)
+    return cells
+
+BOXES = [
+    (-90, -180, 90, 180),
+    (40, 20, 60, 50),
+    (55.7, 37.5, 55.8, 37.7),
+    (-50, 170, 10, -170),  # across the antimeridian
+    (60, 179.5, 70, -179.5),
+]
+
+def assert_matches(index, positions):
+    for south, west, north, east in BOXES:
+        for zoom in (0, 3, 8, 12, MAP_CLUSTER_MAX_ZOOM):
+            clusters = index.clusters(south, west, north, east, zoom)
+            cells = brute_force(positions, south, west, north, east, zoom).values()
+            assert sorted(c["count"] for c in clusters) == sorted(len(ids) for ids in cells)
+            # Representatives are the smallest ids of the cell
+            assert sorted(c["partner_ids"] for c in clusters) == sorted(
+                sorted(ids)[:map_index.MAP_CLUSTER_REPRESENTATIVES] for ids in cells
+            )
+
+def test_upsert_move_and_remove_match_a_brute_force_count():
+    rng = random.Random(42)
+    index, positions = GridIndex(), {}
+    for partner_id in range(1, 301):
+        # Clumped around a few cities and the antimeridian, plus some spread over the world
+        if partner_id % 3:
+            latitude, longitude = rng.choice([(55.75, 37.61), (-17.7, 178.0), (64.7, -179.9)])
+            latitude += rng.uniform(-2, 2)
+            longitude = (longitude + rng.uniform(-2, 2) + 180) % 360 - 180
+        else:
+            latitude, longitude = rng.uniform(-89, 89), rng.uniform(-180, 180)
+        positions[partner_id] = (latitude, longitude)
+        index.upsert(partner_id, latitude, longitude)
+    assert_matches(index, positions)
+
+    for partner_id in rng.sample(sorted(positions), 60):
+        positions[partner_id] = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+        index.upsert(partner_id, *positions[partner_id])
+    for partner_id in rng.sample(sorted(positions), 60):
+        del positions[partner_id]
+        index.remove(partner_id)
+    assert_matches(index, positions)
+
+def test_refresh_drops_deleted_partners(client, db):
+    partners = []
+    for n in range(3):
+        user = User(email=f"map{n}@example.com", username=f"map{n}", hashed_password="x", user_type=UserType.PARTNER)
+        db.add(user)
+        db.flush()
+        partners.append(Partner(user_id=user.id, name=f"Map {n}", latitude=-33.0 - n, longitude=151.0))
+    db.add_all(partners)
+    db.commit()
+    index = GridIndex()
+    index.rebuild(db)
+    box = (-40, 150, -30, 152)
+    assert sum(c["count"] for c in index.clusters(*box, 5)) == 3
+
+    # Deleted by another worker or by hand: no updated_at to notice
+    db.delete(partners[0])
+    db.commit()
+    index._next_refresh = 0
+    index.refresh(db)
+    assert sum(c["count"] for c in index.clusters(*box, 5)) == 2
+    assert sorted(i for c in index.clusters(*box, 5) for i in c["partner_ids"]) == [partners[1].id, partners[2].id]
@@ -0,0 +1,48 @@
+import sqlite3
+from pathlib import Path
+
+import db_migrations
+import migrate_db
+from database import SessionLocal
+from order_queue import QueueTracker
+
+LEGACY_SCHEMA = Path(__file__).parent / "fixtures" / "legacy_schema.sql"
+
+def migrate_and_check():
+    migrate_db.migrate()
+    db_migrations.check_schema()
+    db = SessionLocal()
+    try:
+        QueueTracker().rebuild(db)
+    finally:
+        db.close()
+    assert migrate_db.schema_differences() == []
+
+def test_fresh_database_matches_models(scratch_database):
+    migrate_and_check()
+
+def test_legacy_database_is_baselined_and_matches_models(scratch_database, capsys):
+    conn = sqlite3.connect(scratch_database)
+    conn.executescript(LEGACY_SCHEMA.read_text())
+    conn.executescript("""
+        INSERT INTO users (id, email, username, hashed_password, user_type) VALUES
+            (1, 'p@example.com', 'p', 'x', 'PARTNER'), (2, 'c@example.com', 'c', 'x', 'CUSTOMER');
+        INSERT INTO partners (id, user_id, name, latitude, longitude) VALUES (1, 1, 'Cafe', 55.0, 82.9);
+        INSERT INTO products (id, partner_id, name, price, is_available) VALUES (1, 1, 'Soup', 10.0, 1);
+        INSERT INTO orders (id, customer_id, partner_id, status, total_amount, qr_code, created_at) VALUES
+            (1, 2, 1, 'COMPLETED', 20.0, 'qr-1', '2026-10-01 12:00:00');
+        INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (1, 1, 2, 10.0);
+    """)
+    conn.commit()
+    conn.close()
+
+    migrate_and_check()
+    assert "Statistics rollups rebuilt" in capsys.readouterr().out
+
+    conn = sqlite3.connect(scratch_database)
+    assert conn.execute("SELECT count(*) FROM orders").fetchone() == (1,)
+    assert conn.execute(
+        "SELECT partner_id, day, orders, completed_orders, revenue FROM partner_daily_stats"
+    ).fetchall() == [(1, "2026-10-01", 1, 1, 20.0)]
+    assert conn.execute("SELECT quantity, revenue FROM partner_daily_product_stats").fetchall() == [(2, 20.0)]
+    conn.close()
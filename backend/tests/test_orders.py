@@ -0,0 +1,61 @@
+from conftest import place_order
+
+def test_items_of_deleted_products_are_kept(client, world):
+    order = place_order(client, world)
+    deleted = world.product_ids[0]
+    assert client.delete(f"/api/partner/products/{deleted}", headers=world.partner_headers).status_code == 200
+
+    for url, headers in (
+        ("/api/partner/orders", world.partner_headers),
+        ("/api/customer/orders", world.customer_headers),
+        (f"/api/customer/orders/{order['id']}", world.customer_headers),
+    ):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, response.text
+        body = response.json()
+        listed = next(o for o in body if o["id"] == order["id"]) if isinstance(body, list) else body
+        items = {item["product_id"]: item for item in listed["items"]}
+        assert set(items) == set(world.product_ids)
+        assert items[deleted]["product"] is None
+        assert items[world.product_ids[1]]["product"]["id"] == world.product_ids[1]
+
+def test_admission_limit_is_counted_in_the_database(client, world, db):
+    from models import Order, OrderStatus, Partner
+    from order_queue import tracker
+    response = client.put("/api/partner/profile", headers=world.partner_headers, json={"max_open_orders": 2})
+    assert response.status_code == 200, response.text
+    place_order(client, world)
+    # An order accepted by another worker never reaches this process's tracker
+    partner = db.get(Partner, world.partner_id)
+    db.add(Order(customer_id=partner.user_id, partner_id=partner.id, status=OrderStatus.IN_QUEUE, total_amount=1, qr_code="other-worker"))
+    db.commit()
+    assert tracker.snapshot(world.partner_id)["open_orders"] == 1
+
+    response = client.post("/api/customer/orders", headers=world.customer_headers, json={
+        "partner_id": world.partner_id, "items": [{"product_id": world.product_ids[0], "quantity": 1}]
+    })
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    load = client.get(f"/api/customer/partners/{world.partner_id}/load").json()
+    assert load["open_orders"] == 2 and not load["accepting_orders"]
+
+def test_orders_for_unknown_partners_are_not_tracked(client, world):
+    from order_queue import tracker
+    response = client.post("/api/customer/orders", headers=world.customer_headers, json={
+        "partner_id": 987654, "items": [{"product_id": world.product_ids[0], "quantity": 1}]
+    })
+    assert response.status_code == 404
+    assert 987654 not in tracker._partners
+
+def test_ready_estimate_follows_the_queue_position(client, world):
+    orders = [place_order(client, world) for _ in range(3)]
+    assert [o["orders_ahead"] for o in orders][-1] == 2
+    listed = {o["id"]: o for o in client.get("/api/partner/orders", headers=world.partner_headers).json()}
+    ahead = [listed[o["id"]]["orders_ahead"] for o in orders]
+    etas = [listed[o["id"]]["estimated_ready_at"] for o in orders]
+    assert ahead == [0, 1, 2] and etas == sorted(etas)
+
+    response = client.put(f"/api/partner/orders/{orders[0]['id']}", headers=world.partner_headers, json={"status": "ready"})
+    assert response.json()["orders_ahead"] is None and response.json()["estimated_ready_at"] is None
+    second = client.get(f"/api/customer/orders/{orders[1]['id']}", headers=world.customer_headers).json()
+    assert second["orders_ahead"] == 0
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import outbox
+from models import OutboxEvent
+from routers.websocket import ConnectionManager, DeliveryError, manager
+
+class FakeSocket:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.sent = []
+
+    async def send_json(self, message):
+        if not self.alive:
+            raise RuntimeError("connection closed")
+        self.sent.append(message)
+
+def test_failed_send_raises_and_drops_dead_socket():
+    connections = ConnectionManager()
+    connections.active_connections[1] = [FakeSocket(alive=False)]
+    with pytest.raises(DeliveryError):
+        asyncio.run(connections.send_personal_message({"type": "order_update"}, 1))
+    assert 1 not in connections.active_connections
+    assert connections.send_failures == 1
+
+def test_live_socket_still_gets_the_message():
+    connections = ConnectionManager()
+    dead, live = FakeSocket(alive=False), FakeSocket()
+    connections.active_connections[1] = [dead, live]
+    assert asyncio.run(connections.send_personal_message({"type": "order_update"}, 1)) == 1
+    assert connections.active_connections[1] == [live]
+    assert live.sent == [{"type": "order_update"}]
+
+@pytest.fixture
+def worker(monkeypatch):
+    """A fresh dispatcher position, as in a newly started worker process"""
+    def start():
+        cursor = outbox._Cursor()
+        monkeypatch.setattr(outbox, "_cursor", cursor)
+        asyncio.run(outbox.dispatch_pending())  # starts at the newest event
+        return cursor
+    monkeypatch.setattr(manager, "active_connections", {})
+    return start
+
+def enqueue(db, recipient_id):
+    outbox.enqueue(db, "order_update", {"id": recipient_id}, [recipient_id])
+    db.commit()
+
+def test_every_worker_delivers_to_its_own_sockets(db, worker, monkeypatch):
+    first, second = worker(), worker()
+    enqueue(db, 101)
+
+    # Worker 1 has the customer's socket, worker 2 the partner's one
+    customer, partner = FakeSocket(), FakeSocket()
+    monkeypatch.setattr(outbox, "_cursor", first)
+    manager.active_connections = {101: [customer]}
+    assert asyncio.run(outbox.dispatch_pending()) == 1
+    assert asyncio.run(outbox.dispatch_pending()) == 0
+
+    monkeypatch.setattr(outbox, "_cursor", second)
+    manager.active_connections = {101: [partner]}
+    assert asyncio.run(outbox.dispatch_pending()) == 1
+    assert customer.sent == partner.sent == [{"type": "order_update", "data": {"id": 101}}]
+
+def test_events_committed_behind_the_cursor_are_delivered(db, worker):
+    cursor = worker()
+    enqueue(db, 102)
+    event_id = db.query(OutboxEvent.id).order_by(OutboxEvent.id.desc()).first()[0]
+    # Another transaction took a higher id and was handled first
+    cursor.last_id = event_id + 1
+    socket = FakeSocket()
+    manager.active_connections = {102: [socket]}
+    assert asyncio.run(outbox.dispatch_pending()) == 1
+    assert socket.sent == [{"type": "order_update", "data": {"id": 102}}]
+    assert asyncio.run(outbox.dispatch_pending()) == 0
+
+def test_events_from_before_the_start_are_not_sent(db, worker):
+    enqueue(db, 103)
+    worker()
+    socket = FakeSocket()
+    manager.active_connections = {103: [socket]}
+    assert asyncio.run(outbox.dispatch_pending()) == 0
+    assert socket.sent == []
+
+def test_old_events_are_pruned(db):
+    enqueue(db, 104)
+    event = db.query(OutboxEvent).order_by(OutboxEvent.id.desc()).first()
+    event_id = event.id
+    event.created_at = datetime.utcnow() - outbox.OUTBOX_RETENTION - timedelta(minutes=1)
+    db.commit()
+    outbox._prune()
+    db.expire_all()
+    assert db.get(OutboxEvent, event_id) is None
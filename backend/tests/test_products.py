@@ -0,0 +1,37 @@
+import json
+
+def create(client, world, **fields):
+    response = client.post("/api/partner/products", headers=world.partner_headers, json={"name": "Tea", **fields})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def update(client, world, product_id, **fields):
+    response = client.put(f"/api/partner/products/{product_id}", headers=world.partner_headers, json=fields)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_discount_on_a_plain_price_is_applied_once(client, world):
+    product = create(client, world, price=100)
+    product = update(client, world, product["id"], discount_percent=10)
+    assert (product["price"], product["original_price"]) == (90, 100)
+    # The original price is kept, so a new discount does not compound
+    product = update(client, world, product["id"], discount_percent=20)
+    assert (product["price"], product["original_price"]) == (80, 100)
+    product = update(client, world, product["id"], discount_percent=0)
+    assert product["price"] == 100
+
+def test_new_product_with_price_and_discount(client, world):
+    product = create(client, world, price=50, discount_percent=10)
+    assert (product["price"], product["original_price"]) == (45, 50)
+
+def test_bulk_import_discount_on_a_plain_price(client, world):
+    product = create(client, world, name="Coffee", price=200)
+    response = client.post(
+        "/api/partner/products/bulk",
+        headers={**world.partner_headers, "Content-Type": "application/json"},
+        content=json.dumps([{"id": product["id"], "discount_percent": 25}, {"name": "Juice", "price": 80, "discount_percent": 50}])
+    )
+    assert response.status_code == 200 and response.json()["failed"] == 0, response.text
+    products = {p["name"]: p for p in client.get("/api/partner/products", headers=world.partner_headers).json()}
+    assert (products["Coffee"]["price"], products["Coffee"]["original_price"]) == (150, 200)
+    assert (products["Juice"]["price"], products["Juice"]["original_price"]) == (40, 80)
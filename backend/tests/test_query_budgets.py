@@ -0,0 +1,57 @@
+"""
+SQL statement budgets of the hot endpoints. The list endpoints are measured
+with few and with more rows: a count that grows with the rows is an N+1 query.
+"""
+import pytest
+
+from conftest import place_order
+
+def get(client, url, headers, query_recorder, max_queries):
+    with query_recorder(max_queries=max_queries) as recorder:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.text
+    return recorder
+
+def test_create_order(client, world, query_recorder):
+    # The partner's first order also loads its price table
+    with query_recorder(max_queries=17):
+        place_order(client, world)
+    # Auth, partner, products, the order and its items (one executemany), status
+    # history, rollups, two outbox events (order update, partner load), then the response
+    # with the partner's queue for the ready estimate
+    with query_recorder(max_queries=15) as recorder:
+        place_order(client, world)
+    assert not recorder.repeated(threshold=2)
+
+def test_partner_orders_do_not_grow_with_the_orders(client, world, query_recorder):
+    place_order(client, world)
+    few = get(client, "/api/partner/orders", world.partner_headers, query_recorder, max_queries=6).count
+    for _ in range(5):
+        place_order(client, world)
+    assert get(client, "/api/partner/orders", world.partner_headers, query_recorder, max_queries=6).count == few
+
+def test_customer_orders_do_not_grow_with_the_orders(client, world, query_recorder):
+    place_order(client, world)
+    few = get(client, "/api/customer/orders", world.customer_headers, query_recorder, max_queries=5).count
+    for _ in range(5):
+        place_order(client, world)
+    assert get(client, "/api/customer/orders", world.customer_headers, query_recorder, max_queries=5).count == few
+
+def test_statistics(client, world, query_recorder):
+    place_order(client, world)
+    # Computed from the rollups, then served from stats_cache until the next change
+    get(client, "/api/partner/statistics", world.partner_headers, query_recorder, max_queries=7)
+    get(client, "/api/partner/statistics", world.partner_headers, query_recorder, max_queries=2)
+
+@pytest.mark.parametrize("path", ["/api/customer/partners", "/api/customer/products", "/api/customer/promotions"])
+def test_customer_catalog_lists(client, world, query_recorder, path):
+    url = path if path.endswith("partners") else f"{path}?partner_id={world.partner_id}"
+    # One query to render (and one to check the partner exists when the list is
+    # empty, the world has no promotions), none while the cached body is valid
+    get(client, url, world.customer_headers, query_recorder, max_queries=2)
+    get(client, url, world.customer_headers, query_recorder, max_queries=0)
+
+@pytest.mark.parametrize("path", ["/api/partner/products", "/api/partner/promotions"])
+def test_partner_catalog_lists(client, world, query_recorder, path):
+    # Auth, partner profile, the list
+    get(client, path, world.partner_headers, query_recorder, max_queries=3)
@@ -0,0 +1,12 @@
+import pytest
+from sqlalchemy import text
+
+from database import engine
+from migrate_db import QUERY_PLAN_CHECKS
+
+@pytest.mark.skipif(engine.dialect.name != "sqlite", reason="EXPLAIN QUERY PLAN is SQLite syntax")
+@pytest.mark.parametrize("name, sql, expected_index", QUERY_PLAN_CHECKS, ids=[check[0] for check in QUERY_PLAN_CHECKS])
+def test_hot_path_query_uses_its_index(client, name, sql, expected_index):
+    with engine.connect() as conn:
+        plan = " | ".join(row[3] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+    assert expected_index in plan, f"{name}: expected {expected_index}, got: {plan}"
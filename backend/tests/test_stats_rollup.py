@@ -0,0 +1,29 @@
+import stats_rollup
+from conftest import place_order
+from models import PartnerDailyCustomer, PartnerDailyProductStats, PartnerDailyStats
+
+ROLLUPS = (PartnerDailyStats, PartnerDailyCustomer, PartnerDailyProductStats)
+
+def rollup_rows(db, partner_id):
+    rows = {}
+    for model in ROLLUPS:
+        columns = [c.name for c in model.__table__.columns if c.name != "id"]
+        rows[model.__tablename__] = sorted(
+            tuple(getattr(row, c) for c in columns)
+            for row in db.query(model).filter(model.partner_id == partner_id)
+        )
+    return rows
+
+def test_incremental_rollups_match_a_rebuild(client, world, db):
+    first = place_order(client, world)
+    place_order(client, world, quantity=2)
+    for status in ("in_process", "ready", "completed"):
+        response = client.put(f"/api/partner/orders/{first['id']}", headers=world.partner_headers, json={"status": status})
+        assert response.status_code == 200, response.text
+
+    incremental = rollup_rows(db, world.partner_id)
+    assert incremental["partner_daily_stats"][0][2:] == (2, 1, first["total_amount"], 1)
+    stats_rollup.rebuild(db, world.partner_id)
+    db.flush()
+    assert rollup_rows(db, world.partner_id) == incremental
+    db.rollback()
@@ -0,0 +1,85 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from datetime import datetime
+
+from PIL import Image
+
+import upload_gc
+from models import StoredUpload
+from routers import uploads
+from routers.uploads import UPLOAD_DIR, _register_upload, storage_key
+from storage import storage
+
+OLD = time.time() - 48 * 3600
+
+def stored_file(db, content_hash: str):
+    """An old upload nobody references"""
+    path = storage.local_path(storage_key(f"{content_hash}.png"))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"png")
+    os.utime(path, (OLD, OLD))
+    db.add(StoredUpload(content_hash=content_hash, extension=".png", size=3, last_uploaded_at=datetime(2020, 1, 1)))
+    db.commit()
+    return path
+
+def png_bytes(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def test_reuploaded_content_survives_gc(client, db):
+    reuploaded, abandoned = stored_file(db, "a" * 64), stored_file(db, "b" * 64)
+    # The same bytes uploaded again: deduplicated, the file itself stays old
+    _register_upload(db, "a" * 64, ".png", 3)
+
+    upload_gc.collect_garbage(grace_hours=24, batch_pause=0)
+    assert reuploaded.exists() and not abandoned.exists()
+    db.expire_all()
+    hashes = {row.content_hash for row in db.query(StoredUpload).filter(StoredUpload.content_hash.in_(["a" * 64, "b" * 64]))}
+    assert hashes == {"a" * 64}
+
+def test_upload_deduplicated_while_gc_deletes_the_file(client, world, db, monkeypatch):
+    content = png_bytes("red")
+    content_hash = hashlib.sha256(content).hexdigest()
+    monkeypatch.setattr(uploads, "_schedule_variants", lambda *args, **kwargs: None)
+    response = client.post("/api/uploads/image", headers=world.partner_headers, files={"file": ("a.png", content, "image/png")})
+    assert response.status_code == 200, response.text
+    path = storage.local_path(storage_key(f"{content_hash}.png"))
+    os.utime(path, (OLD, OLD))
+    db.query(StoredUpload).filter(StoredUpload.content_hash == content_hash).update({StoredUpload.last_uploaded_at: datetime(2020, 1, 1)})
+    db.commit()
+
+    # The same image is uploaded again while the GC is between deleting the record and the file
+    results = []
+    def upload_again():
+        results.append(client.post("/api/uploads/image", headers=world.partner_headers, files={"file": ("b.png", content, "image/png")}))
+    uploader = threading.Thread(target=upload_again)
+    delete = storage.delete
+    def delete_during_upload(key):
+        if key == storage_key(f"{content_hash}.png") and not uploader.is_alive() and not results:
+            uploader.start()
+            uploader.join(0.5)  # it sees the record and the file, then waits for the GC transaction
+        delete(key)
+    monkeypatch.setattr(storage, "delete", delete_during_upload)
+
+    upload_gc.collect_garbage(grace_hours=24, batch_pause=0)
+    uploader.join(10)
+    assert results and results[0].status_code == 200, results and results[0].text
+    assert path.exists()
+    db.expire_all()
+    assert db.query(StoredUpload).filter(StoredUpload.content_hash == content_hash).count() == 1
+
+def test_stale_temp_files_are_removed_in_subdirectories(client):
+    stale = UPLOAD_DIR / "ab" / "cd" / ".abc_w320.jpg.part"
+    fresh = UPLOAD_DIR / ".fresh.part"
+    for path in (stale, fresh):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+    os.utime(stale, (OLD, OLD))
+
+    report = upload_gc.collect_garbage(grace_hours=24, batch_pause=0)
+    assert report.temp_files_deleted >= 1
+    assert not stale.exists() and fresh.exists()
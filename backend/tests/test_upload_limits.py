@@ -0,0 +1,43 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from routers.uploads import UploadSizeLimitMiddleware
+
+def make_client(max_body_size: int):
+    app = FastAPI()
+    parsed = []
+
+    @app.post("/api/uploads/image")
+    async def upload(file: UploadFile = File(...)):
+        parsed.append(file.filename)
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadSizeLimitMiddleware, max_body_size=max_body_size)
+    return TestClient(app), parsed
+
+def test_small_upload_passes():
+    client, parsed = make_client(1024)
+    response = client.post("/api/uploads/image", files={"file": ("a.png", b"x" * 100, "image/png")})
+    assert response.status_code == 200 and response.json() == {"size": 100}
+    assert parsed == ["a.png"]
+
+def test_content_length_over_the_cap_is_rejected_before_parsing():
+    client, parsed = make_client(1024)
+    response = client.post("/api/uploads/image", files={"file": ("a.png", b"x" * 4096, "image/png")})
+    assert response.status_code == 413
+    assert parsed == []
+
+def test_streamed_body_without_content_length_is_counted():
+    client, parsed = make_client(1024)
+
+    def chunks():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n\r\n"
+        for _ in range(64):
+            yield b"x" * 64
+        yield b"\r\n--b--\r\n"
+
+    response = client.post(
+        "/api/uploads/image", content=chunks(), headers={"Content-Type": "multipart/form-data; boundary=b"}
+    )
+    assert response.status_code == 413
+    assert parsed == []
@@ -0,0 +1,247 @@
+"""
+Garbage collection of uploaded files nobody references any more.
+
+A file is kept while a Product, Promotion or PartnerImage points at it. Files
+that are unreferenced and outside the grace period (so uploads that are about
+to be attached survive) are deleted together with their resized variants. The
+grace period counts from the last time an upload handed the file out
+(StoredUpload.last_uploaded_at, refreshed by deduplicated uploads too), or from
+the file time for files without a record.
+The store is walked in batches; each batch is re-checked against the database
+right before deleting and the database is only written to in short
+transactions, so the job can run next to normal traffic. The StoredUpload rows
+of a batch are deleted in the same transaction that deletes its files: a
+deduplicated upload of the same content waits for it, then finds the row gone
+and stores the file again.
+
+    python upload_gc.py [--dry-run] [--grace-hours 24]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+from urllib.parse import urlparse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Product, Promotion, PartnerImage, StoredUpload
+from storage import StoredObject, storage
+from query_recorder import mark_background
+from routers.uploads import UPLOAD_DIR, CONTENT_NAME, _known_remote_keys
+
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "24"))
+UPLOAD_GC_BATCH_SIZE = int(os.getenv("UPLOAD_GC_BATCH_SIZE", "500"))
+UPLOAD_GC_BATCH_PAUSE = float(os.getenv("UPLOAD_GC_BATCH_PAUSE", "0.1"))  # seconds between batches
+UPLOAD_GC_INTERVAL = int(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", str(6 * 3600)))  # 0 disables the periodic job
+
+IMAGE_URL_COLUMNS = [Product.image_url, Promotion.image_url, PartnerImage.image_url]
+UPLOADS_PATH = "/api/uploads/"
+# <stem>_w<width>.<fmt> produced by image_variants
+VARIANT_NAME = re.compile(r"^(?P<stem>.+)_w\d+\.(jpg|webp)$")
+
+@dataclass
+class GCReport:
+    scanned: int = 0
+    deleted: int = 0
+    reclaimed_bytes: int = 0
+    kept_recent: int = 0
+    temp_files_deleted: int = 0
+    duration_seconds: float = 0.0
+
+def upload_name(url: Optional[str]) -> Optional[str]:
+    """File name behind an image_url, None for external links"""
+    if not url:
+        return None
+    path = urlparse(url).path
+    if UPLOADS_PATH not in path:
+        return None
+    return path.rsplit("/", 1)[-1] or None
+
+def owner_stem(key: str) -> str:
+    """Stem of the original upload a stored object belongs to (variants share it)"""
+    name = key.rsplit("/", 1)[-1]
+    match = VARIANT_NAME.match(name)
+    if match:
+        return match.group("stem")
+    return Path(name).stem
+
+def referenced_stems(db: Session) -> Set[str]:
+    stems = set()
+    for column in IMAGE_URL_COLUMNS:
+        query = db.query(column).filter(column.isnot(None)).execution_options(yield_per=5000)
+        for (url,) in query:
+            name = upload_name(url)
+            if name:
+                stems.add(Path(name).stem)
+    return stems
+
+def _still_referenced(db: Session, stems: Iterable[str]) -> Set[str]:
+    """Stems from the batch that got attached after the reference set was built"""
+    stems = list(stems)
+    found = set()
+    for column in IMAGE_URL_COLUMNS:
+        conditions = [column.like(f"%{UPLOADS_PATH}{stem}.%") for stem in stems]
+        for chunk_start in range(0, len(conditions), 100):
+            chunk = conditions[chunk_start:chunk_start + 100]
+            for (url,) in db.query(column).filter(column.isnot(None)).filter(or_(*chunk)):
+                name = upload_name(url)
+                if name:
+                    found.add(Path(name).stem)
+    return found
+
+def _batches(objects: Iterable[StoredObject], size: int) -> Iterable[List[StoredObject]]:
+    iterator = iter(objects)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _timestamp(moment: datetime) -> float:
+    """Database timestamps are UTC, naive on SQLite"""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def _collect_batch(batch: List[StoredObject], referenced: Set[str], cutoff: float, report: GCReport, dry_run: bool):
+    candidates = []
+    for stored_object in batch:
+        report.scanned += 1
+        if owner_stem(stored_object.key) in referenced:
+            continue
+        candidates.append(stored_object)
+    if not candidates:
+        return
+
+    cutoff_at = datetime.fromtimestamp(cutoff, timezone.utc)
+    db = SessionLocal()
+    try:
+        # Re-check right before deleting: the reference set may be minutes old
+        stems = {owner_stem(o.key) for o in candidates}
+        attached = _still_referenced(db, stems)
+        referenced.update(attached)
+        uploaded_at = {
+            content_hash: _timestamp(last_uploaded_at)
+            for content_hash, last_uploaded_at in db.query(StoredUpload.content_hash, StoredUpload.last_uploaded_at).filter(
+                StoredUpload.content_hash.in_(stems - attached)
+            )
+            if last_uploaded_at is not None
+        }
+        expired = []
+        for stored_object in candidates:
+            stem = owner_stem(stored_object.key)
+            if stem in attached:
+                continue
+            if stored_object.modified_at > cutoff or uploaded_at.get(stem, 0) > cutoff:
+                report.kept_recent += 1
+                continue
+            expired.append(stored_object)
+        candidates = expired
+        if dry_run:
+            report.deleted += len(candidates)
+            report.reclaimed_bytes += sum(o.size for o in candidates)
+            return
+
+        # Only records still outside the grace period go: an upload may have just refreshed one.
+        # The deleted rows stay locked until the files are gone and the transaction commits.
+        hashes = {Path(o.key).stem for o in candidates if CONTENT_NAME.match(o.key.rsplit("/", 1)[-1])}
+        if hashes:
+            db.query(StoredUpload).filter(
+                StoredUpload.content_hash.in_(hashes),
+                StoredUpload.last_uploaded_at <= cutoff_at
+            ).delete(synchronize_session=False)
+            refreshed = {row.content_hash for row in db.query(StoredUpload.content_hash).filter(StoredUpload.content_hash.in_(hashes))}
+            report.kept_recent += sum(1 for o in candidates if owner_stem(o.key) in refreshed)
+            candidates = [o for o in candidates if owner_stem(o.key) not in refreshed]
+        _delete_objects(candidates, report)
+        db.commit()
+    finally:
+        db.close()
+
+def _delete_objects(objects: List[StoredObject], report: GCReport):
+    for stored_object in objects:
+        try:
+            storage.delete(stored_object.key)
+        except Exception as e:
+            logging.error(f"Upload GC could not delete {stored_object.key}: {e}")
+            continue
+        _known_remote_keys.discard(stored_object.key)
+        report.deleted += 1
+        report.reclaimed_bytes += stored_object.size
+
+def _remove_stale_temp_files(cutoff: float, report: GCReport, dry_run: bool):
+    """Leftovers of uploads interrupted by a crash or restart, also in the variant directories"""
+    for path in UPLOAD_DIR.rglob(".*.part"):
+        try:
+            st = path.stat()
+            if not path.is_file() or st.st_mtime > cutoff:
+                continue
+            if not dry_run:
+                path.unlink()
+        except FileNotFoundError:
+            continue
+        report.temp_files_deleted += 1
+        report.reclaimed_bytes += st.st_size
+
+def collect_garbage(
+    grace_hours: float = UPLOAD_GC_GRACE_HOURS,
+    batch_size: int = UPLOAD_GC_BATCH_SIZE,
+    batch_pause: float = UPLOAD_GC_BATCH_PAUSE,
+    dry_run: bool = False,
+) -> GCReport:
+    started = time.monotonic()
+    report = GCReport()
+    cutoff = time.time() - grace_hours * 3600
+
+    db = SessionLocal()
+    try:
+        referenced = referenced_stems(db)
+    finally:
+        db.close()
+
+    for batch in _batches(storage.iter_objects(), batch_size):
+        _collect_batch(batch, referenced, cutoff, report, dry_run)
+        if batch_pause:
+            time.sleep(batch_pause)
+
+    _remove_stale_temp_files(cutoff, report, dry_run)
+
+    report.duration_seconds = round(time.monotonic() - started, 3)
+    logging.info(
+        f"Upload GC: scanned {report.scanned}, deleted {report.deleted}, "
+        f"reclaimed {report.reclaimed_bytes} bytes{' (dry run)' if dry_run else ''}"
+    )
+    return report
+
+async def run_periodic():
+    """Background loop started by the application; the first run waits one interval"""
+    mark_background()
+    while True:
+        await asyncio.sleep(UPLOAD_GC_INTERVAL)
+        try:
+            await run_in_threadpool(collect_garbage)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Upload GC error: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete uploaded files that are no longer referenced")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    parser.add_argument("--grace-hours", type=float, default=UPLOAD_GC_GRACE_HOURS)
+    parser.add_argument("--batch-size", type=int, default=UPLOAD_GC_BATCH_SIZE)
+    args = parser.parse_args()
+    report = collect_garbage(args.grace_hours, args.batch_size, dry_run=args.dry_run)
+    print(json.dumps(asdict(report), indent=2))
+
+if __name__ == "__main__":
+    main()
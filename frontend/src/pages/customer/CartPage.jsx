@@ -10,12 +10,44 @@ function CartPage() {
   const { cart, removeFromCart, updateQuantity, clearCart, getTotal } = useCart()
   const [orderPlaced, setOrderPlaced] = useState(null)
   const [partners, setPartners] = useState({})
+  const [quote, setQuote] = useState(null)
   const navigate = useNavigate()
 
   useEffect(() => {
     fetchPartners()
   }, [])
 
+  useEffect(() => {
+    fetchQuote()
+  }, [cart])
+
+  // Цены с учетом скидок и акций считает сервер, одним запросом на всю корзину
+  const fetchQuote = async () => {
+    if (cart.length === 0) {
+      setQuote(null)
+      return
+    }
+    try {
+      const response = await api.post('/api/customer/cart/quote', {
+        items: cart.map(item => ({
+          partner_id: item.partnerId,
+          product_id: item.product.id,
+          quantity: item.quantity
+        }))
+      })
+      setQuote(response.data)
+    } catch (error) {
+      console.error('Error fetching cart quote:', error)
+      setQuote(null)
+    }
+  }
+
+  const unitPrice = (partnerId, productId, fallback) => {
+    const partnerQuote = quote?.partners.find(p => p.partner_id === Number(partnerId))
+    const line = partnerQuote?.items.find(l => l.product_id === productId)
+    return line ? line.unit_price : fallback
+  }
+
   const fetchPartners = async () => {
     try {
       const response = await api.get('/api/customer/partners')
@@ -43,8 +75,7 @@ function CartPage() {
       }
       ordersByPartner[item.partnerId].push({
         product_id: item.product.id,
-        quantity: item.quantity,
-        price: item.product.price
+        quantity: item.quantity
       })
     })
 
@@ -120,7 +151,7 @@ function CartPage() {
               <div className="cart-item-info">
                 <h3>{item.product.name}</h3>
                 <p>{item.product.description}</p>
-                <span className="price">{item.product.price} ₽</span>
+                <span className="price">{unitPrice(item.partnerId, item.product.id, item.product.price)} ₽</span>
               </div>
               <div className="cart-item-controls">
                 <button onClick={async () => {
@@ -149,7 +180,7 @@ function CartPage() {
         </div>
       ))}
       <div className="cart-summary">
-        <h2>Итого: {getTotal()} ₽</h2>
+        <h2>Итого: {quote ? quote.total : getTotal()} ₽</h2>
         <button onClick={handleCheckout} className="btn btn-primary btn-large">
           Оформить заказ
         </button>
@@ -1,5 +1,5 @@
-import React, { useState, useEffect, useRef } from 'react'
-import { MapContainer, TileLayer, Marker, Popup, useMap } from 'react-leaflet'
+import React, { useState, useEffect, useCallback } from 'react'
+import { MapContainer, TileLayer, Marker, Popup, useMap, useMapEvents } from 'react-leaflet'
 import { useSearchParams } from 'react-router-dom'
 import api, { getImageUrl } from '../../api/api'
 import 'leaflet/dist/leaflet.css'
@@ -23,67 +23,107 @@ L.Icon.Default.mergeOptions({
   shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/images/marker-shadow.png',
 })
 
+const clusterIcon = (count) => L.divIcon({
+  html: `<span>${count}</span>`,
+  className: 'cluster-marker',
+  iconSize: [40, 40]
+})
+
+// Loads the clustered partners of the visible area after every move or zoom
+function ClusterLayer({ onSelect }) {
+  const map = useMap()
+  const [clusters, setClusters] = useState([])
+
+  const fetchClusters = useCallback(async () => {
+    const bounds = map.getBounds()
+    try {
+      const response = await api.get('/api/customer/map/clusters', {
+        params: {
+          south: Math.max(bounds.getSouth(), -90),
+          west: Math.max(bounds.getWest(), -180),
+          north: Math.min(bounds.getNorth(), 90),
+          east: Math.min(bounds.getEast(), 180),
+          zoom: map.getZoom()
+        }
+      })
+      setClusters(response.data.clusters)
+    } catch (error) {
+      console.error('Error fetching map clusters:', error)
+    }
+  }, [map])
+
+  useEffect(() => {
+    fetchClusters()
+  }, [fetchClusters])
+
+  useMapEvents({ moveend: fetchClusters })
+
+  return clusters.map(cluster => (
+    cluster.count > 1 ? (
+      <Marker
+        key={`${cluster.latitude}-${cluster.longitude}`}
+        position={[cluster.latitude, cluster.longitude]}
+        icon={clusterIcon(cluster.count)}
+        eventHandlers={{
+          click: () => map.setView([cluster.latitude, cluster.longitude], map.getZoom() + 2)
+        }}
+      />
+    ) : (
+      <Marker
+        key={cluster.partner_ids[0]}
+        position={[cluster.latitude, cluster.longitude]}
+        eventHandlers={{
+          click: () => onSelect(cluster.partner_ids[0])
+        }}
+      />
+    )
+  ))
+}
+
 function MapPage() {
   const [searchParams] = useSearchParams()
-  const [partners, setPartners] = useState([])
   const [selectedPartner, setSelectedPartner] = useState(null)
   const [promotions, setPromotions] = useState({})
   const [partnerImages, setPartnerImages] = useState({})
   const [mapCenter, setMapCenter] = useState([55.0084, 82.9357])
   const [mapZoom, setMapZoom] = useState(12)
 
-  useEffect(() => {
-    fetchPartners()
-  }, [])
-
   useEffect(() => {
     // Check if partner ID is in URL params
     const partnerId = searchParams.get('partner')
-    if (partnerId && partners.length > 0) {
-      const partner = partners.find(p => p.id === parseInt(partnerId))
-      if (partner) {
-        setSelectedPartner(partner)
-        setMapCenter([partner.latitude, partner.longitude])
-        setMapZoom(15)
-      }
+    if (partnerId) {
+      selectPartner(parseInt(partnerId))
     }
-  }, [searchParams, partners])
+  }, [searchParams])
 
-  const fetchPartners = async () => {
+  // Details, promotions and images are loaded only for the partner the user opens
+  const selectPartner = async (partnerId) => {
     try {
-      const response = await api.get('/api/customer/partners')
-      setPartners(response.data)
-      
-      // Fetch promotions and images for each partner
-      const imagePromises = response.data.map(async (partner) => {
-        try {
-          const promoResponse = await api.get(`/api/customer/promotions?partner_id=${partner.id}`)
-          setPromotions(prev => ({ ...prev, [partner.id]: promoResponse.data }))
-        } catch (error) {
-          console.error(`Error fetching promotions for partner ${partner.id}:`, error)
-        }
-        
-        try {
-          const imagesResponse = await api.get(`/api/customer/partners/${partner.id}/images`)
-          console.log(`Fetched ${imagesResponse.data.length} images for partner ${partner.id}:`, imagesResponse.data)
-          if (imagesResponse.data && imagesResponse.data.length > 0) {
-            setPartnerImages(prev => ({ ...prev, [partner.id]: imagesResponse.data }))
-          }
-        } catch (error) {
-          console.error(`Error fetching images for partner ${partner.id}:`, error)
-        }
-      })
-      
-      await Promise.all(imagePromises)
+      const response = await api.get(`/api/customer/partners/${partnerId}`)
+      const partner = response.data
+      setSelectedPartner(partner)
+      setMapCenter([partner.latitude, partner.longitude])
+      setMapZoom(15)
     } catch (error) {
-      console.error('Error fetching partners:', error)
+      console.error(`Error fetching partner ${partnerId}:`, error)
+      return
+    }
+
+    try {
+      const promoResponse = await api.get(`/api/customer/promotions?partner_id=${partnerId}`)
+      setPromotions(prev => ({ ...prev, [partnerId]: promoResponse.data }))
+    } catch (error) {
+      console.error(`Error fetching promotions for partner ${partnerId}:`, error)
     }
-  }
 
-  const handleMarkerClick = (partner) => {
-    setSelectedPartner(partner)
-    setMapCenter([partner.latitude, partner.longitude])
-    setMapZoom(15)
+    try {
+      const imagesResponse = await api.get(`/api/customer/partners/${partnerId}/images`)
+      if (imagesResponse.data && imagesResponse.data.length > 0) {
+        setPartnerImages(prev => ({ ...prev, [partnerId]: imagesResponse.data }))
+      }
+    } catch (error) {
+      console.error(`Error fetching images for partner ${partnerId}:`, error)
+    }
   }
 
   return (
@@ -101,26 +141,21 @@ function MapPage() {
             url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
             attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
           />
-          {partners.map(partner => (
-            <Marker
-              key={partner.id}
-              position={[partner.latitude, partner.longitude]}
-              eventHandlers={{
-                click: () => handleMarkerClick(partner)
-              }}
-            >
+          <ClusterLayer onSelect={selectPartner} />
+          {selectedPartner && (
+            <Marker position={[selectedPartner.latitude, selectedPartner.longitude]}>
               <Popup>
                 <div className="marker-popup">
-                  <h3>{partner.name}</h3>
-                  {partner.address && <p className="address"><strong>Адрес:</strong> {partner.address}</p>}
-                  {partner.description && <p>{partner.description}</p>}
-                  {partnerImages[partner.id] && partnerImages[partner.id].length > 0 ? (
+                  <h3>{selectedPartner.name}</h3>
+                  {selectedPartner.address && <p className="address"><strong>Адрес:</strong> {selectedPartner.address}</p>}
+                  {selectedPartner.description && <p>{selectedPartner.description}</p>}
+                  {partnerImages[selectedPartner.id] && partnerImages[selectedPartner.id].length > 0 ? (
                     <div className="popup-images">
-                      {partnerImages[partner.id].slice(0, 2).map(image => (
+                      {partnerImages[selectedPartner.id].slice(0, 2).map(image => (
                         <img 
                           key={image.id} 
                           src={getImageUrl(image.image_url)} 
-                          alt={`${partner.name} фото`}
+                          alt={`${selectedPartner.name} фото`}
                           className="popup-image"
                           onError={(e) => {
                             console.error('Error loading popup image:', image.image_url)
@@ -133,7 +168,7 @@ function MapPage() {
                 </div>
               </Popup>
             </Marker>
-          ))}
+          )}
         </MapContainer>
       </div>
       